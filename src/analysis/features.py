@@ -0,0 +1,196 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from src.analysis.preprocessing import CalibrationCache, Preprocessor
+from src.storage.cube import CubeReader
+
+
+@dataclass
+class SampleFeatures:
+    """1サンプル分の粒子ごとの特徴量"""
+    sample_name: str
+    excitations: list
+    emissions: list
+    areas: np.ndarray = field(default_factory=lambda: np.zeros(0))         # (粒子数,) 画素数
+    centroids: np.ndarray = field(default_factory=lambda: np.zeros((0, 2)))  # (粒子数, 2) 行, 列
+    fingerprints: np.ndarray = field(default_factory=lambda: np.zeros((0, 0, 0)))  # (粒子数, 励起, 放射)
+
+    @property
+    def num_particles(self):
+        return len(self.areas)
+
+    def normalized_fingerprints(self):
+        """明るさの違いを除いた励起・放射スペクトルの形（各粒子の合計が1）"""
+        totals = self.fingerprints.sum(axis=(1, 2), keepdims=True)
+        return np.divide(self.fingerprints, totals, out=np.zeros_like(self.fingerprints), where=totals > 0)
+
+
+# 自動しきい値に求める、背景からの距離（背景ノイズの標準偏差の何倍か）
+MIN_CONTRAST = 5.0
+
+
+def otsu_threshold(image, bins=256):
+    """大津の方法で2値化のしきい値を求める（ヒストグラムの累積和で一括計算）"""
+    hist, edges = np.histogram(image, bins=bins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    sum_bg = np.cumsum(hist * centers)
+    mean_bg = np.divide(sum_bg, weight_bg, out=np.zeros_like(sum_bg), where=weight_bg > 0)
+    mean_fg = np.divide(sum_bg[-1] - sum_bg, weight_fg, out=np.zeros_like(sum_bg), where=weight_fg > 0)
+    variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return float(centers[np.argmax(variance)])
+
+
+def label_components(mask):
+    """
+    4近傍で連結した前景領域に 1, 2, ... の番号を付ける（背景は0）。
+    各画素の番号を近傍の最小値で置き換える処理を、変化がなくなるまで配列全体で繰り返す。
+    """
+    height, width = mask.shape
+    big = np.iinfo(np.int64).max
+    labels = np.where(mask, np.arange(height * width, dtype=np.int64).reshape(height, width), big)
+    while True:
+        updated = labels.copy()
+        np.minimum(updated[1:, :], labels[:-1, :], out=updated[1:, :])
+        np.minimum(updated[:-1, :], labels[1:, :], out=updated[:-1, :])
+        np.minimum(updated[:, 1:], labels[:, :-1], out=updated[:, 1:])
+        np.minimum(updated[:, :-1], labels[:, 1:], out=updated[:, :-1])
+        updated[~mask] = big
+        # 番号の参照先をたどって一気に伝播させ、繰り返し回数を減らす
+        flat = updated.ravel()
+        fg = flat != big
+        flat[fg] = flat[flat[fg]]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    result = np.zeros(mask.shape, dtype=np.int32)
+    if mask.any():
+        _, inverse = np.unique(labels[mask], return_inverse=True)
+        result[mask] = inverse + 1
+    return result
+
+
+def background_noise(image):
+    """背景の明るさ（中央値）と、中央値絶対偏差から推定したノイズの標準偏差"""
+    background = float(np.median(image))
+    return background, 1.4826 * float(np.median(np.abs(image - background)))
+
+
+def segment_particles(image, threshold=None, min_area=4, min_contrast=MIN_CONTRAST):
+    """
+    画像から粒子を切り出し、番号付きの画像を返す。min_area未満の小さな領域は除く。
+    大津の方法は粒子がなくても必ず2つに分けるため、自動しきい値は背景から
+    ノイズの min_contrast 倍以上上に取る（粒子のない画像では何も残らない）。
+    """
+    if threshold is None:
+        background, noise = background_noise(image)
+        threshold = max(otsu_threshold(image), background + min_contrast * noise)
+    labels = label_components(image > threshold)
+    areas = np.bincount(labels.ravel())
+    small = areas < min_area
+    small[0] = False
+    if small.any():
+        labels[small[labels]] = 0
+        _, inverse = np.unique(labels, return_inverse=True)
+        labels = inverse.reshape(labels.shape).astype(np.int32)
+    return labels
+
+
+def particle_fingerprints(cube, labels):
+    """
+    励起×放射×H×W のキューブから、粒子ごとの平均輝度 (粒子数, 励起, 放射) を求める。
+    バンドごとに bincount で全粒子を一度に集計する。
+    """
+    num_particles = int(labels.max())
+    n_ex, n_em = cube.shape[:2]
+    flat_labels = labels.ravel()
+    counts = np.bincount(flat_labels, minlength=num_particles + 1)[1:].astype(np.float64)
+    fingerprints = np.zeros((num_particles, n_ex, n_em), dtype=np.float64)
+    for ex in range(n_ex):
+        for em in range(n_em):
+            sums = np.bincount(flat_labels, weights=cube[ex, em].ravel(), minlength=num_particles + 1)[1:]
+            fingerprints[:, ex, em] = sums / np.maximum(counts, 1)
+    return fingerprints
+
+
+def extract_features(cube, sample_name="", excitations=None, emissions=None, threshold=None, min_area=4):
+    """キューブから粒子を切り出し、面積・重心・励起放射フィンガープリントを求める"""
+    cube = np.asarray(cube, dtype=np.float32)
+    n_ex, n_em, height, width = cube.shape
+    # 全バンドの最大値で粒子を探す（どの組み合わせでも光る粒子を拾うため）
+    projection = cube.reshape(n_ex * n_em, height, width).max(axis=0)
+    labels = segment_particles(projection, threshold=threshold, min_area=min_area)
+
+    num_particles = int(labels.max())
+    flat_labels = labels.ravel()
+    areas = np.bincount(flat_labels, minlength=num_particles + 1)[1:]
+    rows, cols = np.indices((height, width))
+    safe_areas = np.maximum(areas, 1)
+    centroids = np.stack([
+        np.bincount(flat_labels, weights=rows.ravel(), minlength=num_particles + 1)[1:] / safe_areas,
+        np.bincount(flat_labels, weights=cols.ravel(), minlength=num_particles + 1)[1:] / safe_areas,
+    ], axis=1)
+
+    return SampleFeatures(
+        sample_name=sample_name,
+        excitations=list(excitations or range(n_ex)),
+        emissions=list(emissions or range(n_em)),
+        areas=areas,
+        centroids=centroids,
+        fingerprints=particle_fingerprints(cube, labels),
+    )
+
+
+def analyze_cube_file(path, calibration_path=None, threshold=None, min_area=4):
+    """
+    キューブファイル1つを解析する。プロセスプールから呼ばれるため、
+    大きな配列は受け渡さず、各プロセスがファイルを直接メモリマップで読む。
+    """
+    path = Path(path)
+    with CubeReader(path) as reader:
+        cube = np.zeros(reader.shape, dtype=np.float32)
+        preprocessor = None
+        if calibration_path is not None:
+            preprocessor = Preprocessor(CalibrationCache.load(calibration_path))
+        for ex_label, em_label in reader.available():
+            ex, em = reader.excitations.index(ex_label), reader.emissions.index(em_label)
+            band = reader.band(ex, em)
+            if preprocessor is None:
+                cube[ex, em] = band
+            else:
+                metadata = reader.band_metadata(ex, em)
+                preprocessor.process_frame(band, metadata["exposure_ms"], metadata.get("filter_position"),
+                                           out=cube[ex, em])
+        sample_name = reader.metadata.get("sample_name", path.stem)
+        excitations, emissions = reader.excitations, reader.emissions
+    return extract_features(cube, sample_name, excitations, emissions, threshold=threshold, min_area=min_area)
+
+
+def analyze_samples(paths, calibration_path=None, max_workers=None, threshold=None, min_area=4):
+    """
+    複数のキューブファイルをプロセスプールで並列に解析し、入力と同じ順番で結果を返す。
+    max_workers=1 の場合はプロセスを使わずにその場で処理する。
+    """
+    paths = [Path(p) for p in paths]
+    if max_workers is None:
+        max_workers = min(len(paths), os.cpu_count() or 1)
+    if max_workers <= 1 or len(paths) <= 1:
+        return [analyze_cube_file(p, calibration_path, threshold, min_area) for p in paths]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(analyze_cube_file, p, calibration_path, threshold, min_area) for p in paths]
+        return [f.result() for f in futures]
+
+
+def analyze_catalog(catalog, name_like=None, sample_type=None, calibration_path=None, max_workers=None,
+                    threshold=None, min_area=4):
+    """
+    索引 (src.storage.catalog.Catalog) で条件に合うサンプルを探して解析する。
+    保存先のディレクトリを走査せずに、名前（部分一致）や試料の種類で対象を絞り込める。
+    """
+    paths = catalog.sample_paths(name_like=name_like, sample_type=sample_type)
+    return analyze_samples(paths, calibration_path, max_workers, threshold, min_area)
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+
+import numpy as np
+
+# 推定したダークを保持する数。自動露光ではバンドごとに露光時間が違うため、最近使ったものだけを残す
+MAX_DERIVED_DARKS = 8
+
+
+class CalibrationCache:
+    """
+    ダークフレーム（露光時間ごと）とフラットフィールド（フィルターごと）を保持する。
+    補正に使う形（float32のダーク、正規化したフラットの逆数）に一度だけ変換して使い回す。
+    """
+
+    def __init__(self, max_derived_darks=MAX_DERIVED_DARKS):
+        self._darks = {}      # 露光時間(ms) -> float32 のダークフレーム
+        self._inv_flats = {}  # フィルター -> 平均1に正規化したフラットの逆数
+        self._derived_darks = OrderedDict()  # 推定したダーク（古く使ったものから捨てる）
+        self.max_derived_darks = max_derived_darks
+
+    def add_dark(self, exposure_ms, frames):
+        """同じ露光時間で撮影したダークフレーム（1枚または複数枚）を登録する"""
+        frames = np.asarray(frames)
+        dark = frames.mean(axis=0, dtype=np.float32) if frames.ndim == 3 else frames.astype(np.float32)
+        self._darks[float(exposure_ms)] = dark
+        self._derived_darks.clear()
+
+    def add_flat(self, filter_key, frames, exposure_ms):
+        """一様な光源を撮影したフラットフレームを登録する。ダークはこの時点で差し引く"""
+        frames = np.asarray(frames)
+        flat = frames.mean(axis=0, dtype=np.float32) if frames.ndim == 3 else frames.astype(np.float32)
+        flat -= self.dark(exposure_ms)
+        mean = float(flat.mean())
+        if mean <= 0:
+            raise ValueError(f"フラットフレームの信号がありません（フィルター: {filter_key}）。")
+        flat /= mean
+        # 信号のない画素で割り算が発散しないよう、極端に暗い画素は補正しない
+        inv_flat = np.ones_like(flat)
+        np.divide(1.0, flat, out=inv_flat, where=flat > 0.05)
+        self._inv_flats[filter_key] = inv_flat
+
+    @property
+    def dark_exposures(self):
+        return sorted(self._darks)
+
+    def dark(self, exposure_ms):
+        """
+        露光時間に対応するダークを返す。登録がない場合は、近い2つの露光時間から
+        ダーク = バイアス + 暗電流 × 露光時間 として線形に推定し、結果を max_derived_darks 件までキャッシュする。
+        """
+        exposure_ms = float(exposure_ms)
+        if exposure_ms in self._darks:
+            return self._darks[exposure_ms]
+        if exposure_ms in self._derived_darks:
+            self._derived_darks.move_to_end(exposure_ms)
+            return self._derived_darks[exposure_ms]
+        exposures = self.dark_exposures
+        if not exposures:
+            raise KeyError("ダークフレームが登録されていません。")
+        if len(exposures) == 1:
+            dark = self._darks[exposures[0]]
+        else:
+            nearest = sorted(exposures, key=lambda e: abs(e - exposure_ms))[:2]
+            e0, e1 = sorted(nearest)
+            weight = (exposure_ms - e0) / (e1 - e0)
+            dark = self._darks[e0] + (self._darks[e1] - self._darks[e0]) * np.float32(weight)
+        self._derived_darks[exposure_ms] = dark
+        while len(self._derived_darks) > self.max_derived_darks:
+            self._derived_darks.popitem(last=False)
+        return dark
+
+    def inverse_flat(self, filter_key):
+        """フラットの逆数を返す。未登録のフィルターはNone（フラット補正なし）"""
+        return self._inv_flats.get(filter_key)
+
+    def save(self, path):
+        """キャッシュを .npz に保存する"""
+        arrays = {}
+        for exposure, dark in self._darks.items():
+            arrays[f"dark|{exposure!r}"] = dark
+        for key, inv_flat in self._inv_flats.items():
+            arrays[f"flat|{key}"] = inv_flat
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        cache = cls()
+        with np.load(path) as data:
+            for name in data.files:
+                kind, key = name.split("|", 1)
+                if kind == "dark":
+                    cache._darks[float(key)] = data[name]
+                else:
+                    cache._inv_flats[int(key) if key.isdigit() else key] = data[name]
+        return cache
+
+
+class Preprocessor:
+    """
+    ダーク減算・フラット補正・露光時間による正規化をまとめて行う。
+    出力は float32 の「1msあたりのカウント」で、露光時間の違うバンド同士を比較できる。
+    演算はすべて出力配列上でその場で行い、中間配列を作らない。
+    """
+
+    def __init__(self, calibration, clip_negative=True):
+        self.calibration = calibration
+        self.clip_negative = clip_negative
+
+    def process_frame(self, frame, exposure_ms, filter_key=None, out=None):
+        if out is None:
+            out = np.empty(frame.shape, dtype=np.float32)
+        np.subtract(frame, self.calibration.dark(exposure_ms), out=out, casting="unsafe")
+        inv_flat = self.calibration.inverse_flat(filter_key)
+        if inv_flat is not None:
+            np.multiply(out, inv_flat, out=out)
+        np.multiply(out, np.float32(1.0 / exposure_ms), out=out)
+        if self.clip_negative:
+            np.maximum(out, 0, out=out)
+        return out
+
+    def process_stack(self, stack, exposures, filter_keys, out=None):
+        """
+        (N, H, W) の画像スタックを一括で補正する。
+        exposures と filter_keys は1枚ごとの値のリスト（または全画像共通の1つの値）。
+        """
+        stack = np.asarray(stack)
+        count = stack.shape[0]
+        exposures = _per_frame(exposures, count)
+        filter_keys = _per_frame(filter_keys, count)
+        if out is None:
+            out = np.empty(stack.shape, dtype=np.float32)
+        for i in range(count):
+            self.process_frame(stack[i], exposures[i], filter_keys[i], out=out[i])
+        return out
+
+
+def _per_frame(values, count):
+    if isinstance(values, (list, tuple, np.ndarray)):
+        if len(values) != count:
+            raise ValueError(f"値の数 ({len(values)}) が画像の枚数 ({count}) と一致しません。")
+        return list(values)
+    return [values] * count
@@ -0,0 +1,263 @@
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from src.utils.tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+tracer = get_tracer()
+
+
+class AcquisitionError(Exception):
+    """自動撮影シーケンスを続行できない場合に送出される"""
+
+
+@dataclass
+class StepTiming:
+    """1ステップ分の各工程の所要時間（秒）"""
+    index: int
+    led: str
+    filter: str
+    move: float = 0.0     # フィルターホイールの移動
+    led_switch: float = 0.0  # 励起LEDの切り替え（移動と並行して実行）
+    prepare: float = 0.0  # 移動とLED切り替えの両方が終わるまで
+    capture: float = 0.0  # 露光と画像の取得
+    save: float = 0.0     # 保存（次のステップと並行して実行）
+    captures: int = 1     # 自動露光の試し撮りを含めた撮影枚数
+
+
+@dataclass
+class AcquisitionReport:
+    sample_name: str
+    timings: list = field(default_factory=list)
+    wall_time: float = 0.0
+    cancelled: bool = False
+
+    @property
+    def frames(self):
+        return len(self.timings)
+
+    @property
+    def frames_per_minute(self):
+        return 60.0 * self.frames / self.wall_time if self.wall_time > 0 else 0.0
+
+    def stage_totals(self):
+        """工程ごとの合計時間。保存時間は並行処理のためwall_timeには加算されない"""
+        stages = ("move", "led_switch", "prepare", "capture", "save")
+        return {stage: sum(getattr(t, stage) for t in self.timings) for stage in stages}
+
+    @property
+    def extra_captures(self):
+        """自動露光で余分に撮った試し撮りの枚数"""
+        return sum(t.captures - 1 for t in self.timings)
+
+    def summary(self):
+        totals = self.stage_totals()
+        text = (
+            f"{self.frames}枚 / {self.wall_time:.1f}秒 ({self.frames_per_minute:.1f}枚/分) "
+            f"移動 {totals['move']:.1f}秒, 撮影 {totals['capture']:.1f}秒, 保存 {totals['save']:.1f}秒"
+        )
+        if self.extra_captures:
+            text += f", 試し撮り {self.extra_captures}枚"
+        return text
+
+
+class NpyFrameWriter:
+    """1枚ごとに .npy 画像と撮影条件の .json メタデータを保存する"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def write(self, sample_name, index, step, frame, metadata):
+        sample_dir = self.directory / sample_name
+        sample_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{index:03d}_ex{step.led}_em{step.filter}"
+        np.save(sample_dir / f"{stem}.npy", frame)
+        with open(sample_dir / f"{stem}.json", "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        return sample_dir / f"{stem}.npy"
+
+    def close(self):
+        pass
+
+
+class AcquisitionEngine:
+    """
+    「励起側操作 → 放射側フィルター移動 → カメラ撮影」のループ（仕様書3.4）をパイプラインで実行する。
+    N枚目の保存は専用スレッドで行い、その間に N+1枚目のフィルター移動と撮影を進める。
+    LEDの切り替えはフィルター移動と並行して行うため、移動が終わった時点で次の露光を始められる。
+
+    各ドライバに必要なメソッド:
+      filter_changer.move_to(slot) -> bool
+      excitation.select(led) -> bool, excitation.off()
+      excitation.upload_schedule(leds) -> bool（任意。撮影前に点灯順をまとめて渡す）
+      camera.capture(exposure_ms) -> numpy配列
+      writer.write(sample_name, index, step, frame, metadata) -> 保存先, writer.close()
+
+    journal (AcquisitionJournal) を渡すと、計画と保存が終わったステップを記録し、中断しても再開できるようにする。
+    auto_exposure (AutoExposure) を渡すと、露光時間が None のステップは試し撮りで露光時間を決める。
+    """
+
+    def __init__(self, filter_changer, camera, excitation, writer, on_step=None, save_queue_size=4, journal=None,
+                 auto_exposure=None):
+        self.filter_changer = filter_changer
+        self.camera = camera
+        self.excitation = excitation
+        self.writer = writer
+        # on_step(StepTiming) 撮影が1枚終わるごとに呼ばれる（撮影スレッド上）
+        self.on_step = on_step
+        self.save_queue_size = save_queue_size
+        self.journal = journal
+        self.auto_exposure = auto_exposure
+
+    def run(self, steps, exposure_ms, sample_name, cancel_event=None, completed=None, sample_type=None):
+        """
+        steps (SequenceStepのリスト) を順に撮影し、AcquisitionReportを返す。
+        exposure_ms は全ステップ共通の値、またはステップごとの値のリスト（Noneは自動露光）。
+        completed には再開時に飛ばす保存済みのステップ {番号: 保存先} を渡す。
+        sample_type は自動露光のキャッシュを引くときの試料の種類。
+        """
+        if isinstance(exposure_ms, (list, tuple)) and len(exposure_ms) != len(steps):
+            raise ValueError("露光時間のリストはステップと同じ数にしてください。")
+        exposures = list(exposure_ms) if isinstance(exposure_ms, (list, tuple)) else [exposure_ms] * len(steps)
+        completed = dict(completed or {})
+        pending = [index for index in range(len(steps)) if index not in completed]
+        if self.auto_exposure is None and any(exposures[i] is None for i in pending):
+            raise ValueError("自動露光のステップを撮影するには auto_exposure を指定してください。")
+        # 点灯順を先に光源へ渡しておき、各ステップでの切り替えを短くする
+        upload_schedule = getattr(self.excitation, "upload_schedule", None)
+        if upload_schedule is not None and pending and not upload_schedule([steps[i].led for i in pending]):
+            raise AcquisitionError("励起光源に点灯順を送れませんでした。")
+        if self.journal is not None:
+            path_for = getattr(self.writer, "path_for", None)
+            self.journal.begin(sample_name, steps, exposures, path_for(sample_name) if path_for else None, completed)
+        report = AcquisitionReport(sample_name)
+        # 保存待ちの枚数を制限し、保存が遅い場合でもメモリが増え続けないようにする
+        save_queue = queue.Queue(maxsize=self.save_queue_size)
+        save_errors = []
+        saver = threading.Thread(
+            target=self._save_loop, args=(save_queue, save_errors), name="AcquisitionSaver", daemon=True
+        )
+        saver.start()
+        led_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AcquisitionLED")
+
+        start = time.perf_counter()
+        try:
+            for index in pending:
+                step = steps[index]
+                if cancel_event is not None and cancel_event.is_set():
+                    report.cancelled = True
+                    break
+                if save_errors:
+                    raise AcquisitionError(f"画像の保存に失敗しました: {save_errors[0]}")
+
+                timing = StepTiming(index, step.led, step.filter)
+                self._prepare(step, timing, led_pool)
+
+                exposure = exposures[index]
+                auto = None
+                t0 = time.perf_counter()
+                if exposure is None:
+                    # 試し撮りのうち、目標の明るさに収まった画像をそのまま撮影結果にする
+                    auto = self.auto_exposure.find(step.led, step.filter, sample_type)
+                    frame, exposure, timing.captures = auto.frame, auto.exposure_ms, auto.captures
+                else:
+                    frame = self.camera.capture(exposure)
+                timing.capture = time.perf_counter() - t0
+                tracer.record_span("camera.capture", timing.capture, exposure_ms=exposure, captures=timing.captures)
+
+                metadata = {
+                    "sample_name": sample_name,
+                    "index": index,
+                    "excitation": step.led,
+                    "emission_filter": step.filter,
+                    "filter_position": step.slot,
+                    "exposure_ms": exposure,
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                }
+                if sample_type:
+                    metadata["sample_type"] = sample_type
+                if auto is not None:
+                    metadata["auto_exposure"] = {"captures": auto.captures, "converged": auto.converged,
+                                                 "level": auto.level, "sample_type": sample_type}
+                save_queue.put((sample_name, index, step, frame, metadata, timing))
+                report.timings.append(timing)
+                if self.on_step is not None:
+                    self.on_step(timing)
+        finally:
+            led_pool.shutdown(wait=True)
+            save_queue.put(None)
+            saver.join()
+            try:
+                self.excitation.off()
+            except Exception as e:
+                logger.error(f"励起光源を消灯できませんでした。 {e}")
+            report.wall_time = time.perf_counter() - start
+            if self.auto_exposure is not None:
+                try:
+                    self.auto_exposure.save()
+                except OSError as e:
+                    logger.error(f"露光時間のキャッシュを保存できませんでした。 {e}")
+            if self.journal is not None:
+                if not save_errors and not report.cancelled and len(report.timings) == len(pending):
+                    self.journal.finish()
+                self.journal.sync()
+
+        if save_errors:
+            raise AcquisitionError(f"画像の保存に失敗しました: {save_errors[0]}")
+        return report
+
+    def _prepare(self, step, timing, led_pool):
+        """フィルター移動とLED切り替えを並行して行う"""
+        t0 = time.perf_counter()
+        led_future = led_pool.submit(self._timed, self.excitation.select, step.led)
+        moved = self.filter_changer.move_to(step.slot)
+        timing.move = time.perf_counter() - t0
+        led_ok, timing.led_switch = led_future.result()
+        timing.prepare = time.perf_counter() - t0
+        tracer.record_span("acquisition.prepare", timing.prepare, slot=step.slot, led=step.led)
+        if not moved:
+            raise AcquisitionError(f"フィルターをポジション {step.slot} へ移動できませんでした。")
+        if led_ok is False:
+            raise AcquisitionError(f"励起光源を {step.led} に切り替えられませんでした。")
+
+    @staticmethod
+    def _timed(func, *args):
+        t0 = time.perf_counter()
+        result = func(*args)
+        return result, time.perf_counter() - t0
+
+    def _save_loop(self, save_queue, save_errors):
+        while True:
+            item = save_queue.get()
+            if item is None:
+                break
+            sample_name, index, step, frame, metadata, timing = item
+            if save_errors:
+                continue  # 失敗後は残りを読み捨て、撮影スレッドが詰まらないようにする
+            t0 = time.perf_counter()
+            try:
+                output = self.writer.write(sample_name, index, step, frame, metadata)
+            except Exception as e:
+                save_errors.append(e)
+            else:
+                if self.journal is not None:
+                    self.journal.step_done(index, output)
+            timing.save = time.perf_counter() - t0
+            tracer.record_span("acquisition.save", timing.save, index=index)
+        try:
+            self.writer.close()
+        except Exception as e:
+            save_errors.append(e)
+
+
+def timings_as_dicts(report):
+    """タイミング情報をJSONなどに書き出しやすい形に変換する"""
+    return [asdict(t) for t in report.timings]
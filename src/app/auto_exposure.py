@@ -0,0 +1,257 @@
+"""
+励起・放射の組ごとに露光時間を自動で決める。
+
+前回までの結果（LED・フィルター・試料の種類ごとの「1msあたりの明るさ」）から最初の露光時間を予測し、
+間引いた画像の明るさ（上位パーセンタイル）と飽和画素の割合を見ながら、少ない試し撮りで目標の明るさに合わせる。
+目標に収まった画像はそのまま撮影結果として使えるため、余分に撮るのは外れた試し撮りの分だけになる。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from src.utils.config_parser import PROJECT_ROOT
+
+logger = logging.getLogger(__name__)
+
+# 明るさの指標に使うパーセンタイルと、統計を取るときの間引き間隔
+LEVEL_PERCENTILE = 99.5
+DECIMATION = 4
+# 最大値のこの割合以上の画素を飽和とみなす
+SATURATION_LEVEL = 0.98
+DEFAULT_SAMPLE_TYPE = "default"
+DEFAULT_CACHE_PATH = PROJECT_ROOT / "data" / "exposure_cache.json"
+
+
+def frame_statistics(frame, max_value, decimation=DECIMATION, percentile=LEVEL_PERCENTILE):
+    """間引いた画像から (明るさの指標, 飽和画素の割合) を求める"""
+    sample = np.asarray(frame)[::decimation, ::decimation].ravel()
+    level = float(np.percentile(sample, percentile))
+    saturated = np.count_nonzero(sample >= SATURATION_LEVEL * max_value) / sample.size
+    return level, saturated
+
+
+class ExposureCache:
+    """
+    (LED, フィルター, 試料の種類) ごとの明るさの伸び (counts/ms) をJSONファイルに保存する。
+    同じ組み合わせの記録がなければ、試料の種類を問わず同じLED・フィルターの記録を使う。
+    """
+
+    def __init__(self, path=None):
+        self.path = None if path is None else Path(path)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if self.path is not None and self.path.exists():
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"露光時間のキャッシュ {self.path} を読み込めませんでした。 {e}")
+
+    @staticmethod
+    def _key(led, filter_label, sample_type):
+        return f"{led}|{filter_label}|{sample_type or DEFAULT_SAMPLE_TYPE}"
+
+    def rate(self, led, filter_label, sample_type=None):
+        """1msあたりの明るさの伸び。記録がなければNone"""
+        with self._lock:
+            entry = self._entries.get(self._key(led, filter_label, sample_type))
+            if entry is None:
+                prefix = f"{led}|{filter_label}|"
+                rates = [e["rate"] for key, e in self._entries.items() if key.startswith(prefix)]
+                # 試料の種類が違う記録は、桁を合わせるために幾何平均を使う
+                return float(np.exp(np.mean(np.log(rates)))) if rates else None
+            return entry["rate"]
+
+    def update(self, led, filter_label, sample_type, rate, exposure_ms):
+        with self._lock:
+            self._entries[self._key(led, filter_label, sample_type)] = {
+                "rate": rate, "exposure_ms": exposure_ms, "updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            self._dirty = True
+
+    def save(self):
+        """変更があればファイルに書き出す（書き込み途中で壊れないよう一時ファイルから置き換える）"""
+        with self._lock:
+            if self.path is None or not self._dirty:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+
+@dataclass
+class ExposureResult:
+    exposure_ms: float
+    frame: np.ndarray # 最後に撮った画像（converged なら撮影結果としてそのまま使える）
+    captures: int # 試し撮りを含めた撮影枚数
+    converged: bool
+    level: float
+    history: list = field(default_factory=list) # 試した露光時間（撮影順）
+
+
+class AutoExposure:
+    """
+    明るさの指標が最大値の target_fraction 付近（± tolerance）になる露光時間を探す。
+    明るさは「オフセット + 伸び × 露光時間」で近似し、2枚目以降は撮った画像から両方を推定する。
+    飽和した露光時間は上限として残し、それより短い露光時間だけを試す（飽和した露光時間と飽和しなかった露光時間の幅が
+    1 + tolerance 倍以内に狭まったら、飽和しなかった方で決まったものとする）。
+    """
+
+    def __init__(self, camera, cache=None, target_fraction=0.6, tolerance=0.15, max_value=None,
+                 min_exposure=1.0, max_exposure=10000.0, default_exposure=100.0, max_captures=5,
+                 max_saturated=0.001, dark_level=0.0):
+        self.camera = camera
+        self.cache = cache
+        self.target_fraction = target_fraction
+        self.tolerance = tolerance
+        self.max_value = max_value # Noneなら画像の型の最大値
+        self.min_exposure = min_exposure
+        self.max_exposure = max_exposure
+        self.default_exposure = default_exposure
+        self.max_captures = max_captures
+        self.max_saturated = max_saturated
+        # 明るさの指標より上位の画素が飽和しても、指標そのものは飽和していないことが分かる範囲に限る
+        if not max_saturated < (100.0 - LEVEL_PERCENTILE) / 100.0:
+            raise ValueError(f"max_saturated は {(100.0 - LEVEL_PERCENTILE) / 100.0} より小さくしてください。")
+        if not target_fraction * (1.0 + tolerance) < SATURATION_LEVEL:
+            raise ValueError(f"目標の明るさの上限 (target_fraction × (1 + tolerance)) は {SATURATION_LEVEL} より小さくしてください。")
+        # 露光0でのカメラの値（オフセット）。1枚目の画像から次の露光時間を決めるときに使う
+        self.dark_level = dark_level
+
+    def _clamp(self, exposure):
+        return float(min(self.max_exposure, max(self.min_exposure, exposure)))
+
+    def predict(self, led, filter_label, sample_type=None, max_value=65535):
+        """キャッシュから最初に試す露光時間を求める"""
+        rate = self.cache.rate(led, filter_label, sample_type) if self.cache is not None else None
+        if not rate or rate <= 0:
+            return self._clamp(self.default_exposure)
+        return self._clamp((self.target_fraction * max_value - self.dark_level) / rate)
+
+    def find(self, led=None, filter_label=None, sample_type=None, initial_ms=None):
+        """試し撮りを繰り返して露光時間を決め、ExposureResultを返す"""
+        max_value = self.max_value
+        exposure = None if initial_ms is None else self._clamp(initial_ms)
+        points = []  # 飽和していない (露光時間, 明るさ)
+        history = []
+        best = None  # 飽和していない中で最も長い露光時間の (露光時間, 画像, 明るさ)
+        upper = None  # 飽和した中で最も短い露光時間
+        frame = level = captured_exposure = None
+        for captures in range(1, self.max_captures + 1):
+            if exposure is None:
+                exposure = self.predict(led, filter_label, sample_type, max_value or 65535)
+            frame = self.camera.capture(exposure)
+            captured_exposure = exposure
+            history.append(exposure)
+            if max_value is None:
+                max_value = np.iinfo(frame.dtype).max if np.issubdtype(frame.dtype, np.integer) else 1.0
+            target = self.target_fraction * max_value
+            level, saturated = frame_statistics(frame, max_value)
+
+            if saturated > self.max_saturated:
+                if exposure <= self.min_exposure:
+                    break
+                upper = exposure if upper is None else min(upper, exposure)
+                if best is None:
+                    # 飽和していると明るさが分からないため、飽和した画素が多いほど大きく短くする
+                    exposure = self._clamp(exposure * 0.25 / (1.0 + 10.0 * saturated))
+                    continue
+            else:
+                points.append((exposure, level))
+                if best is None or exposure > best[0]:
+                    best = (exposure, frame, level)
+                if abs(level - target) <= self.tolerance * target:
+                    self._remember(led, filter_label, sample_type, points, exposure)
+                    return ExposureResult(exposure, frame, captures, True, level, history)
+
+            next_exposure = self._next_exposure(points, target)
+            ceiling = upper
+            limit = self._saturation_limit(best, max_value)
+            if next_exposure > limit:
+                next_exposure = limit
+                ceiling = limit if ceiling is None else min(ceiling, limit)
+            if ceiling is not None and best[2] < target and ceiling <= best[0] * (1.0 + self.tolerance):
+                # 目標に届く前に飽和する試料。飽和しない範囲で最も明るい画像を使う
+                exposure, frame, level = best
+                self._remember(led, filter_label, sample_type, [(exposure, level)], exposure)
+                return ExposureResult(exposure, frame, captures, True, level, history)
+            if upper is not None:
+                # 飽和した露光時間との間は、予測が届かなくても幾何平均で半分ずつ狭める
+                next_exposure = min(next_exposure, float(np.sqrt(best[0] * upper)))
+            if next_exposure == exposure:
+                break  # 露光時間の上限・下限に達した
+            exposure = next_exposure
+
+        logger.warning(f"露光時間を目標の明るさに合わせられませんでした (LED={led}, Filter={filter_label}, "
+                       f"露光 {captured_exposure:.1f} ms, 明るさ {level:.0f})")
+        return ExposureResult(captured_exposure, frame, captures, False, level, history)
+
+    def _next_exposure(self, points, target):
+        (e1, l1) = points[-1]
+        rate = None
+        if len(points) >= 2:
+            (e0, l0) = points[-2]
+            if e1 != e0 and (l1 - l0) / (e1 - e0) > 0:
+                rate = (l1 - l0) / (e1 - e0)
+                offset = l1 - rate * e1
+        if rate is None:
+            offset = min(self.dark_level, l1)
+            rate = (l1 - offset) / e1
+        if rate <= 0:
+            return self._clamp(e1 * 4)
+        return self._clamp((target - offset) / rate)
+
+    def _saturation_limit(self, best, max_value):
+        """飽和していない画像から、飽和画素の割合が max_saturated に達する露光時間を見積もる"""
+        exposure, frame, _ = best
+        sample = np.asarray(frame)[::DECIMATION, ::DECIMATION]
+        brightest = float(np.percentile(sample, 100.0 * (1.0 - self.max_saturated)))
+        if brightest <= self.dark_level:
+            return self.max_exposure
+        return self._clamp(exposure * (SATURATION_LEVEL * max_value - self.dark_level) / (brightest - self.dark_level))
+
+    def _remember(self, led, filter_label, sample_type, points, exposure):
+        if self.cache is None or led is None or filter_label is None:
+            return
+        exposure_ms, level = points[-1]
+        rate = (level - min(self.dark_level, level)) / exposure_ms
+        if rate > 0:
+            self.cache.update(led, filter_label, sample_type, rate, exposure)
+
+    def save(self):
+        if self.cache is not None:
+            self.cache.save()
+
+
+def create_auto_exposure(camera, settings=None, cache=None):
+    """
+    settings.ini の [AutoExposure] の設定でAutoExposureを作る（設定がなければ既定値）。
+    cache を渡すと、設定のキャッシュファイルの代わりにそれを使う（擬似デバイスでの撮影など）。
+    """
+    def option(name, fallback):
+        value = settings.get("AutoExposure", name) if settings is not None else None
+        return fallback if value is None else type(fallback)(value)
+
+    if cache is None:
+        cache_path = settings.get("AutoExposure", "cache") if settings is not None else None
+        cache = ExposureCache(Path(cache_path) if cache_path else DEFAULT_CACHE_PATH)
+    return AutoExposure(
+        camera,
+        cache=cache,
+        target_fraction=option("target_fraction", 0.6),
+        tolerance=option("tolerance", 0.15),
+        min_exposure=option("min_exposure_ms", 1.0),
+        max_exposure=option("max_exposure_ms", 10000.0),
+        default_exposure=option("exposure_default", settings.exposure_default if settings is not None else 100.0),
+        max_captures=option("max_captures", 5),
+    )
@@ -0,0 +1,406 @@
+"""
+GUIを使わずに複数サンプルを連続撮影するためのコマンドラインツール兼ライブラリ。
+
+    python -m src.app.batch plan.yaml [--simulate] [--save-dir DIR] [--resume]
+    python -m src.app.batch plan.yaml --record-trace session.jsonl   # 通信と撮影時間を記録する
+    python -m src.app.batch plan.yaml --replay-trace session.jsonl --replay-speed 10  # 実機なしで再生する
+
+再生中に記録と異なる通信があった場合は終了コード3を返す。
+
+撮影計画ファイル（YAMLまたはJSON）の例:
+
+    exposure_ms: 1000          # 既定の露光時間（auto なら組み合わせごとに自動で決める）
+    optimize_order: true       # フィルター移動が最小になるよう並べ替える
+    samples:
+      - name: sample01
+        sample_type: PE         # 自動露光の記録を引くときの試料の種類（省略可）
+        pairs:
+          - [280nm, 400nm]
+          - {excitation: 310nm, emission: 450nm, exposure_ms: 200}
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from src.app.acquisition import AcquisitionEngine, timings_as_dicts
+from src.app.auto_exposure import ExposureCache, create_auto_exposure
+from src.app.journal import AcquisitionJournal, JOURNAL_NAME, incomplete_runs
+from src.app.sequence_planner import build_steps, plan_sequence
+from src.hardware.session_trace import TraceRecorder, TraceReplay
+from src.storage.catalog import Catalog
+from src.storage.cube import CubeFrameWriter, check_sample_name
+from src.utils.config_parser import load_settings
+
+logger = logging.getLogger(__name__)
+
+# --simulate のときの露光時間キャッシュ（保存先に作る）
+SIMULATED_CACHE_NAME = "exposure_cache.simulated.json"
+
+
+class PlanError(ValueError):
+    """撮影計画ファイルの内容が不正な場合に送出される"""
+
+
+@dataclass
+class SamplePlan:
+    name: str
+    pairs: list # (励起, 放射フィルター) のリスト
+    exposures: list # pairs と同じ順の露光時間 (ms)。Noneは自動露光
+    sample_type: str = None
+
+
+@dataclass
+class BatchPlan:
+    samples: list = field(default_factory=list)
+    optimize_order: bool = True
+    save_directory: str = None
+
+
+def _parse_exposure(value, where):
+    """露光時間を数値に変換する。'auto'（と、それを引き継いだNone）は自動露光を表すNoneにする"""
+    if value is None or isinstance(value, str) and value.strip().lower() == "auto":
+        return None
+    try:
+        exposure = float(value)
+    except (TypeError, ValueError):
+        raise PlanError(f"{where}の露光時間 {value!r} は数値か 'auto' で指定してください。") from None
+    if exposure <= 0:
+        raise PlanError(f"{where}の露光時間は正の値にしてください。")
+    return exposure
+
+
+def parse_plan(data, default_exposure=1000.0):
+    """辞書形式の撮影計画を検証して BatchPlan に変換する"""
+    if not isinstance(data, dict) or not isinstance(data.get("samples"), list) or not data["samples"]:
+        raise PlanError("撮影計画には1つ以上のサンプルを 'samples' に記述してください。")
+    plan_exposure = _parse_exposure(data.get("exposure_ms", default_exposure), "計画")
+    samples = []
+    for i, sample in enumerate(data["samples"]):
+        name = str(sample.get("name", "")).strip() if isinstance(sample, dict) else ""
+        if not name:
+            raise PlanError(f"{i + 1}番目のサンプルに名前 'name' がありません。")
+        try:
+            check_sample_name(name)
+        except ValueError as e:
+            raise PlanError(str(e)) from None
+        sample_exposure = _parse_exposure(sample.get("exposure_ms", plan_exposure), f"サンプル '{name}' ")
+        pairs, exposures = [], []
+        for pair in sample.get("pairs") or []:
+            if isinstance(pair, dict):
+                try:
+                    pairs.append((str(pair["excitation"]), str(pair["emission"])))
+                except KeyError as e:
+                    raise PlanError(f"サンプル '{name}' の組み合わせに {e} がありません。") from None
+                exposures.append(_parse_exposure(pair.get("exposure_ms", sample_exposure), f"サンプル '{name}' "))
+            elif isinstance(pair, (list, tuple)) and len(pair) == 2:
+                pairs.append((str(pair[0]), str(pair[1])))
+                exposures.append(sample_exposure)
+            else:
+                raise PlanError(f"サンプル '{name}' の組み合わせ {pair!r} を解釈できません。")
+        if not pairs:
+            raise PlanError(f"サンプル '{name}' に撮影する組み合わせ 'pairs' がありません。")
+        sample_type = sample.get("sample_type")
+        samples.append(SamplePlan(name, pairs, exposures, None if sample_type is None else str(sample_type)))
+    return BatchPlan(samples, bool(data.get("optimize_order", True)), data.get("save_directory"))
+
+
+def load_plan(path, default_exposure=1000.0):
+    """YAML (.yaml/.yml) またはJSONの撮影計画ファイルを読み込む"""
+    path = Path(path)
+    with open(path, encoding="utf-8") as f:
+        if path.suffix.lower() in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise PlanError("YAMLの読み込みには PyYAML が必要です (pip install pyyaml)。") from None
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    return parse_plan(data, default_exposure)
+
+
+@dataclass
+class SampleResult:
+    name: str
+    output: str
+    report: object # AcquisitionReport
+    naive_move_time: float
+    planned_move_time: float
+
+
+class BatchRunner:
+    """
+    撮影計画に従ってサンプルを順に撮影する。GUIからもスクリプトからも同じように使える。
+    各サンプルは '<保存先>/<サンプル名>.fcube' に保存する。
+    journal を渡すと進行状況を記録し、resume に中断した撮影 {サンプル名: JournalRun} を渡すと続きから撮影する。
+    catalog を渡すと、保存したバンドを索引とプレビューにも登録する。
+    """
+
+    def __init__(self, filter_changer, camera, excitation, filter_slots, save_directory, on_step=None,
+                 journal=None, resume=None, auto_exposure=None, catalog=None):
+        self.filter_changer = filter_changer
+        self.camera = camera
+        self.excitation = excitation
+        self.filter_slots = filter_slots
+        self.save_directory = Path(save_directory)
+        self.on_step = on_step
+        self.journal = journal
+        self.resume = resume or {}
+        self.auto_exposure = auto_exposure
+        self.catalog = catalog
+        self.cancel_event = threading.Event()
+
+    def plan_steps(self, sample, optimize_order=True):
+        """サンプルの撮影順と、それに対応する露光時間のリストを決める"""
+        start = getattr(self.filter_changer, "current_position", None)
+        if optimize_order:
+            plan = plan_sequence(sample.pairs, self.filter_slots, start_position=start)
+            steps = plan.steps
+            naive_time, planned_time = plan.naive_time, plan.estimated_time
+        else:
+            steps = build_steps(sample.pairs, self.filter_slots)
+            naive_time = planned_time = None
+        # 並べ替え後も、それぞれの組み合わせに指定した露光時間を対応させる
+        remaining = {}
+        for pair, exposure in zip(sample.pairs, sample.exposures):
+            remaining.setdefault(pair, []).append(exposure)
+        exposures = [remaining[(step.led, step.filter)].pop(0) for step in steps]
+        return steps, exposures, naive_time, planned_time
+
+    def run_sample(self, sample, optimize_order=True):
+        previous = self.resume.get(sample.name)
+        completed = {}
+        if previous is not None and _same_pairs(previous, sample):
+            # 前回と同じ計画なら、前回の撮影順のまま保存済みのステップを飛ばす
+            steps, exposures = previous.steps, previous.exposures
+            completed = {i: previous.completed[i] for i in previous.verified_completed()}
+            naive_time = planned_time = None
+            logger.info(f"サンプル '{sample.name}' を再開します (保存済み {len(completed)}/{len(steps)}枚)")
+        else:
+            steps, exposures, naive_time, planned_time = self.plan_steps(sample, optimize_order)
+        writer = CubeFrameWriter.for_steps(self.save_directory, steps, resume=bool(completed), catalog=self.catalog,
+                                           outputs={sample.name: previous.output} if completed else None)
+        engine = AcquisitionEngine(self.filter_changer, self.camera, self.excitation, writer,
+                                   on_step=self.on_step, journal=self.journal, auto_exposure=self.auto_exposure)
+        report = engine.run(steps, exposures, sample.name, cancel_event=self.cancel_event, completed=completed,
+                            sample_type=sample.sample_type)
+        return SampleResult(sample.name, str(writer.path_for(sample.name)), report, naive_time, planned_time)
+
+    def run(self, plan, results=None):
+        """
+        計画内の全サンプルを撮影し、SampleResult のリストを返す（中止された場合はそこまで）。
+        results にリストを渡すと、途中で例外が起きてもそれまでの結果が残る。
+        """
+        results = [] if results is None else results
+        for sample in plan.samples:
+            if self.cancel_event.is_set():
+                break
+            logger.info(f"サンプル '{sample.name}' の撮影を開始します ({len(sample.pairs)}枚)")
+            result = self.run_sample(sample, plan.optimize_order)
+            logger.info(f"サンプル '{sample.name}': {result.report.summary()}")
+            results.append(result)
+        return results
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+def _same_pairs(run, sample):
+    """中断した撮影 run が、計画のサンプルと同じ組み合わせ・露光時間か（順番は問わない）"""
+    recorded = Counter(((step.led, step.filter), exposure) for step, exposure in zip(run.steps, run.exposures))
+    return recorded == Counter(zip(sample.pairs, sample.exposures))
+
+
+def build_timing_report(results, started_at):
+    """撮影結果からJSONに書き出せる所要時間レポートを作る"""
+    total_frames = sum(r.report.frames for r in results)
+    total_time = sum(r.report.wall_time for r in results)
+    return {
+        "started_at": started_at,
+        "samples": [
+            {
+                "name": r.name,
+                "output": r.output,
+                "frames": r.report.frames,
+                "cancelled": r.report.cancelled,
+                "wall_time_s": r.report.wall_time,
+                "frames_per_minute": r.report.frames_per_minute,
+                "auto_exposure_extra_captures": r.report.extra_captures,
+                "stage_totals_s": r.report.stage_totals(),
+                "estimated_move_time_naive_s": r.naive_move_time,
+                "estimated_move_time_planned_s": r.planned_move_time,
+                "steps": timings_as_dicts(r.report),
+            }
+            for r in results
+        ],
+        "total_frames": total_frames,
+        "total_wall_time_s": total_time,
+        "frames_per_minute": 60.0 * total_frames / total_time if total_time > 0 else 0.0,
+    }
+
+
+def open_devices(settings, simulate=False, recorder=None, replay=None):
+    """
+    撮影に使うデバイスを用意して (フィルターチェンジャー, カメラ, 励起光源, 後片付け用の関数) を返す。
+    simulate=True の場合は擬似デバイスを使う。
+    recorder (TraceRecorder) を渡すとフィルターチェンジャーの通信とカメラの撮影時間を記録し、
+    replay (TraceReplay) を渡すと実機の代わりに記録を再生する（励起光源は擬似デバイス）。
+    """
+    from src.hardware.filter_changer import TRACE_DEVICE, FilterChangerController
+
+    if replay is not None:
+        from src.hardware.simulators import SimulatedExcitationSource
+
+        filter_changer = FilterChangerController(port=replay.meta.get("port", "replay"),
+                                                 baudrate=settings.filter_changer_baudrate,
+                                                 serial_factory=replay.serial_factory(TRACE_DEVICE))
+        if not filter_changer.connect():
+            raise RuntimeError("記録を再生できませんでした。")
+        return filter_changer, replay.camera(), SimulatedExcitationSource(), filter_changer.disconnect
+
+    serial_factory = recorder.serial_factory(TRACE_DEVICE) if recorder is not None else None
+    if simulate:
+        from src.hardware.led_controller import LedController
+        from src.hardware.simulators import FakeFC8Device, FakeLedServer, SimulatedCamera
+
+        device = FakeFC8Device()
+        device.start()
+        # LEDは擬似サーバー経由で、実機と同じ通信経路を通して切り替える
+        led_server = FakeLedServer()
+        led_server.start()
+        filter_changer = FilterChangerController(port=device.port, baudrate=settings.filter_changer_baudrate,
+                                                 serial_factory=serial_factory)
+        excitation = LedController(*led_server.address)
+        if not filter_changer.connect() or not excitation.connect():
+            filter_changer.disconnect()
+            device.stop()
+            led_server.stop()
+            raise RuntimeError("擬似デバイスに接続できませんでした。")
+        camera = SimulatedCamera(excitation=excitation, filter_changer=filter_changer)
+        if recorder is not None:
+            camera = recorder.wrap_camera(camera)
+
+        def close():
+            excitation.disconnect()
+            filter_changer.disconnect()
+            led_server.stop()
+            device.stop()
+
+        return filter_changer, camera, excitation, close
+
+    # カメラ (CS-66UV) の制御モジュールはまだないため、実機での撮影はできない
+    raise RuntimeError("カメラの制御モジュールが未実装のため、実機での撮影はできません。--simulate を指定してください。")
+
+
+def _replay_speed(text):
+    try:
+        speed = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"数値で指定してください: {text}") from None
+    if not speed > 0:
+        raise argparse.ArgumentTypeError(f"正の値で指定してください: {text}")
+    return speed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="撮影計画ファイルに従って、GUIなしで複数サンプルを撮影する")
+    parser.add_argument("plan", help="撮影計画ファイル (.yaml / .json)")
+    parser.add_argument("--save-dir", help="保存先（省略時は計画ファイルまたはsettings.iniの設定）")
+    parser.add_argument("--simulate", action="store_true", help="実機の代わりに擬似デバイスを使う")
+    parser.add_argument("--no-optimize", action="store_true", help="撮影順を並べ替えない")
+    parser.add_argument("--resume", action="store_true", help="中断したサンプルを保存済みのステップの続きから撮影する")
+    parser.add_argument("--record-trace", help="フィルターチェンジャーの通信とカメラの撮影時間を記録するファイル")
+    parser.add_argument("--replay-trace", help="実機の代わりに再生する記録ファイル（--record-trace で作ったもの）")
+    parser.add_argument("--replay-speed", type=_replay_speed, default=1.0, help="再生の速さ（記録の何倍速か。既定は1）")
+    parser.add_argument("--config", help="設定ファイルのパス（省略時は config/settings.ini）")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    settings = load_settings(args.config)
+    try:
+        plan = load_plan(args.plan, settings.exposure_default)
+    except (OSError, ValueError) as e:
+        print(f"エラー: 撮影計画を読み込めませんでした。 {e}", file=sys.stderr)
+        return 2
+    if args.no_optimize:
+        plan.optimize_order = False
+    save_directory = Path(args.save_dir or plan.save_directory or settings.save_directory)
+
+    recorder = replay = None
+    try:
+        if args.replay_trace:
+            replay = TraceReplay(args.replay_trace, speed=args.replay_speed)
+        elif args.record_trace:
+            recorder = TraceRecorder(args.record_trace, plan=str(args.plan))
+    except OSError as e:
+        print(f"エラー: 記録ファイルを開けませんでした。 {e}", file=sys.stderr)
+        return 2
+    try:
+        filter_changer, camera, excitation, close = open_devices(settings, simulate=args.simulate,
+                                                                 recorder=recorder, replay=replay)
+    except RuntimeError as e:
+        if recorder is not None:
+            recorder.close()
+        print(f"エラー: {e}", file=sys.stderr)
+        return 1
+
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+    resume = incomplete_runs(save_directory / JOURNAL_NAME) if args.resume else None
+    journal = AcquisitionJournal.in_directory(save_directory)
+    catalog = Catalog.in_directory(save_directory)
+    auto_exposure = None
+    if any(exposure is None for sample in plan.samples for exposure in sample.exposures):
+        if replay is not None and replay.recorded("auto_exposure"):
+            # 再生する画像では判断が変わるため、記録した露光時間をなぞる
+            auto_exposure = replay.auto_exposure(camera)
+        else:
+            cache = None
+            if replay is not None:
+                # 再生の結果が保存済みのキャッシュに左右されず、キャッシュも書き換えないようメモリ上だけで使う
+                cache = ExposureCache()
+            elif args.simulate:
+                # 擬似カメラの明るさで、実機の撮影に使う露光時間のキャッシュを上書きしないよう保存先に分ける
+                cache = ExposureCache(save_directory / SIMULATED_CACHE_NAME)
+            auto_exposure = create_auto_exposure(camera, settings, cache=cache)
+            if recorder is not None:
+                auto_exposure = recorder.wrap_auto_exposure(auto_exposure)
+    runner = BatchRunner(filter_changer, camera, excitation, settings.filter_options, save_directory,
+                         journal=journal, resume=resume, auto_exposure=auto_exposure, catalog=catalog)
+    results = []
+    exit_code = 0
+    try:
+        runner.run(plan, results)
+    except KeyboardInterrupt:
+        print("中断されました。ここまでの結果を保存します。")
+        exit_code = 130
+    except Exception as e:
+        print(f"エラー: 撮影中にエラーが発生しました。 {e}", file=sys.stderr)
+        exit_code = 1
+    finally:
+        journal.close()
+        catalog.close()
+        close()
+        if recorder is not None:
+            recorder.close()
+
+    save_directory.mkdir(parents=True, exist_ok=True)
+    report_path = save_directory / f"batch_report_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(build_timing_report(results, started_at), f, ensure_ascii=False, indent=2)
+    print(f"所要時間レポートを保存しました: {report_path}")
+    if replay is not None and replay.mismatches:
+        print(f"記録と異なる通信・撮影が {len(replay.mismatches)}件ありました。", file=sys.stderr)
+        for mismatch in replay.mismatches[:10]:
+            print(f"  {mismatch}", file=sys.stderr)
+        exit_code = exit_code or 3
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from src.app.acquisition import AcquisitionEngine, NpyFrameWriter
+from src.app.sequence_planner import build_steps
+from src.hardware.filter_changer import FilterChangerController
+from src.hardware.simulators import FakeFC8Device, SimulatedCamera, SimulatedExcitationSource
+
+DEFAULT_FILTERS = {"1": "350nm", "2": "400nm", "3": "450nm", "4": "500nm", "5": "550nm", "6": "600nm"}
+DEFAULT_LEDS = ["280nm", "310nm", "325nm", "340nm", "365nm"]
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """値のリストから {'p50': ..., ...} を求める"""
+    if not values:
+        return {f"p{p}": None for p in points}
+    return {f"p{p}": float(v) for p, v in zip(points, np.percentile(values, points))}
+
+
+def measure_command_latency(controller, count=100):
+    """'F?' の往復遅延（ミリ秒）を count 回計測する"""
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        controller.get_current_position()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def run_benchmark(commands=100, shape=(480, 640), exposure_ms=10.0, move_time_per_slot=0.0,
+                  readout_time=0.0, exposure_scale=0.0, leds=None, filters=None, save_directory=None):
+    """
+    擬似デバイスでコマンド遅延と全組み合わせのシーケンス撮影を計測し、結果を辞書で返す。
+    フィルターチェンジャーは pty 上の FakeFC8Device と実際の FilterChangerController を通して動かす。
+    """
+    leds = leds or DEFAULT_LEDS
+    filters = filters or DEFAULT_FILTERS
+    steps = build_steps([(led, f) for f in filters.values() for led in leds], filters)
+
+    with FakeFC8Device(move_time_per_slot=move_time_per_slot) as device, \
+            tempfile.TemporaryDirectory() as tmp_dir:
+        controller = FilterChangerController(port=device.port, baudrate=9600)
+        if not controller.connect():
+            raise RuntimeError("擬似フィルターチェンジャーに接続できませんでした。")
+        try:
+            latencies = measure_command_latency(controller, commands)
+            excitation = SimulatedExcitationSource()
+            camera = SimulatedCamera(shape=shape, readout_time=readout_time, exposure_scale=exposure_scale,
+                                     excitation=excitation, filter_changer=controller)
+            writer = NpyFrameWriter(save_directory or tmp_dir)
+            report = AcquisitionEngine(controller, camera, excitation, writer).run(steps, exposure_ms, "benchmark")
+        finally:
+            controller.disconnect()
+
+    return {
+        "command_latency_ms": percentiles(latencies),
+        "frames": report.frames,
+        "sequence_wall_time_s": report.wall_time,
+        "frames_per_second": report.frames / report.wall_time if report.wall_time > 0 else 0.0,
+        "stage_totals_s": report.stage_totals(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="擬似デバイスを使った撮影スループットのベンチマーク")
+    parser.add_argument("--commands", type=int, default=100, help="遅延を計測する F? コマンドの回数")
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--exposure", type=float, default=10.0, help="露光時間 (ms)")
+    parser.add_argument("--move-time", type=float, default=0.0, help="1スロットあたりの擬似移動時間 (秒)")
+    parser.add_argument("--readout-time", type=float, default=0.0, help="擬似カメラの読み出し時間 (秒)")
+    parser.add_argument("--real-exposure", action="store_true", help="露光時間だけ実際に待つ")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args(argv)
+
+    result = run_benchmark(
+        commands=args.commands, shape=(args.height, args.width), exposure_ms=args.exposure,
+        move_time_per_slot=args.move_time, readout_time=args.readout_time,
+        exposure_scale=1.0 if args.real_exposure else 0.0,
+    )
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    latency = result["command_latency_ms"]
+    print(f"コマンド遅延 (ms): p50={latency['p50']:.2f}, p90={latency['p90']:.2f}, p99={latency['p99']:.2f}")
+    print(f"シーケンス: {result['frames']}枚 / {result['sequence_wall_time_s']:.2f}秒 "
+          f"({result['frames_per_second']:.1f}枚/秒)")
+    for stage, total in result["stage_totals_s"].items():
+        print(f"  {stage}: {total:.3f}秒")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# デバイスの状態
+DISCONNECTED = "disconnected"
+CONNECTING = "connecting"
+CONNECTED = "connected"
+RECONNECTING = "reconnecting"
+
+
+class ManagedDevice:
+    """DeviceManagerが管理する1台分の状態"""
+
+    def __init__(self, name, device, connect_timeout, auto_reconnect):
+        self.name = name
+        self.device = device
+        self.connect_timeout = connect_timeout
+        self.auto_reconnect = auto_reconnect
+        self.state = DISCONNECTED
+        self.attempts = 0 # 連続して接続に失敗した回数
+        self.next_retry = 0.0
+        self.last_check = 0.0
+        self.busy = False # 接続処理や死活確認の実行中
+        self.failures = 0 # 連続して死活確認に失敗した回数
+        self.holds = 0 # 撮影中などで死活確認を止めている数（paused() の入れ子に対応）
+
+
+class DeviceManager:
+    """
+    複数のデバイスへの接続をまとめて管理する。
+    起動時は全デバイスへ並行して接続し（デバイスごとにタイムアウトあり）、その後は一定間隔で死活確認を行う。
+    死活確認に failures_before_disconnect 回続けて失敗したデバイスは、待ち時間を倍々に延ばしながら自動で再接続する。
+    デバイスが busy 属性で処理中を示している間と、paused() の間は死活確認を行わない
+    （移動中のコマンドと問い合わせが重なって、応答待ちが時間切れになるのを避けるため）。
+
+    各デバイスに必要なメソッド: connect() -> bool, disconnect(), health_check() -> bool
+    """
+
+    def __init__(self, on_status=None, heartbeat_interval=5.0, backoff_initial=1.0, backoff_max=30.0,
+                 failures_before_disconnect=3):
+        # on_status(name, state, detail) 状態が変わるたびに呼ばれる（管理スレッド上）
+        self.on_status = on_status
+        self.heartbeat_interval = heartbeat_interval
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.failures_before_disconnect = failures_before_disconnect
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def add(self, name, device, connect_timeout=5.0, auto_reconnect=True):
+        with self._lock:
+            self._devices[name] = ManagedDevice(name, device, connect_timeout, auto_reconnect)
+
+    def state(self, name):
+        return self._devices[name].state
+
+    def is_connected(self, name):
+        return name in self._devices and self._devices[name].state == CONNECTED
+
+    @contextmanager
+    def paused(self, *names):
+        """with の間、指定したデバイスの死活確認を止める（撮影中など）"""
+        entries = [self._devices[name] for name in names if name in self._devices]
+        with self._lock:
+            for entry in entries:
+                entry.holds += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for entry in entries:
+                    entry.holds -= 1
+                    entry.last_check = time.monotonic()
+
+    def _ensure_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(4, len(self._devices) * 2),
+                                                thread_name_prefix="DeviceManager")
+        return self._executor
+
+    def connect_all(self):
+        """全デバイスへ並行して接続し、{名前: 接続できたか} を返す。最も遅いデバイスのタイムアウトまでしか待たない"""
+        executor = self._ensure_executor()
+        entries = list(self._devices.values())
+        futures = {}
+        for entry in entries:
+            self._set_state(entry, CONNECTING)
+            entry.busy = True
+            futures[entry.name] = executor.submit(entry.device.connect)
+        deadline = {entry.name: time.monotonic() + entry.connect_timeout for entry in entries}
+        results = {}
+        for entry in entries:
+            remaining = max(0.0, deadline[entry.name] - time.monotonic())
+            results[entry.name] = self._finish_connect(entry, futures[entry.name], remaining)
+        return results
+
+    def _finish_connect(self, entry, future, timeout):
+        try:
+            connected = bool(future.result(timeout=timeout))
+            detail = None if connected else "接続できませんでした"
+        except FutureTimeoutError:
+            connected, detail = False, f"{entry.connect_timeout:g}秒以内に接続できませんでした"
+            # 時間切れの接続処理が後から成功した場合に備え、終わったら切断しておく
+            future.add_done_callback(lambda f: self._discard_late_connection(entry, f))
+        except Exception as e:
+            connected, detail = False, str(e)
+        entry.busy = False
+        if connected:
+            entry.attempts = 0
+            entry.failures = 0
+            self._set_state(entry, CONNECTED)
+        else:
+            self._schedule_retry(entry, detail)
+        return connected
+
+    def _discard_late_connection(self, entry, future):
+        if future.cancelled() or future.exception() is not None or not future.result():
+            return
+        if entry.state != CONNECTED and not entry.busy:
+            try:
+                entry.device.disconnect()
+            except Exception:
+                pass
+
+    def _schedule_retry(self, entry, detail):
+        if not entry.auto_reconnect:
+            self._set_state(entry, DISCONNECTED, detail)
+            return
+        delay = min(self.backoff_max, self.backoff_initial * (2 ** entry.attempts))
+        entry.attempts += 1
+        entry.next_retry = time.monotonic() + delay
+        self._set_state(entry, RECONNECTING, f"{detail} ({delay:.0f}秒後に再試行)" if detail else None)
+
+    def _set_state(self, entry, state, detail=None):
+        changed = entry.state != state
+        entry.state = state
+        if detail:
+            logger.info(f"{entry.name}: {state} ({detail})")
+        if self.on_status is not None and (changed or detail):
+            try:
+                self.on_status(entry.name, state, detail)
+            except Exception as e:
+                logger.error(f"状態通知の処理中にエラーが発生しました。 {e}")
+
+    def start(self):
+        """バックグラウンドで全デバイスに接続し、その後は死活確認と再接続を続ける"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="DeviceManager", daemon=True)
+        self._thread.start()
+
+    def stop(self, disconnect=True):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.heartbeat_interval + 1.0)
+            self._thread = None
+        if disconnect:
+            for entry in self._devices.values():
+                if entry.state == CONNECTED:
+                    try:
+                        entry.device.disconnect()
+                    except Exception as e:
+                        logger.error(f"{entry.name}の切断中にエラーが発生しました。 {e}")
+                    self._set_state(entry, DISCONNECTED)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _run(self):
+        self.connect_all()
+        while not self._stop_event.wait(min(self.heartbeat_interval, self.backoff_initial)):
+            self.poll()
+
+    def poll(self):
+        """死活確認と、再接続の時刻になったデバイスへの再接続を1回分行う"""
+        now = time.monotonic()
+        for entry in list(self._devices.values()):
+            if entry.busy:
+                continue
+            if entry.state == CONNECTED and now - entry.last_check >= self.heartbeat_interval:
+                if entry.holds or getattr(entry.device, "busy", False):
+                    continue
+                entry.last_check = now
+                self._check(entry)
+            elif entry.state == RECONNECTING and now >= entry.next_retry:
+                self._reconnect(entry)
+
+    def _check(self, entry):
+        executor = self._ensure_executor()
+        entry.busy = True
+        future = executor.submit(entry.device.health_check)
+        try:
+            healthy = bool(future.result(timeout=entry.connect_timeout))
+        except Exception:
+            healthy = False
+        entry.busy = False
+        if healthy:
+            entry.failures = 0
+            return
+        entry.failures += 1
+        # ポートが閉じている（USBが抜けたなど）場合は、回数を待たずに再接続する
+        lost = not getattr(entry.device, "is_connected", True)
+        if not lost and entry.failures < self.failures_before_disconnect:
+            logger.warning(f"{entry.name}から応答がありません。({entry.failures}/{self.failures_before_disconnect})")
+            return
+        logger.warning(f"{entry.name}から応答がありません。再接続します。")
+        try:
+            entry.device.disconnect()
+        except Exception:
+            pass
+        entry.attempts = 0
+        entry.failures = 0
+        self._schedule_retry(entry, "応答がありません")
+
+    def _reconnect(self, entry):
+        try:
+            entry.device.disconnect()
+        except Exception:
+            pass
+        self._set_state(entry, CONNECTING)
+        entry.busy = True
+        future = self._ensure_executor().submit(entry.device.connect)
+        if self._finish_connect(entry, future, entry.connect_timeout):
+            logger.info(f"{entry.name}に再接続しました。")
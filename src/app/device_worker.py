@@ -0,0 +1,160 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackDispatcher:
+    """
+    ワーカースレッドで得た結果をGUIスレッドへ受け渡す。
+    Tkは別スレッドからのウィジェット操作に対応していないため、
+    コールバックはキューに積み、メインループ側で after() により定期的に取り出して実行する。
+    """
+
+    def __init__(self, root=None, interval_ms=30):
+        self.root = root
+        self.interval_ms = interval_ms
+        self._callbacks = queue.SimpleQueue()
+        self._after_id = None
+
+    def post(self, callback, *args):
+        """任意のスレッドから呼び出せる。callback(*args) はGUIスレッドで実行される"""
+        self._callbacks.put((callback, args))
+
+    def start(self):
+        if self.root is not None and self._after_id is None:
+            self._after_id = self.root.after(self.interval_ms, self._poll)
+
+    def stop(self):
+        if self.root is not None and self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+        self._after_id = None
+
+    def process_pending(self):
+        """溜まっているコールバックを全て実行し、実行した件数を返す"""
+        count = 0
+        while True:
+            try:
+                callback, args = self._callbacks.get_nowait()
+            except queue.Empty:
+                return count
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.exception(f"コールバックの実行中にエラーが発生しました。 {e}")
+            count += 1
+
+    def _poll(self):
+        self.process_pending()
+        self._after_id = self.root.after(self.interval_ms, self._poll)
+
+
+class DeviceJob:
+    """DeviceWorkerに投入された1件のコマンド"""
+
+    def __init__(self, description, func, args, kwargs, on_success, on_error, tag=None):
+        self.description = description
+        self.tag = tag # cancel_pending(tag) で種類ごとに取り消すための印
+        self.future = Future()
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._on_success = on_success
+        self._on_error = on_error
+
+    def cancel(self):
+        """まだ実行が始まっていなければ取り消す。取り消せた場合はTrueを返す"""
+        return self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self.future.cancelled()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout=timeout)
+
+
+class DeviceWorker:
+    """
+    1台のデバイスに対するコマンドを専用スレッドで順番に実行する。
+    結果は CallbackDispatcher を通じてGUIスレッドのコールバックに届けられる。
+    """
+
+    def __init__(self, name, dispatcher, on_status=None):
+        self.name = name
+        self.dispatcher = dispatcher
+        # on_status(name, description or None) 実行開始時と終了時に呼ばれる（GUIスレッド）
+        self.on_status = on_status
+        self._jobs = queue.Queue()
+        # 取り消し時に待ち行列を並べ直す間、新しいコマンドが割り込まないようにする
+        self._submit_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"DeviceWorker-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, on_success=None, on_error=None, description=None, tag=None, **kwargs):
+        """func(*args, **kwargs) をワーカースレッドで実行するよう予約し、DeviceJobを返す"""
+        job = DeviceJob(description or getattr(func, "__name__", "command"), func, args, kwargs, on_success, on_error,
+                        tag)
+        with self._submit_lock:
+            self._jobs.put(job)
+        return job
+
+    def cancel_pending(self, tag=None):
+        """
+        実行待ちのコマンドを取り消し、取り消した件数を返す。
+        tag を指定した場合はその印のコマンドだけを取り消し、他のコマンドは順番を保って残す。
+        """
+        cancelled = 0
+        kept = []
+        with self._submit_lock:
+            while True:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    # shutdown() の終了合図は残しておく
+                    kept.append(None)
+                    break
+                if tag is not None and job.tag != tag:
+                    kept.append(job)
+                elif job.cancel():
+                    cancelled += 1
+            for job in kept:
+                self._jobs.put(job)
+        return cancelled
+
+    def shutdown(self, wait=True, timeout=None):
+        """実行待ちのコマンドを取り消してスレッドを終了する"""
+        self.cancel_pending()
+        self._jobs.put(None)
+        if wait:
+            self._thread.join(timeout=timeout)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            self._post_status(job.description)
+            try:
+                result = job._func(*job._args, **job._kwargs)
+            except Exception as e:
+                job.future.set_exception(e)
+                if job._on_error is not None:
+                    self.dispatcher.post(job._on_error, e)
+                else:
+                    logger.error(f"{self.name}のコマンド '{job.description}' が失敗しました。 {e}")
+            else:
+                job.future.set_result(result)
+                if job._on_success is not None:
+                    self.dispatcher.post(job._on_success, result)
+            self._post_status(None)
+
+    def _post_status(self, description):
+        if self.on_status is not None:
+            self.dispatcher.post(self.on_status, self.name, description)
@@ -0,0 +1,169 @@
+"""
+自動撮影の進行状況を記録する追記専用のジャーナル（JSON Lines）。
+
+    {"type": "plan", "run": "...", "sample_name": ..., "steps": [...], "exposures": [...], "completed": [...]}
+    {"type": "step", "run": "...", "index": 0, "output": "..."}
+    {"type": "end",  "run": "..."}
+
+各行は書き込むたびにOSへ渡すため、アプリが落ちても失われない。ディスクへの同期 (fsync) は
+数ステップまたは一定時間ごとにまとめて行い、停電時でも失うのは直近の数ステップ分に留める。
+再開時はジャーナルの記録と保存先の実データを突き合わせ、保存済みのステップだけを飛ばす。
+"""
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from src.app.sequence_planner import SequenceStep
+from src.storage.cube import CubeFormatError, CubeReader
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_NAME = "acquisition.journal"
+# ステップの記録をこの件数または秒数ごとにまとめてfsyncする
+SYNC_EVERY = 8
+SYNC_INTERVAL = 2.0
+
+
+@dataclass
+class JournalRun:
+    """ジャーナルから復元した1回分の撮影"""
+    run_id: str
+    sample_name: str
+    steps: list # SequenceStep のリスト（撮影順）
+    exposures: list
+    output: str = None
+    completed: dict = field(default_factory=dict) # ステップ番号 -> 保存先
+    finished: bool = False
+
+    @property
+    def pending(self):
+        return [i for i in range(len(self.steps)) if i not in self.completed]
+
+    def verified_completed(self):
+        """ジャーナル上で完了しており、保存先にも実際にデータが残っているステップ番号"""
+        done = set()
+        cube_bands = {}
+        for index, output in self.completed.items():
+            if not output or not Path(output).exists():
+                continue
+            if str(output).endswith(".fcube"):
+                if output not in cube_bands:
+                    cube_bands[output] = _saved_cube_bands(output)
+                step = self.steps[index]
+                if (step.led, step.filter) not in cube_bands[output]:
+                    continue
+            done.add(index)
+        return done
+
+
+def _saved_cube_bands(path):
+    try:
+        with CubeReader(path) as reader:
+            return set(reader.available())
+    except (CubeFormatError, OSError, ValueError) as e:
+        logger.warning(f"{path} を読み込めませんでした。保存済みの画像はないものとして扱います。 {e}")
+        return set()
+
+
+class AcquisitionJournal:
+    """撮影の計画と完了したステップを追記していく"""
+
+    def __init__(self, path, sync_every=SYNC_EVERY, sync_interval=SYNC_INTERVAL):
+        self.path = Path(path)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self.run_id = None
+
+    @classmethod
+    def in_directory(cls, directory, **kwargs):
+        return cls(Path(directory) / JOURNAL_NAME, **kwargs)
+
+    def _append(self, record, sync=False):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if sync or self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._file is None or not self._unsynced:
+            return
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def begin(self, sample_name, steps, exposures, output=None, completed=None):
+        """撮影の計画を記録する。再開の場合は completed に保存済みのステップ {番号: 保存先} を渡す"""
+        self.run_id = uuid.uuid4().hex
+        self._append({
+            "type": "plan", "run": self.run_id, "t": time.time(), "sample_name": sample_name,
+            "steps": [{"led": s.led, "filter": s.filter, "slot": s.slot} for s in steps],
+            "exposures": list(exposures), "output": None if output is None else str(output),
+            "completed": {str(i): None if o is None else str(o) for i, o in (completed or {}).items()},
+        }, sync=True)
+        return self.run_id
+
+    def step_done(self, index, output=None):
+        self._append({"type": "step", "run": self.run_id, "index": index,
+                      "output": None if output is None else str(output)})
+
+    def finish(self):
+        """全ステップが保存できたことを記録する（中止や失敗の場合は呼ばず、再開できるようにしておく）"""
+        self._append({"type": "end", "run": self.run_id, "t": time.time()}, sync=True)
+
+    def close(self):
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def load_journal(path):
+    """ジャーナルを読み込み、JournalRunのリストを記録順に返す。途中で切れた最終行は無視する"""
+    runs = {}
+    path = Path(path)
+    if not path.exists():
+        return []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            kind, run_id = record.get("type"), record.get("run")
+            if kind == "plan":
+                runs[run_id] = JournalRun(
+                    run_id, record["sample_name"],
+                    [SequenceStep(s["led"], s["filter"], s["slot"]) for s in record["steps"]],
+                    record["exposures"], record.get("output"),
+                    {int(i): o for i, o in (record.get("completed") or {}).items()},
+                )
+            elif run_id in runs:
+                if kind == "step":
+                    runs[run_id].completed[record["index"]] = record.get("output")
+                elif kind == "end":
+                    runs[run_id].finished = True
+    return list(runs.values())
+
+
+def incomplete_runs(path):
+    """サンプル名 -> 最後まで終わっていない最新の JournalRun。後から撮り直して終わったサンプルは含めない"""
+    latest = {}
+    for run in load_journal(path):
+        latest[run.sample_name] = run
+    return {name: run for name, run in latest.items() if not run.finished}
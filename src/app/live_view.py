@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRingBuffer:
+    """
+    事前に確保した配列に画像を循環して書き込むリングバッファ。
+    撮影スレッドが書き込み、表示側は常に最新の1枚だけを読むため、古い画像は自然に捨てられる。
+    """
+
+    def __init__(self, capacity, shape, dtype=np.uint16):
+        if capacity < 2:
+            raise ValueError("リングバッファの容量は2以上にしてください。")
+        self.capacity = capacity
+        self.frames = np.zeros((capacity,) + tuple(shape), dtype=dtype)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.written = 0 # これまでに書き込んだ枚数（次に書き込む通し番号）
+        self._lock = threading.Lock()
+
+    def push(self, frame, timestamp=None):
+        """画像をコピーして書き込み、その通し番号を返す"""
+        seq = self.written
+        slot = seq % self.capacity
+        np.copyto(self.frames[slot], frame, casting="unsafe")
+        self.timestamps[slot] = time.perf_counter() if timestamp is None else timestamp
+        with self._lock:
+            self.written = seq + 1
+        return seq
+
+    def latest(self):
+        """(通し番号, 画像, 取得時刻) を返す。画像はバッファ上のビューなので早めに使い終えること"""
+        with self._lock:
+            seq = self.written - 1
+        if seq < 0:
+            return None
+        slot = seq % self.capacity
+        return seq, self.frames[slot], self.timestamps[slot]
+
+    def is_valid(self, seq):
+        """seq の画像がまだ上書きされていないか（読み取り中に書き込みが追い越していないか）"""
+        with self._lock:
+            return self.written - seq < self.capacity
+
+
+def downscale(frame, max_height, max_width):
+    """間引きにより max_height × max_width 以内に縮小する（プレビュー用のため補間しない）"""
+    height, width = frame.shape[:2]
+    step = max(1, -(-height // max_height), -(-width // max_width))
+    return frame[::step, ::step]
+
+
+def contrast_stretch(frame, low_percentile=1.0, high_percentile=99.5, out=None):
+    """パーセンタイルで決めた範囲を0〜255に引き伸ばし、uint8画像を返す"""
+    # 範囲の推定は更に間引いた画像で行い、ソートのコストを抑える
+    sample = frame[::4, ::4].ravel()
+    low, high = np.percentile(sample, (low_percentile, high_percentile))
+    scale = 255.0 / max(float(high - low), 1.0)
+    work = np.subtract(frame, low, dtype=np.float32)
+    np.multiply(work, scale, out=work)
+    np.clip(work, 0, 255, out=work)
+    if out is None:
+        out = np.empty(frame.shape, dtype=np.uint8)
+    np.copyto(out, work, casting="unsafe")
+    return out
+
+
+def to_pgm(image):
+    """uint8のグレースケール画像を、Tkの PhotoImage が読めるバイナリPGMに変換する"""
+    height, width = image.shape
+    return b"P5 %d %d 255\n" % (width, height) + np.ascontiguousarray(image).tobytes()
+
+
+@dataclass
+class DisplayFrame:
+    image: np.ndarray # 表示用のuint8画像
+    seq: int
+    latency: float # 撮影完了から表示用画像ができるまでの時間（秒）
+    dropped: int # 前回表示してから読み飛ばした枚数
+
+
+class LiveViewPipeline:
+    """
+    撮影スレッドがリングバッファを埋め、表示側（GUIのタイマー）は最新の1枚だけを縮小・階調補正して受け取る。
+    表示が間に合わない場合は古い画像を捨てるため、遅延もメモリ使用量も増え続けない。
+    """
+
+    def __init__(self, camera, exposure_ms, shape, capacity=4, display_size=(480, 640)):
+        self.camera = camera
+        self.exposure_ms = exposure_ms
+        self.buffer = FrameRingBuffer(capacity, shape)
+        self.display_size = display_size
+        self.frames_displayed = 0
+        self.frames_dropped = 0
+        self.latency = None # 表示遅延の移動平均（秒）
+        self.error = None
+        self._last_seq = -1
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop_event.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._capture_loop, name="LiveViewCapture", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _capture_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                frame = self.camera.capture(self.exposure_ms)
+            except Exception as e:
+                self.error = e
+                logger.error(f"ライブビューの撮影に失敗しました。 {e}")
+                return
+            self.buffer.push(frame)
+
+    def next_display_frame(self):
+        """新しい画像があれば表示用に変換して返す。なければNoneを返す"""
+        latest = self.buffer.latest()
+        if latest is None or latest[0] == self._last_seq:
+            return None
+        seq, frame, timestamp = latest
+        image = contrast_stretch(downscale(frame, *self.display_size))
+        if not self.buffer.is_valid(seq):
+            # 変換中に上書きされた場合は次の機会に回す
+            return None
+        latency = time.perf_counter() - timestamp
+        dropped = max(0, seq - self._last_seq - 1) if self._last_seq >= 0 else 0
+        self._last_seq = seq
+        self.frames_displayed += 1
+        self.frames_dropped += dropped
+        self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+        return DisplayFrame(image, seq, latency, dropped)
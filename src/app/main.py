@@ -1,37 +1,148 @@
 import tkinter as tk
 from tkinter import ttk
 # config_parserをインポートするのを忘れないように
-from src.utils.config_parser import get_config
-from src.hardware.filter_changer import FilterChangerController
+from src.utils.config_parser import PROJECT_ROOT, load_settings, parse_wavelength, subscribe
+from src.utils.tracing import install_log_capture
+from src.hardware.filter_changer import TRACE_DEVICE, FilterChangerController
+from src.hardware.excitation import SYSTEM_XENON, create_excitation_source
+from src.hardware.session_trace import TraceRecorder
+from src.app.device_worker import CallbackDispatcher, DeviceWorker
+from src.app.device_manager import DeviceManager, CONNECTED, CONNECTING, RECONNECTING
+from src.app.sequence_planner import build_steps, plan_sequence
+from src.app.acquisition import AcquisitionEngine
+from src.app.auto_exposure import create_auto_exposure
+from src.app.journal import AcquisitionJournal, JOURNAL_NAME, incomplete_runs
+from src.app.live_view import LiveViewPipeline, to_pgm
+from src.storage.catalog import CATALOG_NAME, Catalog
+from src.storage.cube import CubeFrameWriter, check_sample_name
+import logging
+import sqlite3
+import threading
 import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# ログ欄へまとめて書き込む間隔と、ログ欄に残す最大行数
+LOG_FLUSH_INTERVAL_MS = 200
+LOG_MAX_LINES = 2000
 
 class Application(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("蛍光分光画像撮影システム")
         self.geometry("1024x768")        
+
+        # 各モジュールのログと処理時間はTracerに集め、ログ欄にはタイマーでまとめて表示する
+        self.tracer = install_log_capture()
+        self.tracer.enable_file(PROJECT_ROOT / 'data' / 'logs' / 'trace.jsonl')
+        self._log_seq = self.tracer.last_seq
         
         # 1. フィルターチェンジャー用の「リモコン」を属性として作成
         self.fc_controller = FilterChangerController()
 
+        # デバイス操作はワーカースレッドで実行し、結果はafter()経由でGUIスレッドに戻す
+        self.dispatcher = CallbackDispatcher(self)
+        self.fc_worker = DeviceWorker("フィルター", self.dispatcher, on_status=self._on_worker_status)
+        self.acq_worker = DeviceWorker("自動撮影", self.dispatcher)
+        self.acq_cancel = threading.Event()
+        # 自動撮影中は、手動のフィルター移動・位置の問い合わせを受け付けない（撮影中の画像が乱れるため）
+        self.acquiring = False
+        self.filter_buttons = []
+        # 接続・死活確認・自動再接続はDeviceManagerがまとめて行う（状態はGUIスレッドに渡して表示）
+        self.device_manager = DeviceManager(
+            on_status=lambda name, state, detail: self.dispatcher.post(self._on_device_status, name, state, detail)
+        )
+        self.device_manager.add("フィルター", self.fc_controller)
+        self._filter_ever_connected = False
+
+        # カメラの制御モジュールは未実装（接続されるまでNone）
+        self.camera = None
+        self.excitation = None
+        self.excitation_label = "LED"
+        self.live_view = None
+        self.preview_image = None
+        self.auto_exposure = None
+        # 保存済みデータの一覧表示用の索引（保存先ごとに開く）
+        self.catalog = None
+        self.trace_recorder = None
+        self._browse_samples = []
+        self._browse_bands = []
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
         # --- 設定ファイルから波長リストを読み込んで保持 ---
         self._load_config()
+        self._start_trace_recording()
+        self._create_excitation_source()
         self.create_widgets()
+        # 設定ファイルが書き換えられたら、波長リストを読み直す
+        subscribe(lambda settings: self.dispatcher.post(self._on_settings_changed, settings))
+        self.after(2000, self._check_settings)
 
         # 2. 起動時にデバイスへの接続を試みるメソッドを呼び出す
+        self.dispatcher.start()
+        self.after(LOG_FLUSH_INTERVAL_MS, self._flush_log)
         self._connect_devices()
+        self._report_incomplete_runs()
+        self._load_catalog()
+
+    def _create_excitation_source(self):
+        """settings.ini の system_type に応じて、LEDユニットかキセノンランプを使う"""
+        if self.settings is None:
+            return
+        try:
+            self.excitation = create_excitation_source(self.settings)
+        except ValueError as e:
+            logger.error(f"励起光源の設定エラー: {e}")
+            return
+        system_type = (self.settings.get("System", "system_type") or "").strip().lower()
+        self.excitation_label = "キセノン" if system_type == SYSTEM_XENON else "LED"
+        self.device_manager.add("励起光源", self.excitation)
+
+    def _start_trace_recording(self):
+        """[Trace] record = true なら、フィルターチェンジャーとの通信を記録する（再生による試験用）"""
+        if self.settings is None or (self.settings.get("Trace", "record") or "").strip().lower() != "true":
+            return
+        path = PROJECT_ROOT / 'data' / 'logs' / f"session_{time.strftime('%Y%m%d_%H%M%S')}.jsonl"
+        try:
+            self.trace_recorder = TraceRecorder(path, port=self.fc_controller.port)
+        except OSError as e:
+            logger.error(f"通信の記録ファイル {path} を作成できませんでした。 {e}")
+            return
+        self.fc_controller.serial_factory = self.trace_recorder.serial_factory(TRACE_DEVICE)
+        logger.info(f"フィルターチェンジャーとの通信を記録します: {path}")
 
     def _load_config(self):
         """起動時に設定ファイルを読み込み、波長リストなどを準備する"""
         try:
-            config = get_config()
-            self.filter_options = dict(config.items('FilterWavelengths'))
-            self.led_options = [value for key, value in config.items('LedWavelengths')]
+            self._apply_settings(load_settings())
         except Exception as e:
-            print(f"設定ファイルの読み込みエラー: {e}")
+            logger.error(f"設定ファイルの読み込みエラー: {e}")
             # デフォルト値を設定
+            self.settings = None
             self.filter_options = {"1":"Error", "2":"Error"}
             self.led_options = ["Error"]
+            self.save_directory = "data"
+
+    def _apply_settings(self, settings):
+        self.settings = settings
+        self.filter_options = settings.filter_options
+        self.led_options = settings.led_options
+        self.save_directory = settings.save_directory
+
+    def _check_settings(self):
+        """設定ファイルの更新を定期的に確認する（更新時刻が変わっていなければ読み直さない）"""
+        try:
+            load_settings()
+        except Exception as e:
+            self.add_log(f"設定ファイルを読み込めませんでした: {e}")
+        self.after(2000, self._check_settings)
+
+    def _on_settings_changed(self, settings):
+        self._apply_settings(settings)
+        self.auto_led_combo['values'] = self.led_options
+        self._update_filter_options()
+        self.add_log("設定ファイルの変更を読み込みました。")
 
     def create_widgets(self):
         # --- メインレイアウト ---
@@ -89,6 +200,7 @@ class Application(tk.Tk):
                 command=lambda p=pos: self._move_filter(p)
             )
             button.grid(row=i // 4, column=i % 4, padx=5, pady=5)
+            self.filter_buttons.append(button)
             
         self.current_pos_label = ttk.Label(manual_frame, text="現在位置: - (自動更新)")
         self.current_pos_label.pack(pady=5)
@@ -103,10 +215,11 @@ class Application(tk.Tk):
 
         # ... (他のライブビューウィジェットは変更なし) ...
         ttk.Label(live_frame, text="露光時間 (ms):").grid(row=1, column=0, padx=5, pady=5, sticky="e")
-        live_exp_entry = ttk.Entry(live_frame, width=18)
-        live_exp_entry.grid(row=1, column=1, padx=5, pady=5, sticky="w")
+        self.live_exp_entry = ttk.Entry(live_frame, width=18)
+        self.live_exp_entry.grid(row=1, column=1, padx=5, pady=5, sticky="w")
+        ttk.Button(live_frame, text="自動露光", command=self._auto_live_exposure).grid(row=1, column=2, padx=5, pady=5, sticky="w")
         self.is_live_view = tk.BooleanVar()
-        live_check = ttk.Checkbutton(live_frame, text="ライブビュー開始", variable=self.is_live_view)
+        live_check = ttk.Checkbutton(live_frame, text="ライブビュー開始", variable=self.is_live_view, command=self._toggle_live_view)
         live_check.grid(row=2, column=0, columnspan=2, padx=5, pady=10)
 
     def _populate_auto_tab(self, parent_frame):
@@ -146,18 +259,39 @@ class Application(tk.Tk):
         list_button_frame.pack(side="left", padx=5)
         ttk.Button(list_button_frame, text="選択を削除", command=self._delete_selected_sequence).pack(pady=2)
         ttk.Button(list_button_frame, text="全てクリア", command=self._clear_all_sequences).pack(pady=2)
+        ttk.Button(list_button_frame, text="順番を最適化", command=self._optimize_sequence).pack(pady=2)
         run_frame = ttk.Labelframe(parent_frame, text="撮影実行")
         run_frame.pack(fill="x", padx=10, pady=10)
         ttk.Label(run_frame, text="露光時間 (ms):").grid(row=0, column=0, padx=5, pady=5, sticky="e")
-        exp_entry = ttk.Entry(run_frame, width=20)
-        exp_entry.grid(row=0, column=1, padx=5, pady=5, sticky="w")
+        self.exp_entry = ttk.Entry(run_frame, width=20)
+        self.exp_entry.grid(row=0, column=1, padx=5, pady=5, sticky="w")
+        self.use_auto_exposure = tk.BooleanVar()
+        ttk.Checkbutton(run_frame, text="自動露光", variable=self.use_auto_exposure).grid(row=0, column=2, padx=5, pady=5, sticky="w")
+        ttk.Label(run_frame, text="試料の種類:").grid(row=1, column=2, padx=5, pady=5, sticky="e")
+        self.sample_type_entry = ttk.Entry(run_frame, width=12)
+        self.sample_type_entry.grid(row=1, column=3, padx=5, pady=5, sticky="w")
         ttk.Label(run_frame, text="サンプル名:").grid(row=1, column=0, padx=5, pady=5, sticky="e")
-        name_entry = ttk.Entry(run_frame, width=20)
-        name_entry.grid(row=1, column=1, padx=5, pady=5, sticky="w")
-        ttk.Button(run_frame, text="このシーケンスで撮影開始").grid(row=2, column=1, padx=5, pady=10, sticky="w")
+        self.name_entry = ttk.Entry(run_frame, width=20)
+        self.name_entry.grid(row=1, column=1, padx=5, pady=5, sticky="w")
+        ttk.Button(run_frame, text="このシーケンスで撮影開始", command=self._start_acquisition).grid(row=2, column=1, padx=5, pady=10, sticky="w")
+        ttk.Button(run_frame, text="中止", command=self._cancel_acquisition).grid(row=2, column=0, padx=5, pady=10, sticky="e")
+        ttk.Button(run_frame, text="中断した撮影を再開", command=self._resume_acquisition).grid(row=3, column=1, padx=5, pady=5, sticky="w")
 
     def _create_preview_widgets(self):
-        ttk.Label(self.preview_frame, text="ここに画像が表示されます", font=("Meiryo UI", 16), anchor="center").pack(expand=True)
+        # 保存済みのデータは索引のプレビューで表示する（元の画像ファイルは開かない）
+        browser = ttk.Frame(self.preview_frame)
+        browser.pack(fill="x", padx=5, pady=5)
+        ttk.Label(browser, text="保存済み:").pack(side="left")
+        self.browse_sample_combo = ttk.Combobox(browser, state="readonly", width=24)
+        self.browse_sample_combo.pack(side="left", padx=5)
+        self.browse_sample_combo.bind("<<ComboboxSelected>>", self._on_browse_sample_selected)
+        self.browse_band_combo = ttk.Combobox(browser, state="readonly", width=20)
+        self.browse_band_combo.pack(side="left", padx=5)
+        self.browse_band_combo.bind("<<ComboboxSelected>>", self._show_catalog_preview)
+        ttk.Button(browser, text="更新", command=self._refresh_catalog).pack(side="left", padx=5)
+        ttk.Button(browser, text="保存先を再走査", command=self._index_existing_data).pack(side="left", padx=5)
+        self.preview_label = ttk.Label(self.preview_frame, text="ここに画像が表示されます", font=("Meiryo UI", 16), anchor="center")
+        self.preview_label.pack(expand=True)
 
     def _create_status_widgets(self):
         # ▼▼▼ self.xxx_status_label = のように、属性として保持する形に変更 ▼▼▼
@@ -165,8 +299,11 @@ class Application(tk.Tk):
         self.camera_status_label.pack(side="left", padx=10)
         self.filter_status_label = ttk.Label(self.status_frame, text="フィルター: ⚪ Disconnected")
         self.filter_status_label.pack(side="left", padx=10)
-        self.led_status_label = ttk.Label(self.status_frame, text="LED: ⚪ Disconnected")
+        self.led_status_label = ttk.Label(self.status_frame, text=f"{self.excitation_label}: ⚪ Disconnected")
         self.led_status_label.pack(side="left", padx=10)
+        self.live_status_label = ttk.Label(self.status_frame, text="ライブビュー: 停止")
+        self.live_status_label.pack(side="right", padx=10)
+        ttk.Button(self.status_frame, text="遅延統計", command=self._show_latency_report).pack(side="right", padx=5)
 
     def _create_log_widgets(self, parent_frame):
         self.log_text = tk.Text(parent_frame, height=5, state="disabled") # ユーザーの入力を無効化
@@ -176,44 +313,419 @@ class Application(tk.Tk):
         self.log_text.pack(side="left", fill="both", expand=True, padx=10, pady=5)
 
     def _connect_devices(self):
-        """起動時に各デバイスへの接続を試みる"""
-        if self.fc_controller.connect():
-            # 接続成功時、ステータスラベルを緑にする
-            self.filter_status_label.config(text="フィルター: 🟢 Connected")
-            # 現在位置を取得して表示
-            self._get_filter_position()
+        """起動時に各デバイスへ並行して接続する。切断された場合はDeviceManagerが自動で再接続する"""
+        self.filter_status_label.config(text="フィルター: 🟡 Connecting...")
+        self.device_manager.start()
+
+    def _on_device_status(self, name, state, detail):
+        """DeviceManagerからの状態通知（GUIスレッド）"""
+        icons = {CONNECTED: "🟢 Connected", CONNECTING: "🟡 Connecting...", RECONNECTING: "🟠 Reconnecting..."}
+        text = icons.get(state, "🔴 Disconnected")
+        if name == "フィルター":
+            self.filter_status_label.config(text=f"フィルター: {text}")
+            if state == CONNECTED:
+                self._on_filter_connected()
+        elif name == "励起光源":
+            self.led_status_label.config(text=f"{self.excitation_label}: {text}")
+        if detail:
+            self.add_log(f"{name}: {detail}")
+
+    def _on_filter_connected(self):
+        if self._filter_ever_connected:
+            self.add_log("フィルターチェンジャーに再接続しました。")
         else:
-            # 接続失敗時、ステータスラベルを赤にする
-            self.filter_status_label.config(text="フィルター: 🔴 Disconnected")
+            self.add_log("フィルターチェンジャーに接続しました。")
+        self._filter_ever_connected = True
+        # 現在位置を取得して表示（再接続後は位置が変わっている可能性がある）
+        self._get_filter_position()
 
     def _move_filter(self, position):
         """フィルター移動ボタンが押されたときの処理"""
+        if self.acquiring:
+            self.add_log("自動撮影中はフィルターを手動で移動できません。")
+            return
         pos_int = int(position)
-        if self.fc_controller.move_to(pos_int):
-
-            # ▼▼▼ 物理的な移動が終わるのを2秒間待つ ▼▼▼
-            # 取扱説明書によると最大移動時間は約2秒
-            time.sleep(2)
-
+        # 連打された場合は、まだ実行されていない古い移動要求を取り消して最新の要求だけを残す
+        # （位置の問い合わせなど他のコマンドは、コールバックを待っている処理があるため残す）
+        if self.fc_worker.cancel_pending(tag="move"):
+            self.add_log("実行待ちのフィルター移動を取り消しました。")
+        self.current_pos_label.config(text=f"現在位置: → {pos_int} (移動中)")
+        # move_toはデバイスの'OK'応答（=移動完了）で戻るため、固定時間の待機は不要
+        self.fc_worker.submit(
+            self.fc_controller.move_to,
+            pos_int,
+            on_success=lambda ok: self._on_filter_moved(pos_int, ok),
+            on_error=lambda e: self._on_filter_moved(pos_int, False),
+            description=f"ポジション{pos_int}へ移動",
+            tag="move",
+        )
+
+    def _on_filter_moved(self, position, succeeded):
+        if succeeded:
+            self.add_log(f"フィルターをポジション {position} へ移動しました。")
             # 移動が成功したら、現在位置を自動で更新
             self._get_filter_position()
+        else:
+            self.add_log(f"フィルターのポジション {position} への移動に失敗しました。")
+            self.current_pos_label.config(text="現在位置: 取得失敗")
 
     def _get_filter_position(self):
         """フィルターの現在位置を取得してラベルに表示する"""
-        current_pos = self.fc_controller.get_current_position()
+        if self.acquiring:
+            return # 撮影が終わったときに取得し直す
+        self.fc_worker.submit(
+            self.fc_controller.get_current_position,
+            on_success=self._show_filter_position,
+            on_error=lambda e: self._show_filter_position(None),
+            description="現在位置の取得",
+        )
+
+    def _show_filter_position(self, current_pos):
         if current_pos is not None:
             # ラベルのテキストを更新
             self.current_pos_label.config(text=f"現在位置: {current_pos}")
         else:
             self.current_pos_label.config(text="現在位置: 取得失敗")
 
+    def _on_worker_status(self, name, description):
+        """ワーカーがコマンドを開始・終了したときにログへ記録する"""
+        if description is not None:
+            self.add_log(f"{name}: {description}を実行中...")
+
+    def _start_acquisition(self):
+        """シーケンスリストの順に自動撮影を開始する（撮影はワーカースレッドで実行）"""
+        if self.acquiring:
+            self.add_log("自動撮影の実行中です。")
+            return
+        pairs = [tuple(self.sequence_tree.item(item, "values")) for item in self.sequence_tree.get_children()]
+        if not pairs:
+            self.add_log("撮影シーケンスが空です。")
+            return
+        if self.use_auto_exposure.get():
+            exposure_ms = None # 組み合わせごとに試し撮りで決める
+        else:
+            try:
+                exposure_ms = float(self.exp_entry.get())
+            except ValueError:
+                self.add_log("露光時間を数値で入力してください。")
+                return
+        sample_name = self.name_entry.get().strip()
+        if not sample_name:
+            self.add_log("サンプル名を入力してください。")
+            return
+        try:
+            check_sample_name(sample_name)
+        except ValueError as e:
+            self.add_log(str(e))
+            return
+        if self.camera is None or not self.device_manager.is_connected("励起光源"):
+            self.add_log("カメラまたは励起光源が接続されていないため、撮影を開始できません。")
+            return
+        try:
+            steps = build_steps(pairs, self.filter_options)
+        except ValueError as e:
+            self.add_log(f"撮影を開始できませんでした: {e}")
+            return
+
+        self.add_log(f"自動撮影を開始します: {sample_name} ({len(steps)}枚)")
+        self._submit_acquisition(steps, [exposure_ms] * len(steps), sample_name)
+
+    def _submit_acquisition(self, steps, exposures, sample_name, completed=None, output=None):
+        """撮影をワーカーで実行する。進行状況は保存先のジャーナルに記録し、中断しても再開できるようにする"""
+        try:
+            journal = AcquisitionJournal.in_directory(self.save_directory)
+        except OSError as e:
+            self.add_log(f"保存先 {self.save_directory} に撮影ジャーナルを作成できませんでした: {e}")
+            return
+        try:
+            catalog = Catalog.in_directory(self.save_directory)
+        except (OSError, sqlite3.Error) as e:
+            # 索引がなくても撮影はできる（あとで保存先を読み込み直せば登録される）
+            logger.warning(f"保存先 {self.save_directory} の索引を開けませんでした。 {e}")
+            catalog = None
+        engine = AcquisitionEngine(
+            self.fc_controller, self.camera, self.excitation,
+            CubeFrameWriter.for_steps(self.save_directory, steps, resume=bool(completed), catalog=catalog,
+                                      outputs={sample_name: output} if completed else None),
+            on_step=lambda t: self.dispatcher.post(self._on_acquisition_step, t, len(steps)),
+            journal=journal,
+            auto_exposure=self._get_auto_exposure() if None in exposures else None,
+        )
+        sample_type = self.sample_type_entry.get().strip() or None
+
+        def run():
+            try:
+                # 撮影を始める前に、実行中の手動操作（移動・位置の問い合わせ）が終わるのを待つ
+                self.fc_worker.submit(lambda: None, description="自動撮影の開始待ち").result()
+                # 撮影中はフィルター移動と死活確認の問い合わせが重ならないよう、死活確認を止める
+                with self.device_manager.paused("フィルター", "励起光源"):
+                    return engine.run(steps, exposures, sample_name, self.acq_cancel, completed=completed,
+                                      sample_type=sample_type)
+            finally:
+                journal.close()
+                if catalog is not None:
+                    catalog.close()
+
+        self.acq_cancel.clear()
+        self.fc_worker.cancel_pending(tag="move")
+        self._set_acquiring(True)
+        self.acq_worker.submit(
+            run,
+            on_success=self._on_acquisition_finished,
+            on_error=self._on_acquisition_failed,
+            description="自動撮影",
+        )
+
+    def _set_acquiring(self, acquiring):
+        """自動撮影中はフィルターの手動操作ボタンを無効にする"""
+        self.acquiring = acquiring
+        for button in self.filter_buttons:
+            button.state(["disabled"] if acquiring else ["!disabled"])
+        if not acquiring:
+            self._get_filter_position()
+
+    def _incomplete_runs(self):
+        try:
+            return incomplete_runs(Path(self.save_directory) / JOURNAL_NAME)
+        except OSError as e:
+            logger.error(f"撮影ジャーナルを読み込めませんでした。 {e}")
+            return {}
+
+    def _report_incomplete_runs(self):
+        runs = self._incomplete_runs()
+        if runs:
+            self.add_log(f"中断した撮影があります: {', '.join(runs)}。「中断した撮影を再開」で続きから撮影できます。")
+
+    def _resume_acquisition(self):
+        """ジャーナルに残っている中断した撮影を、保存済みのステップを飛ばして再開する"""
+        if self.acquiring:
+            self.add_log("自動撮影の実行中です。")
+            return
+        runs = self._incomplete_runs()
+        if not runs:
+            self.add_log("再開できる撮影はありません。")
+            return
+        if self.camera is None or not self.device_manager.is_connected("励起光源"):
+            self.add_log("カメラまたは励起光源が接続されていないため、撮影を開始できません。")
+            return
+        # サンプル名欄に入力があればそのサンプルを、なければ最後に中断したサンプルを再開する
+        run = runs.get(self.name_entry.get().strip()) or list(runs.values())[-1]
+        completed = {i: run.completed[i] for i in run.verified_completed()}
+        self.add_log(f"自動撮影を再開します: {run.sample_name} (保存済み {len(completed)}/{len(run.steps)}枚)")
+        self._submit_acquisition(run.steps, run.exposures, run.sample_name, completed, run.output)
+
+    def _on_acquisition_step(self, timing, total):
+        retakes = f", 試し撮り {timing.captures - 1}枚" if timing.captures > 1 else ""
+        self.add_log(
+            f"撮影 {timing.index + 1}/{total}: LED={timing.led}, Filter={timing.filter} "
+            f"(移動 {timing.prepare:.2f}秒, 撮影 {timing.capture:.2f}秒{retakes})"
+        )
+
+    def _get_auto_exposure(self):
+        """自動露光はカメラごとに1つ作り、露光時間のキャッシュを撮影をまたいで使い回す"""
+        if self.auto_exposure is None or self.auto_exposure.camera is not self.camera:
+            self.auto_exposure = create_auto_exposure(self.camera, self.settings)
+        return self.auto_exposure
+
+    def _auto_live_exposure(self):
+        """現在の励起光源とフィルターで露光時間を自動で決め、ライブビューの露光時間に設定する"""
+        if self.camera is None:
+            self.add_log("カメラが接続されていないため、自動露光を実行できません。")
+            return
+        was_running = self.live_view is not None
+        # 試し撮りとライブビューの撮影が重ならないよう、いったん止める
+        self._stop_live_view()
+        self.is_live_view.set(False)
+        led = getattr(self.excitation, "current", None)
+        filter_label = self.filter_options.get(str(self.fc_controller.current_position))
+        sample_type = self.sample_type_entry.get().strip() or None
+        auto_exposure = self._get_auto_exposure()
+        self.add_log("自動露光で露光時間を探しています...")
+
+        def on_found(result):
+            self.live_exp_entry.delete(0, tk.END)
+            self.live_exp_entry.insert(0, f"{result.exposure_ms:.1f}")
+            status = "決まりました" if result.converged else "目標の明るさに届きませんでした"
+            self.add_log(f"自動露光: {result.exposure_ms:.1f} ms に{status} (試し撮り {result.captures}枚)")
+            if was_running:
+                self.is_live_view.set(True)
+                self._toggle_live_view()
+
+        def find():
+            result = auto_exposure.find(led, filter_label, sample_type)
+            auto_exposure.save()
+            return result
+
+        self.acq_worker.submit(find, on_success=on_found,
+                               on_error=lambda e: self.add_log(f"自動露光に失敗しました: {e}"), description="自動露光")
+
+    def _on_acquisition_finished(self, report):
+        self._set_acquiring(False)
+        status = "中止しました" if report.cancelled else "完了しました"
+        self.add_log(f"自動撮影を{status}: {report.summary()}")
+        self._refresh_catalog()
+
+    def _on_acquisition_failed(self, error):
+        self._set_acquiring(False)
+        self.add_log(f"自動撮影が中断されました: {error} (「中断した撮影を再開」で続きから撮影できます)")
+
+    def _get_catalog(self):
+        """保存先の索引を開く（保存先が変わっていれば開き直す）"""
+        directory = Path(self.save_directory)
+        if self.catalog is not None and self.catalog.path.parent != directory:
+            self.catalog.close()
+            self.catalog = None
+        if self.catalog is None:
+            try:
+                self.catalog = Catalog.in_directory(directory)
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"保存先 {directory} の索引を開けませんでした。 {e}")
+        return self.catalog
+
+    def _load_catalog(self):
+        """起動時は索引を読むだけにする。索引のない保存先だけ、保存済みのファイルを走査して索引を作る"""
+        if (Path(self.save_directory) / CATALOG_NAME).exists():
+            self._refresh_catalog()
+        else:
+            self._index_existing_data()
+
+    def _index_existing_data(self):
+        """
+        保存先を走査し、索引にないファイル（索引を作る前の撮影や、他の場所からコピーしたデータ）を
+        ワーカーで索引に登録してから一覧を更新する。走査は時間がかかるため、「保存先を再走査」ボタンで行う。
+        """
+        directory = self.save_directory
+
+        def rebuild():
+            with Catalog.in_directory(directory) as catalog:
+                return catalog.rebuild(directory)
+
+        def on_done(added):
+            if added:
+                self.add_log(f"保存済みのデータ {added}件を索引に登録しました。")
+            self._refresh_catalog()
+
+        self.acq_worker.submit(rebuild, on_success=on_done,
+                               on_error=lambda e: self.add_log(f"保存済みデータの索引を作れませんでした: {e}"),
+                               description="索引の更新")
+
+    def _refresh_catalog(self):
+        """索引から保存済みのサンプル一覧を読み直す"""
+        catalog = self._get_catalog()
+        if catalog is None:
+            return
+        self._browse_samples = catalog.samples()
+        self.browse_sample_combo['values'] = [
+            f"{s['name']} ({s['bands']}枚)" for s in self._browse_samples
+        ]
+
+    def _on_browse_sample_selected(self, event=None):
+        index = self.browse_sample_combo.current()
+        catalog = self._get_catalog()
+        if index < 0 or catalog is None:
+            return
+        self._browse_bands = catalog.bands(sample_id=self._browse_samples[index]["id"])
+        self.browse_band_combo['values'] = [
+            f"{b['excitation']} / {b['emission']} ({b['exposure_ms'] or 0:.0f} ms)" for b in self._browse_bands
+        ]
+        if self._browse_bands:
+            self.browse_band_combo.current(0)
+            self._show_catalog_preview()
+
+    def _show_catalog_preview(self, event=None):
+        index = self.browse_band_combo.current()
+        catalog = self._get_catalog()
+        if index < 0 or catalog is None:
+            return
+        if self.live_view is not None:
+            self.add_log("ライブビュー中は保存済みの画像を表示できません。")
+            return
+        data = catalog.preview(self._browse_bands[index]["id"])
+        if data is None:
+            return
+        if self.preview_image is None:
+            self.preview_image = tk.PhotoImage(data=data, format="PPM")
+            self.preview_label.config(image=self.preview_image, text="")
+        else:
+            self.preview_image.configure(data=data, format="PPM")
+
+    def _cancel_acquisition(self):
+        self.acq_cancel.set()
+        self.add_log("自動撮影の中止を要求しました。")
+
+    def _toggle_live_view(self):
+        """ライブビューのチェックボックスが切り替えられたときの処理"""
+        if not self.is_live_view.get():
+            self._stop_live_view()
+            return
+        if self.camera is None:
+            self.add_log("カメラが接続されていないため、ライブビューを開始できません。")
+            self.is_live_view.set(False)
+            return
+        try:
+            exposure_ms = float(self.live_exp_entry.get())
+        except ValueError:
+            self.add_log("露光時間を数値で入力してください。")
+            self.is_live_view.set(False)
+            return
+        self.live_view = LiveViewPipeline(self.camera, exposure_ms, self.camera.shape)
+        self.live_view.start()
+        self.add_log(f"ライブビューを開始しました。(露光時間 {exposure_ms} ms)")
+        self._update_live_view()
+
+    def _update_live_view(self):
+        """最新の画像だけをプレビューに表示する（表示が追いつかない画像は捨てる）"""
+        if self.live_view is None:
+            return
+        if self.live_view.error is not None:
+            self.add_log(f"ライブビューを停止しました: {self.live_view.error}")
+            self.is_live_view.set(False)
+            self._stop_live_view()
+            return
+        frame = self.live_view.next_display_frame()
+        if frame is not None:
+            if self.preview_image is None:
+                self.preview_image = tk.PhotoImage(data=to_pgm(frame.image), format="PPM")
+                self.preview_label.config(image=self.preview_image, text="")
+            else:
+                self.preview_image.configure(data=to_pgm(frame.image), format="PPM")
+            self.live_status_label.config(
+                text=f"ライブビュー: 表示遅延 {self.live_view.latency * 1000:.0f} ms / 破棄 {self.live_view.frames_dropped}枚"
+            )
+        self.after(15, self._update_live_view)
+
+    def _stop_live_view(self):
+        if self.live_view is None:
+            return
+        self.live_view.stop()
+        self.live_view = None
+        self.live_status_label.config(text="ライブビュー: 停止")
+        self.add_log("ライブビューを停止しました。")
+
+    def _on_close(self):
+        """ウィンドウを閉じる際にワーカーを止め、デバイスを切断する"""
+        if self.live_view is not None:
+            self.live_view.stop()
+        self.acq_cancel.set()
+        self.acq_worker.shutdown(wait=False)
+        self.fc_worker.shutdown(wait=False)
+        self.dispatcher.stop()
+        # DeviceManagerを止めると、接続中のデバイスも切断される
+        self.device_manager.stop()
+        if self.catalog is not None:
+            self.catalog.close()
+        if self.trace_recorder is not None:
+            self.trace_recorder.close()
+        self.tracer.disable_file()
+        self.destroy()
+
     def _add_to_sequence_list(self):
         """選択された波長の組み合わせをシーケンスリストに追加する"""
         led = self.auto_led_combo.get()
         filt = self.auto_filter_combo.get()
 
         if not led or not filt:
-            print("励起波長と放射フィルターの両方を選択してください。")
+            self.add_log("励起波長と放射フィルターの両方を選択してください。")
             # ここでユーザーに警告メッセージを出すのが親切（将来的に実装）
             return
             
@@ -221,41 +733,48 @@ class Application(tk.Tk):
         self.add_log(f"シーケンス追加: LED={led}, Filter={filt}")
 
     def add_log(self, message):
-        """ログウィジェットにタイムスタンプ付きでメッセージを追加する"""
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        log_message = f"[{timestamp}] {message}\n"
-        
-        # ウィジェットを一時的に有効化してテキストを挿入
-        self.log_text.config(state="normal")
-        self.log_text.insert("end", log_message)
-        self.log_text.config(state="disabled") # 再び読み取り専用に
-        
-        # 自動で一番下にスクロール
-        self.log_text.see("end")
-
-    def _parse_wavelength(self, wavelength_str):
-        """'365nm'のような文字列から数値部分を抽出する。失敗した場合はNoneを返す。"""
-        try:
-            # 'nm'などの非数値文字をすべて取り除く
-            return int(''.join(filter(str.isdigit, wavelength_str)))
-        except (ValueError, TypeError):
-            return None
+        """メッセージをログに記録する。ログ欄への表示は _flush_log がまとめて行う"""
+        self.tracer.log(message, source="gui")
+
+    def _flush_log(self):
+        """前回から溜まったログを、ウィジェットへの1回の書き込みでまとめて表示する"""
+        events = self.tracer.events_since(self._log_seq)
+        if events:
+            self._log_seq = events[-1]["seq"]
+            lines = [
+                f"[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e['t']))}] {e['message']}\n"
+                for e in events if e["kind"] == "log"
+            ]
+            if lines:
+                # ウィジェットを一時的に有効化してテキストを挿入
+                self.log_text.config(state="normal")
+                self.log_text.insert("end", "".join(lines))
+                # 古い行を削除して、ログ欄が際限なく大きくならないようにする
+                excess = int(self.log_text.index("end-1c").split(".")[0]) - LOG_MAX_LINES
+                if excess > 0:
+                    self.log_text.delete("1.0", f"{excess + 1}.0")
+                self.log_text.config(state="disabled") # 再び読み取り専用に
+
+                # 自動で一番下にスクロール
+                self.log_text.see("end")
+        self.after(LOG_FLUSH_INTERVAL_MS, self._flush_log)
+
+    def _show_latency_report(self):
+        """コマンドごとの遅延統計をログ欄に表示する"""
+        report = self.tracer.report()
+        self.add_log("遅延統計:\n" + report if report else "まだ計測結果がありません。")
 
     def _update_filter_options(self, event=None):
         """励起波長の選択に応じて、放射フィルターの選択肢を更新する"""
         selected_led_str = self.auto_led_combo.get()
-        led_wavelength = self._parse_wavelength(selected_led_str)
 
-        if led_wavelength is None:
-            # 励起波長が不正な場合は、全てのフィルターを選択可能にする
+        if self.settings is None:
             valid_filters = list(self.filter_options.values())
         else:
-            # 励起波長より長い波長のフィルターのみをリストアップ
-            valid_filters = []
-            for pos, filt_str in self.filter_options.items():
-                filt_wavelength = self._parse_wavelength(filt_str)
-                if filt_wavelength is not None and filt_wavelength > led_wavelength:
-                    valid_filters.append(filt_str)
+            # 励起波長より長い波長のフィルターのみをリストアップ（波長は起動時に数値化済み）
+            # 励起波長が不正な場合は、全てのフィルターを選択可能にする
+            led_wavelength = self.settings.led_nm.get(selected_led_str, parse_wavelength(selected_led_str))
+            valid_filters = self.settings.filters_above(led_wavelength)
 
         # 放射フィルターコンボボックスの選択肢を更新
         self.auto_filter_combo['values'] = valid_filters
@@ -291,6 +810,30 @@ class Application(tk.Tk):
         
         self.add_log("全てのシーケンスをクリアしました。")
 
+    def _optimize_sequence(self):
+        """フィルターホイールの移動時間が最小になるようにシーケンスリストを並べ替える"""
+        all_items = self.sequence_tree.get_children()
+        if not all_items:
+            self.add_log("並べ替えるシーケンスがありません。")
+            return
+
+        pairs = [tuple(self.sequence_tree.item(item, "values")) for item in all_items]
+        try:
+            plan = plan_sequence(pairs, self.filter_options, start_position=self.fc_controller.current_position)
+        except ValueError as e:
+            self.add_log(f"シーケンスを最適化できませんでした: {e}")
+            return
+
+        for item in all_items:
+            self.sequence_tree.delete(item)
+        for step in plan.steps:
+            self.sequence_tree.insert("", "end", values=(step.led, step.filter))
+
+        self.add_log(
+            f"シーケンスを並べ替えました。推定移動時間: {plan.naive_time:.1f}秒 → {plan.estimated_time:.1f}秒 "
+            f"({plan.saving:.1f}秒短縮)"
+        )
+
 if __name__ == '__main__':
     app = Application()
-    app.mainloop()
+    app.mainloop()
\ No newline at end of file
@@ -0,0 +1,137 @@
+from dataclasses import dataclass, field
+
+from src.hardware.filter_changer import NUM_POSITIONS, SLOT_MOVE_TIME, slot_distance
+from src.utils.config_parser import parse_wavelength
+
+
+@dataclass(frozen=True)
+class MoveCostModel:
+    """シーケンスの所要時間を見積もるためのコストモデル（単位は秒）"""
+    slot_move_time: float = SLOT_MOVE_TIME  # フィルターホイールを1スロット回す時間
+    move_overhead: float = 0.1              # 移動1回ごとの通信・停止判定の時間
+    led_switch_time: float = 0.05           # 励起LEDを切り替える時間
+    num_positions: int = NUM_POSITIONS
+
+    def filter_move_time(self, start, end):
+        if start == end:
+            return 0.0
+        if start is None:
+            # 現在位置が不明な場合は最長距離（半周）を仮定する
+            return (self.num_positions // 2) * self.slot_move_time + self.move_overhead
+        return slot_distance(start, end, self.num_positions) * self.slot_move_time + self.move_overhead
+
+    def led_switch(self, current, new):
+        return 0.0 if current == new else self.led_switch_time
+
+
+@dataclass(frozen=True)
+class SequenceStep:
+    led: str
+    filter: str
+    slot: int
+
+
+@dataclass
+class SequencePlan:
+    steps: list = field(default_factory=list)
+    estimated_time: float = 0.0  # 並べ替え後の移動時間の見積もり
+    naive_time: float = 0.0      # 入力順のまま実行した場合の見積もり
+
+    @property
+    def saving(self):
+        return self.naive_time - self.estimated_time
+
+
+def _slot_lookup(filter_slots):
+    """{ポジション: 'ラベル'} の辞書から {'ラベル': ポジション番号} を作る"""
+    lookup = {}
+    for pos, label in filter_slots.items():
+        lookup.setdefault(label, int(pos))
+    return lookup
+
+
+def build_steps(pairs, filter_slots):
+    """(励起LED, 放射フィルター) の組を、フィルターのポジション番号付きのステップに変換する"""
+    lookup = _slot_lookup(filter_slots)
+    steps = []
+    for led, filt in pairs:
+        if filt not in lookup:
+            raise ValueError(f"フィルター '{filt}' は設定ファイルのFilterWavelengthsにありません。")
+        steps.append(SequenceStep(led, filt, lookup[filt]))
+    return steps
+
+
+def estimate_sequence_time(steps, cost_model, start_position=None, start_led=None):
+    """steps を順に実行したときのフィルター移動とLED切り替えの合計時間（秒）"""
+    total = 0.0
+    position, led = start_position, start_led
+    for step in steps:
+        total += cost_model.filter_move_time(position, step.slot)
+        total += cost_model.led_switch(led, step.led)
+        position, led = step.slot, step.led
+    return total
+
+
+def _shortest_slot_order(slots, cost_model, start_position):
+    """全てのスロットを一度ずつ訪れる最短の順番を求める（部分集合DP、スロットは最大8個）"""
+    n = len(slots)
+    if n == 0:
+        return []
+    full = (1 << n) - 1
+    # best[(mask, last)] = (コスト, 直前のスロット番号)
+    best = {}
+    for i, slot in enumerate(slots):
+        best[(1 << i, i)] = (cost_model.filter_move_time(start_position, slot), None)
+    for mask in range(1, full + 1):
+        for last in range(n):
+            if (mask, last) not in best:
+                continue
+            cost, _ = best[(mask, last)]
+            for nxt in range(n):
+                if mask & (1 << nxt):
+                    continue
+                key = (mask | (1 << nxt), nxt)
+                new_cost = cost + cost_model.filter_move_time(slots[last], slots[nxt])
+                if key not in best or new_cost < best[key][0]:
+                    best[key] = (new_cost, last)
+    last = min(range(n), key=lambda i: best[(full, i)][0])
+    order, mask = [], full
+    while last is not None:
+        order.append(slots[last])
+        prev = best[(mask, last)][1]
+        mask &= ~(1 << last)
+        last = prev
+    return list(reversed(order))
+
+
+def plan_sequence(pairs, filter_slots, cost_model=None, start_position=None, start_led=None):
+    """
+    (励起LED, 放射フィルター) の組のリストを、フィルターホイールの移動が最小になる順番に並べ替える。
+    同じフィルターの撮影をまとめ、ホイールを最短経路で回る順にグループを並べる。
+    グループ内では直前と同じLEDから始め、残りは波長順にしてLEDの切り替えを抑える。
+    """
+    cost_model = cost_model or MoveCostModel()
+    naive_steps = build_steps(pairs, filter_slots)
+
+    groups = {}
+    for step in naive_steps:
+        groups.setdefault(step.slot, []).append(step)
+
+    ordered = []
+    led = start_led
+    for slot in _shortest_slot_order(list(groups), cost_model, start_position):
+        group = sorted(groups[slot], key=lambda s: (s.led != led, _wavelength_key(s.led)))
+        ordered.extend(group)
+        led = group[-1].led
+
+    return SequencePlan(
+        steps=ordered,
+        estimated_time=estimate_sequence_time(ordered, cost_model, start_position, start_led),
+        naive_time=estimate_sequence_time(naive_steps, cost_model, start_position, start_led),
+    )
+
+
+def _wavelength_key(label):
+    # 波長の書かれていないラベルは最後に回す
+    wavelength = parse_wavelength(label)
+    return (wavelength is None, wavelength or 0, label)
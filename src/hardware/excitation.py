@@ -0,0 +1,71 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# settings.ini の [System] system_type に指定できる値
+SYSTEM_LED = "led"
+SYSTEM_XENON = "xenon"
+
+
+class ExcitationSource:
+    """
+    励起光源の共通インターフェース。LEDユニット (LedController) とキセノンランプ (XenonController) が実装する。
+    光源はLEDのラベル（'280nm' など、settings.ini の [LedWavelengths] の値）で指定する。
+    """
+
+    def connect(self):
+        return True
+
+    def disconnect(self):
+        pass
+
+    @property
+    def is_connected(self):
+        return True
+
+    def health_check(self):
+        return self.is_connected
+
+    def select(self, led):
+        """led を点灯（キセノンの場合はその波長を選択してシャッターを開く）。成功すればTrueを返す"""
+        raise NotImplementedError
+
+    def off(self):
+        """消灯（シャッターを閉じる）"""
+        raise NotImplementedError
+
+    def upload_schedule(self, leds):
+        """
+        これから select() する順番をまとめて事前に伝える。対応していない光源では何もせずTrueを返す。
+        予定どおりの順に select() すれば、光源側は準備済みの設定に切り替えるだけで済む。
+        """
+        return True
+
+
+def create_excitation_source(settings, allow_experimental=False):
+    """
+    settings.ini の [System] system_type に応じた励起光源を作る（接続はしない）。
+    キセノンランプ (MAX-303) はコマンドが未確認の試験中の実装のため、allow_experimental=True の場合だけ作る
+    （GUIとバッチ撮影は指定しないため、実機で使われることはない）。
+    """
+    system_type = (settings.get("System", "system_type", SYSTEM_LED) or SYSTEM_LED).strip().lower()
+    if system_type == SYSTEM_LED:
+        from src.hardware.led_controller import DEFAULT_PORT, LedController
+
+        return LedController(
+            host=settings.get("LedController", "host", "raspberrypi.local"),
+            port=int(settings.get("LedController", "port", DEFAULT_PORT)),
+            leds=list(settings.led_options),
+        )
+    if system_type == SYSTEM_XENON:
+        if not allow_experimental:
+            raise ValueError("キセノンランプ (MAX-303) の制御は取扱説明書でコマンドを確認中のため、まだ使えません。")
+        from src.hardware.xenon_controller import XenonController
+
+        return XenonController(
+            port=settings.get("XenonLamp", "port"),
+            baudrate=int(settings.get("XenonLamp", "baudrate", 9600)),
+            filter_positions=dict(settings.sections.get("XenonFilters", {})),
+            experimental=True,
+        )
+    raise ValueError(f"system_type '{system_type}' は不明です。'{SYSTEM_LED}' か '{SYSTEM_XENON}' を指定してください。")
@@ -1,64 +1,252 @@
+import logging
+import re
 import serial
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from src.utils.config_parser import load_settings
+from src.utils.tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+tracer = get_tracer()
+
+# 受信スレッドが停止要求を確認する間隔（秒）。データ到着時は即座に復帰する。
+READ_POLL_INTERVAL = 0.2
+
+NUM_POSITIONS = 8
+# 取扱説明書によると最大移動時間(半周=4スロット)は約2秒。1スロットあたりの目安時間
+SLOT_MOVE_TIME = 0.5
+# 移動時間の見積もりに上乗せする、通信と停止判定のための余裕（秒）
+MOVE_TIMEOUT_MARGIN = 1.0
+# 移動の応答待ちの下限（秒）
+MIN_MOVE_TIMEOUT = 3.0
+# 'F?' への応答の形式。移動コマンドの応答（OK など）と区別するために使う
+POSITION_REPLY = re.compile(r"^F(\d+)$")
+# 直近この時間内に応答があれば、死活確認のための 'F?' を省略する（秒）
+HEALTH_CHECK_IDLE_TIME = 2.0
+# 通信を記録・再生するときのデバイス名
+TRACE_DEVICE = "fc8"
+
+
+def slot_distance(start, end, num_positions=NUM_POSITIONS):
+    """ホイールが start から end へ回るときのスロット数（近い方向へ回る前提）"""
+    steps = abs(end - start) % num_positions
+    return min(steps, num_positions - steps)
+
+
+def estimate_move_time(start, end, num_positions=NUM_POSITIONS):
+    """移動にかかる時間の見積もり（秒）。現在位置が不明な場合は最長距離とみなす"""
+    if start is None:
+        return (num_positions // 2) * SLOT_MOVE_TIME
+    return slot_distance(start, end, num_positions) * SLOT_MOVE_TIME
+
+
+def worst_case_move_time(start, end, num_positions=NUM_POSITIONS):
+    """
+    遠回りした場合の移動時間（秒）。ホイールが常に近い方向へ回るかは取扱説明書で確認できていないため、
+    応答待ちの時間はこちらで見積もる。現在位置が不明なら1周近く回る場合とみなす
+    """
+    if start is None:
+        return (num_positions - 1) * SLOT_MOVE_TIME
+    steps = (end - start) % num_positions
+    return max(steps, (num_positions - steps) % num_positions) * SLOT_MOVE_TIME
 
-from src.utils.config_parser import get_config
 
 class FilterChangerController:
-    # ... (__init__, connect, disconnectメソッドは変更なし) ...
-    def __init__(self):
-        print("FilterChangerControllerを初期化します...")
+    def __init__(self, port=None, baudrate=None, serial_factory=None):
+        logger.debug("FilterChangerControllerを初期化します...")
+        self.ser = None
+        # serial.Serial と同じ引数でポートを開く関数（通信の記録・再生用に差し替えられる）
+        self.serial_factory = serial_factory or serial.Serial
+        self._reader_thread = None
+        self._stop_event = threading.Event()
+        # 応答待ちのコマンド (Future, 応答の判定関数) の送信順の列。受信スレッドが先頭から応答を割り当てる
+        self._pending = deque()
+        # 応答を待ちきれなかったコマンドがあり、遅れて届く応答で位置が分からなくなっている
+        self._link_dirty = False
+        self._lock = threading.Lock()
+        # 最後に応答で確認できたポジション（不明ならNone）
+        self.current_position = None
+        self.last_move_duration = None
+        self.last_response_time = None
         try:
-            config = get_config()
-            self.port = config.get('FilterChanger', 'port')
-            self.baudrate = config.getint('FilterChanger', 'baudrate')
-            self.ser = None
-            print(f"設定を読み込みました: Port={self.port}, Baudrate={self.baudrate}")
+            if port is None or baudrate is None:
+                settings = load_settings()
+                port = port or settings.filter_changer_port
+                baudrate = baudrate or settings.filter_changer_baudrate
+            self.port = port
+            self.baudrate = baudrate
+            logger.debug(f"設定を読み込みました: Port={self.port}, Baudrate={self.baudrate}")
         except Exception as e:
-            print(f"エラー: 設定ファイルの読み込みに失敗しました。 {e}")
+            logger.error(f"設定ファイルの読み込みに失敗しました。 {e}")
             self.port = None
 
     def connect(self):
         if self.port is None:
-            print("エラー: ポートが設定されていません。")
+            logger.error("ポートが設定されていません。")
             return False
         try:
-            print(f"{self.port}への接続を試みます...")
-            self.ser = serial.Serial(self.port, self.baudrate, timeout=1)
+            logger.info(f"{self.port}への接続を試みます...")
+            self.ser = self.serial_factory(self.port, self.baudrate, timeout=READ_POLL_INTERVAL)
 
             # ▼▼▼ 接続直後にバッファをクリアする処理を追加 ▼▼▼
             self.ser.reset_input_buffer()
+            self._start_reader()
 
-            print("接続に成功しました。")
+            logger.info("接続に成功しました。")
             return True
         except serial.SerialException as e:
-            print(f"エラー: {self.port}に接続できませんでした。 詳細: {e}")
+            logger.error(f"{self.port}に接続できませんでした。 詳細: {e}")
             self.ser = None
             return False
 
     def disconnect(self):
         if self.ser and self.ser.is_open:
-            self.ser.close()
-            print("接続を切断しました。")
+            self._stop_reader()
+            try:
+                self.ser.close()
+            except (serial.SerialException, OSError) as e:
+                # USBを抜かれた後などは閉じる処理自体が失敗することがある
+                logger.warning(f"ポートを閉じる際にエラーが発生しました。 {e}")
+            logger.info("接続を切断しました。")
         else:
-            print("INFO: 既に接続が切断されています。")
+            self._stop_reader()
+            logger.info("既に接続が切断されています。")
+        self.ser = None
+        self.current_position = None
+        self._link_dirty = False
+
+    @property
+    def is_connected(self):
+        """ポートが開いていて、受信スレッドが動いているか（USBが抜けると受信スレッドが止まる）"""
+        return bool(self.ser and self.ser.is_open and self._reader_thread is not None
+                    and self._reader_thread.is_alive())
+
+    def health_check(self):
+        """
+        デバイスが応答するかを確認する。直近に応答があった場合は通信せずにTrueを返し、
+        移動などのコマンドの邪魔をしないようにする。
+        """
+        if not self.is_connected:
+            return False
+        if self.busy:
+            # 移動などの応答待ち。問い合わせを後ろに並べると移動が終わるまで応答がなく、時間切れになる
+            return True
+        if self.last_response_time is not None and time.monotonic() - self.last_response_time < HEALTH_CHECK_IDLE_TIME:
+            return True
+        return self.get_current_position() is not None
+
+    def _start_reader(self):
+        """応答を行単位で受け取る受信スレッドを起動する"""
+        self._stop_event.clear()
+        self._reader_thread = threading.Thread(
+            target=self._reader_loop, name=f"FC8-reader-{self.port}", daemon=True
+        )
+        self._reader_thread.start()
 
-    def _read_response(self, timeout_sec=2.0):
+    def _stop_reader(self):
+        self._stop_event.set()
+        if self._reader_thread is not None and self._reader_thread is not threading.current_thread():
+            self._reader_thread.join(timeout=1.0)
+        self._reader_thread = None
+        self._cancel_pending()
+
+    def _cancel_pending(self):
+        """応答待ちのコマンドは全て失敗として扱う"""
+        with self._lock:
+            while self._pending:
+                self._pending.popleft()[0].cancel()
+
+    def _reader_loop(self):
         """
-        デバイスからの応答をタイムアウト付きで読み取る。
-        指定時間内に応答（改行コードを含む）がなければNoneを返す。
+        シリアルポートを読み続け、改行で区切った応答を待機中のコマンドへ渡す。
+        read()はデータが届いた時点で戻るため、ポーリングによる待ち時間は発生しない。
         """
-        start_time = time.time()
-        while time.time() - start_time < timeout_sec:
-            if self.ser.in_waiting > 0:
-                response = self.ser.readline().decode('ascii').strip()
+        buffer = bytearray()
+        while not self._stop_event.is_set():
+            try:
+                chunk = self.ser.read(self.ser.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError, AttributeError) as e:
+                if not self._stop_event.is_set():
+                    logger.error(f"受信中に接続が失われました。 {e}")
+                    # 応答を待っているコマンドをタイムアウトまで待たせない
+                    self._cancel_pending()
+                break
+            if not chunk:
+                continue
+            buffer.extend(chunk)
+            while b"\n" in buffer:
+                line, _, rest = buffer.partition(b"\n")
+                buffer = bytearray(rest)
+                response = line.decode('ascii', errors='replace').strip()
                 if response: # 空の応答は無視する
-                    print(f"応答: {response}")
-                    return response
-            time.sleep(0.05) # CPU負荷を抑えるための短い待機
-        
-        # タイムアウトした場合
-        print(f"エラー: {timeout_sec}秒以内に応答がありませんでした。")
-        return None
+                    self._dispatch_response(response)
+
+    def _dispatch_response(self, response):
+        """
+        受信した1行を、最も古い応答待ちコマンドに割り当てる。
+        応答には対応するコマンドの識別子がないため、形式が合わない応答（タイムアウトしたコマンドへの
+        遅れた応答など）は割り当てずに破棄する。
+        """
+        self.last_response_time = time.monotonic()
+        with self._lock:
+            head = self._pending[0] if self._pending else None
+            if head is not None and head[1](response):
+                self._pending.popleft()
+            else:
+                head = None
+        if head is None:
+            logger.info("要求していない応答を破棄しました: %s", response)
+            return
+        logger.debug("応答: %s", response)
+        head[0].set_result(response)
+
+    @property
+    def busy(self):
+        """応答待ちのコマンドがあるか（移動中など）"""
+        return bool(self._pending)
+
+    def _send_command(self, command, timeout_sec=2.0, accept=None):
+        """
+        コマンドを送信し、その応答をタイムアウト付きで待つ。
+        受信スレッドが応答を届けた瞬間に戻る。指定時間内に応答がなければNoneを返す。
+        accept(応答) がFalseを返す行はこのコマンドへの応答とみなさない（省略時は全て受け付ける）。
+        """
+        future = Future()
+        entry = (future, accept or (lambda response: True))
+        # 送信から応答までの時間をスパンとして記録する
+        span_start = time.perf_counter()
+        status = "ok"
+        with self._lock:
+            self._pending.append(entry)
+            logger.debug("コマンド送信: %s", command.strip())
+            try:
+                self.ser.write(command.encode('ascii'))
+            except Exception:
+                self._pending.remove(entry)
+                raise
+        try:
+            return future.result(timeout=timeout_sec)
+        except FutureTimeoutError:
+            status = "timeout"
+            # 待機列から外す。デバイスは遅れて応答する可能性があるため、次のコマンドの前に位置を確認し直す
+            with self._lock:
+                try:
+                    self._pending.remove(entry)
+                except ValueError:
+                    pass
+            self._link_dirty = True
+            logger.error(f"{timeout_sec}秒以内に応答がありませんでした。")
+            return None
+        except Exception:
+            # 切断によってキャンセルされた場合
+            status = "disconnected"
+            logger.error("応答を待っている間に接続が切断されました。")
+            return None
+        finally:
+            tracer.record_span("fc.command", time.perf_counter() - span_start, status, command=command.strip())
 
     def move_to(self, position: int):
         """
@@ -66,73 +254,96 @@ class FilterChangerController:
         position: 1から8の整数
         """
         if not (self.ser and self.ser.is_open):
-            print("エラー: 接続されていません。")
+            logger.error("接続されていません。")
             return False
         
-        if not 1 <= position <= 8:
-            print(f"エラー: ポジションは1から8の間で指定してください。指定値: {position}")
+        if not 1 <= position <= NUM_POSITIONS:
+            logger.error(f"ポジションは1から{NUM_POSITIONS}の間で指定してください。指定値: {position}")
             return False
             
-        try:
-            self.ser.reset_input_buffer()   
+        # 前のコマンドの応答が遅れて届く可能性がある間は、その 'OK' を今回の移動完了と取り違えないよう先に同期する
+        if self._link_dirty and not self._resync():
+            logger.error("フィルターチェンジャーの状態を確認できないため、移動を中止しました。")
+            return False
 
+        try:
             # 取扱説明書p.17のコマンド形式 'Fnnn' + CR/LF
-            command = f"F{position}\r\n"
-            print(f"コマンド送信: {command.strip()}")
-            self.ser.write(command.encode('ascii'))
-            
-            # 応答が来るまで待機する (移動には時間がかかる可能性があるため、タイムアウトを長めに設定)
-            response = self._read_response(timeout_sec=5.0)
+            # 'OK' の応答で移動完了とみなす。タイムアウトは回転するスロット数から決める
+            timeout_sec = self.move_timeout(position)
+            distance = None if self.current_position is None else slot_distance(self.current_position, position)
+            start_time = time.perf_counter()
+            # 'F?' への応答（位置）が紛れ込んでも移動の完了とはみなさない
+            response = self._send_command(f"F{position}\r\n", timeout_sec=timeout_sec,
+                                          accept=lambda reply: not POSITION_REPLY.match(reply))
             
             if response and "OK" in response:
-                print(f"ポジション {position} への移動が完了しました。")
+                self.current_position = position
+                self.last_move_duration = time.perf_counter() - start_time
+                tracer.record_span("fc.move", self.last_move_duration, position=position, distance=distance)
+                logger.info(f"ポジション {position} への移動が完了しました。({self.last_move_duration:.2f}秒)")
                 return True
             else:
-                print("エラー: 予期しない応答がありました。")
+                # 移動できたか分からないため、次回は最長距離のタイムアウトを使う
+                self.current_position = None
+                tracer.record_span("fc.move", time.perf_counter() - start_time, "failed",
+                                   position=position, distance=distance)
+                logger.error("予期しない応答がありました。")
                 return False
         except Exception as e:
-            print(f"エラー: コマンドの送信中にエラーが発生しました。 {e}")
+            logger.error(f"コマンドの送信中にエラーが発生しました。 {e}")
             return False
 
+    def move_timeout(self, position):
+        """position への移動応答を待つ時間（秒）。どちら向きに回っても間に合うよう遠回りの場合で見積もる"""
+        return max(MIN_MOVE_TIMEOUT, worst_case_move_time(self.current_position, position) + MOVE_TIMEOUT_MARGIN)
+
+    def resync_timeout(self):
+        """同期し直すときの 'F?' の応答待ち時間。実行中の移動が終わるまで応答が来ないため、最長の移動を見込む"""
+        return max(MIN_MOVE_TIMEOUT, worst_case_move_time(None, 1) + MOVE_TIMEOUT_MARGIN)
+
+    def _resync(self):
+        """
+        タイムアウトしたコマンドの遅れた応答を読み捨て、'F?' で現在位置を確認し直す。
+        デバイスはコマンドを順に処理するため、'F?' の応答が届いた時点で前のコマンドは終わっている。
+        """
+        logger.info("応答が途切れたため、フィルターチェンジャーの位置を確認し直します。")
+        try:
+            self.ser.reset_input_buffer()
+        except (serial.SerialException, OSError) as e:
+            logger.warning(f"受信バッファを破棄できませんでした。 {e}")
+        self._link_dirty = False
+        if self._query_position(self.resync_timeout()) is None:
+            self._link_dirty = True
+            return False
+        return True
+
+    def _query_position(self, timeout_sec=2.0):
+        # 取扱説明書p.17の問い合わせ形式 'F?'。移動の応答 'OK' などが遅れて届いても位置の応答とはみなさない
+        response = self._send_command("F?\r\n", timeout_sec=timeout_sec, accept=POSITION_REPLY.match)
+        if response is None:
+            return None
+        position = int(POSITION_REPLY.match(response).group(1))
+        self.current_position = position
+        logger.debug("現在のポジションは %d です。", position)
+        return position
+
     def get_current_position(self):
         """現在のフィルターポジションを問い合わせ、数値で返す。"""
         if not (self.ser and self.ser.is_open):
-            print("エラー: 接続されていません。")
+            logger.error("接続されていません。")
             return None
-        
-        try:
-            # ▼▼▼ 送信前にバッファをクリア ▼▼▼
-            self.ser.reset_input_buffer()
 
-            # 取扱説明書p.17の問い合わせ形式 'F?'
-            command = "F?\r\n"
-            print(f"コマンド送信: {command.strip()}")
-            self.ser.write(command.encode('ascii'))
-            
-            # 応答が来るまで待機する
-            response = self._read_response()
-            
-            if response and "F" in response:
-                try:
-                    # 応答文字列から'F'で分割し、最後の要素（数値のはず）を取得
-                    position_str = response.strip().split('F')[-1]
-                    position = int(position_str)
-
-                    print(f"現在のポジションは {position} です。")
-                    return position
-                except (ValueError, IndexError):
-                    print(f"エラー: 応答 '{response}' から数値を抽出できませんでした。")
-                    return None
-            else:
-                print(f"エラー: 応答に 'F' が含まれていませんでした。 (応答: {response})")
-                return None
-            
+        try:
+            if self._link_dirty:
+                return self.current_position if self._resync() else None
+            return self._query_position()
         except Exception as e:
-            print(f"エラー: 問い合わせ中にエラーが発生しました。 {e}")
+            logger.error(f"問い合わせ中にエラーが発生しました。 {e}")
             return None
 
 # --- このファイルが直接実行された場合のテストコード ---
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     fc_controller = FilterChangerController()
     
     if fc_controller.port:
@@ -142,13 +353,9 @@ if __name__ == '__main__':
             print("\nステップ1: ポジション3へ移動します。")
             fc_controller.move_to(3)
             
-            time.sleep(2) # 2秒待機
-            
             print("\nステップ2: ポジション1へ戻します。")
             fc_controller.move_to(1)
             
-            time.sleep(2) # 2秒待機
-            
             fc_controller.disconnect()
             
         print("--- テストが完了しました ---")
\ No newline at end of file
@@ -0,0 +1,172 @@
+import json
+import logging
+import socket
+import threading
+import time
+
+from src.hardware.excitation import ExcitationSource
+from src.utils.tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+tracer = get_tracer()
+
+DEFAULT_PORT = 5005
+CONNECT_TIMEOUT = 3.0
+# 応答待ちの上限（リレーの切り替えを含む）
+RESPONSE_TIMEOUT = 2.0
+
+
+class LedController(ExcitationSource):
+    """
+    Raspberry Pi の制御ユニット経由で紫外線LEDを切り替える。
+    Piとは1本のTCP接続を保ち、1行1つのJSONでコマンドをやり取りする。
+
+        → {"id": 1, "cmd": "select", "led": "280nm"}
+        ← {"id": 1, "ok": true}
+
+    コマンド: ping / select / off / schedule (leds: 点灯順のリスト) / next (予定の次のLEDを点灯)
+    撮影前に schedule で点灯順を送っておけば、各ステップは短い next を送るだけで済み、
+    同じLEDが続くステップでは通信自体を省略できる。
+    複数のコマンドは1回の送信にまとめられ、応答は送った順に返ってくる。
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, leds=None, timeout=RESPONSE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.leds = leds # 既知のLEDのラベル（Noneなら確認しない）
+        self.timeout = timeout
+        self.current = None
+        self.sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._schedule = []
+        self._schedule_index = 0
+
+    # --- 接続 ---
+    def connect(self):
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        except OSError as e:
+            logger.error(f"LED制御ユニット ({self.host}:{self.port}) に接続できませんでした。 {e}")
+            return False
+        # 短いコマンドをすぐに送るため、Nagleアルゴリズムを無効にする
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        with self._lock:
+            self.sock = sock
+            self._reader = sock.makefile("rb")
+            self._schedule = []
+        if self._request_many([{"cmd": "ping"}]) is None:
+            self.disconnect()
+            return False
+        logger.info(f"LED制御ユニット ({self.host}:{self.port}) に接続しました。")
+        return True
+
+    def disconnect(self):
+        with self._lock:
+            self._close_socket()
+        self.current = None
+
+    def _close_socket(self):
+        for closable in (self._reader, self.sock):
+            if closable is not None:
+                try:
+                    closable.close()
+                except OSError:
+                    pass
+        self._reader = None
+        self.sock = None
+        self._schedule = []
+
+    @property
+    def is_connected(self):
+        return self.sock is not None
+
+    def health_check(self):
+        return self.is_connected and self._request_many([{"cmd": "ping"}]) is not None
+
+    # --- 通信 ---
+    def _request_many(self, requests):
+        """
+        複数のコマンドを1回で送信し、同じ順の応答のリストを返す。
+        通信できなかった場合は接続を閉じてNoneを返す（次回は再接続が必要）。
+        """
+        with self._lock:
+            if self.sock is None:
+                return None
+            lines = []
+            for request in requests:
+                request = {"id": self._next_id, **request}
+                self._next_id += 1
+                lines.append(json.dumps(request, ensure_ascii=False))
+            start = time.perf_counter()
+            status = "ok"
+            try:
+                self.sock.sendall(("\n".join(lines) + "\n").encode("utf-8"))
+                replies = []
+                for _ in requests:
+                    line = self._reader.readline()
+                    if not line:
+                        raise ConnectionError("LED制御ユニットが接続を閉じました。")
+                    replies.append(json.loads(line))
+                return replies
+            except (OSError, ValueError) as e:
+                status = "timeout" if isinstance(e, socket.timeout) else "disconnected"
+                logger.error(f"LED制御ユニットとの通信に失敗しました。 {e}")
+                self._close_socket()
+                return None
+            finally:
+                tracer.record_span("led.command", time.perf_counter() - start, status,
+                                   commands=len(requests), cmd=requests[0]["cmd"])
+
+    def _request(self, request):
+        replies = self._request_many([request])
+        if replies is None:
+            return False
+        reply = replies[0]
+        if not reply.get("ok"):
+            logger.error(f"LED制御ユニットがコマンド {request['cmd']} を拒否しました: {reply.get('error')}")
+            return False
+        return True
+
+    # --- 点灯制御 ---
+    def upload_schedule(self, leds):
+        """
+        点灯順をまとめて送る。不明なLEDが含まれていれば撮影を始める前にFalseを返す。
+        同じLEDが続く部分は切り替えが不要なので、Piには切り替わる順番だけを送る。
+        """
+        leds = list(leds)
+        if self.leds is not None:
+            unknown = sorted(set(leds) - set(self.leds))
+            if unknown:
+                logger.error(f"設定にないLEDが指定されました: {', '.join(unknown)}")
+                return False
+        changes = [led for i, led in enumerate(leds) if i == 0 or led != leds[i - 1]]
+        if not self._request({"cmd": "schedule", "leds": changes}):
+            return False
+        self._schedule = leds
+        self._schedule_index = 0
+        self.current = None
+        return True
+
+    def select(self, led):
+        if self._schedule_index < len(self._schedule) and self._schedule[self._schedule_index] == led:
+            self._schedule_index += 1
+            if led == self.current:
+                # 予定どおり同じLEDが続く場合は通信しない
+                return True
+            ok = self._request({"cmd": "next"})
+        else:
+            # 予定と異なる順で呼ばれた場合は、予定を破棄して個別に切り替える
+            self._schedule = []
+            ok = self._request({"cmd": "select", "led": led})
+        self.current = led if ok else None
+        return ok
+
+    def off(self):
+        self._schedule = []
+        if self.is_connected:
+            self._request({"cmd": "off"})
+        self.current = None
+
@@ -0,0 +1,430 @@
+"""
+実機での通信を記録し、実機なしで再生する。
+
+TraceRecorder はシリアルポートの送受信（'F3', 'F?' とその応答）とカメラの撮影時間を、
+時刻付きでJSON Linesのファイルに書き出す。
+
+    {"kind": "serial", "t": 0.0123, "device": "fc8", "dir": "tx", "data": "F3\\r\\n"}
+    {"kind": "frame", "t": 0.52, "exposure_ms": 100, "duration": 0.105, "shape": [480, 640], ...}
+    {"kind": "auto_exposure", "t": 0.9, "led": "280nm", "filter": "400nm", "exposure_ms": 812.5, "history": [...], ...}
+
+TraceReplay は記録したファイルから、同じコントローラのクラスに渡せる擬似ポートと擬似カメラを作る。
+送信されたコマンドが記録と一致すれば、記録された応答を記録と同じ間隔（speed 倍速）で返す。
+再生する画像は明るさが一様で自動露光の判断が記録と変わってしまうため、自動露光は記録した露光時間をなぞる。
+通信手順を変えたときは mismatches に食い違いが残るため、現場の記録に対する回帰試験や遅延の比較に使える。
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import serial
+
+logger = logging.getLogger(__name__)
+
+TRACE_VERSION = 1
+# 撮影画像の明るさとして記録するパーセンタイルと、そのときの間引き間隔
+FRAME_LEVEL_PERCENTILE = 99.5
+FRAME_DECIMATION = 4
+
+
+class ReplayMismatch(serial.SerialException):
+    """再生中に送られたコマンドが記録と一致しなかった"""
+
+
+@dataclass
+class Mismatch:
+    """再生中の記録との食い違い。kind は "serial"・"frame"・"auto_exposure"、index は記録の何件目か（0から）"""
+    kind: str
+    index: int
+    expected: object
+    actual: object
+
+    LABELS = {"serial": ("通信", "送信"), "frame": ("撮影", "再生"), "auto_exposure": ("自動露光", "再生")}
+
+    @staticmethod
+    def _format(kind, value):
+        if value is None:
+            return "なし"
+        if kind == "serial":
+            return repr(_encode(value))
+        if kind == "frame":
+            return f"{value:g} ms"
+        if kind == "auto_exposure":
+            return "/".join(str(v) for v in value)
+        return repr(value)
+
+    def __str__(self):
+        name, action = self.LABELS.get(self.kind, (self.kind, "再生"))
+        return (f"{name} {self.index}: 記録 {self._format(self.kind, self.expected)}, "
+                f"{action} {self._format(self.kind, self.actual)}")
+
+
+def _encode(data):
+    # latin-1なら任意のバイト列を1文字ずつ対応させて戻せる
+    return bytes(data).decode("latin-1")
+
+
+def _decode(text):
+    return text.encode("latin-1")
+
+
+class TraceRecorder:
+    """
+    通信と撮影のイベントを、記録開始からの経過時間付きで1行ずつファイルに追記する。
+    1ファイルには1回分の記録だけを書く（既にあるファイルには書かず FileExistsError）。
+    """
+
+    def __init__(self, path, **meta):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "x", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._write({"kind": "meta", "version": TRACE_VERSION,
+                     "created": time.strftime("%Y-%m-%dT%H:%M:%S"), **meta})
+
+    def _write(self, event):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            # 異常終了しても直前までの記録が残るよう、1件ごとに書き出す
+            self._file.flush()
+
+    def record(self, kind, t=None, **fields):
+        if t is None:
+            t = time.perf_counter() - self._start
+        self._write({"kind": kind, "t": round(t, 6), **fields})
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def serial_factory(self, device):
+        """serial.Serial と同じ引数でポートを開き、送受信を device の名前で記録する関数を返す"""
+        def open_port(*args, **kwargs):
+            return RecordingSerial(serial.Serial(*args, **kwargs), self, device)
+        return open_port
+
+    def wrap_camera(self, camera):
+        return RecordingCamera(camera, self)
+
+    def wrap_auto_exposure(self, auto_exposure):
+        return RecordingAutoExposure(auto_exposure, self)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class RecordingSerial:
+    """シリアルポートをそのまま使いながら、書き込みと読み出しを記録する"""
+
+    def __init__(self, ser, recorder, device):
+        self._ser = ser
+        self._recorder = recorder
+        self.device = device
+
+    def write(self, data):
+        self._recorder.record("serial", device=self.device, dir="tx", data=_encode(data))
+        return self._ser.write(data)
+
+    def read(self, size=1):
+        data = self._ser.read(size)
+        if data:
+            self._recorder.record("serial", device=self.device, dir="rx", data=_encode(data))
+        return data
+
+    def reset_input_buffer(self):
+        self._ser.reset_input_buffer()
+
+    def close(self):
+        self._ser.close()
+
+    @property
+    def in_waiting(self):
+        return self._ser.in_waiting
+
+    @property
+    def is_open(self):
+        return self._ser.is_open
+
+
+class RecordingCamera:
+    """カメラの撮影時間と画像の明るさを記録する（画像そのものは記録しない）"""
+
+    def __init__(self, camera, recorder):
+        self._camera = camera
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._camera, name)
+
+    def capture(self, exposure_ms):
+        start = self._recorder.elapsed()
+        frame = self._camera.capture(exposure_ms)
+        duration = self._recorder.elapsed() - start
+        level = float(np.percentile(np.asarray(frame)[::FRAME_DECIMATION, ::FRAME_DECIMATION], FRAME_LEVEL_PERCENTILE))
+        self._recorder.record("frame", t=start, exposure_ms=exposure_ms, duration=round(duration, 6),
+                              shape=list(frame.shape), dtype=str(frame.dtype), level=level)
+        return frame
+
+
+class RecordingAutoExposure:
+    """自動露光 (AutoExposure) の判断（試した露光時間と決まった露光時間）を記録する"""
+
+    def __init__(self, auto_exposure, recorder):
+        self._auto_exposure = auto_exposure
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._auto_exposure, name)
+
+    def find(self, led=None, filter_label=None, sample_type=None, initial_ms=None):
+        result = self._auto_exposure.find(led, filter_label, sample_type, initial_ms)
+        self._recorder.record("auto_exposure", led=led, filter=filter_label, sample_type=sample_type,
+                              exposure_ms=result.exposure_ms, captures=result.captures,
+                              converged=result.converged, level=result.level, history=list(result.history))
+        return result
+
+
+def load_trace(path):
+    """記録ファイルを読み込み、(メタ情報, イベントのリスト) を返す。壊れた行は読み飛ばす"""
+    meta, events = {}, []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            try:
+                event = json.loads(line)
+            except ValueError:
+                logger.warning(f"{path} の {number}行目を読み飛ばしました。")
+                continue
+            if event.get("kind") == "meta":
+                meta = event
+            else:
+                events.append(event)
+    return meta, events
+
+
+class ReplaySerial:
+    """
+    記録した送受信を再生する擬似シリアルポート（serial.Serial のうちコントローラが使う部分だけを持つ）。
+    コマンドが書き込まれると、記録でそのコマンドの後に届いた応答を、記録と同じ間隔の speed 分の1で返す。
+    """
+
+    def __init__(self, events, speed=1.0, timeout=None, device=None):
+        self.timeout = timeout
+        self.speed = speed
+        self.device = device
+        self.mismatches = []
+        self.sent = []
+        self.is_open = True
+        self._events = [e for e in events if e.get("kind") == "serial"
+                        and (device is None or e.get("device") == device)]
+        self._next = 0
+        self._scheduled = deque()  # (届く時刻, データ)
+        self._buffer = bytearray()
+        self._cond = threading.Condition()
+        # 最初のコマンドより前に届いた応答は、ポートを開いた時刻を基準にする
+        self._schedule_replies(self._events[0]["t"] if self._events else 0.0, time.monotonic())
+
+    def _schedule_replies(self, trace_time, real_time):
+        while self._next < len(self._events) and self._events[self._next]["dir"] == "rx":
+            event = self._events[self._next]
+            due = real_time + max(0.0, event["t"] - trace_time) / self.speed
+            self._scheduled.append((due, _decode(event["data"])))
+            self._next += 1
+
+    def _release_due(self):
+        now = time.monotonic()
+        while self._scheduled and self._scheduled[0][0] <= now:
+            self._buffer.extend(self._scheduled.popleft()[1])
+
+    def write(self, data):
+        data = bytes(data)
+        with self._cond:
+            if not self.is_open:
+                raise serial.SerialException("ポートが閉じられています。")
+            self.sent.append(data)
+            expected = self._events[self._next] if self._next < len(self._events) else None
+            if expected is None or _decode(expected["data"]) != data:
+                recorded = None if expected is None else _decode(expected["data"])
+                self.mismatches.append(Mismatch("serial", self._next, recorded, data))
+                raise ReplayMismatch(f"記録と異なるコマンドが送られました: {data!r} (記録: {recorded!r})")
+            self._next += 1
+            self._schedule_replies(expected["t"], time.monotonic())
+            self._cond.notify_all()
+        return len(data)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if not self.is_open:
+                    raise serial.SerialException("ポートが閉じられています。")
+                self._release_due()
+                if self._buffer:
+                    data = bytes(self._buffer[:size])
+                    del self._buffer[:size]
+                    return data
+                now = time.monotonic()
+                wait = None if deadline is None else deadline - now
+                if wait is not None and wait <= 0:
+                    return b""
+                if self._scheduled:
+                    until_due = self._scheduled[0][0] - now
+                    wait = until_due if wait is None else min(wait, until_due)
+                self._cond.wait(wait)
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            self._release_due()
+            return len(self._buffer)
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._release_due()
+            self._buffer.clear()
+
+    def close(self):
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+    @property
+    def remaining(self):
+        """まだ送られていない記録中のコマンドの数"""
+        return sum(1 for e in self._events[self._next:] if e["dir"] == "tx")
+
+
+class ReplayCamera:
+    """記録した撮影時間で、記録した明るさの一様な画像を返す擬似カメラ"""
+
+    def __init__(self, events, speed=1.0):
+        self.speed = speed
+        self.mismatches = []
+        self._frames = deque(e for e in events if e.get("kind") == "frame")
+        self._index = 0
+        first = self._frames[0] if self._frames else {"shape": [480, 640]}
+        self.shape = tuple(first["shape"])
+        self._lock = threading.Lock()
+
+    def capture(self, exposure_ms):
+        with self._lock:
+            if not self._frames:
+                raise ReplayMismatch("記録にない撮影が行われました。")
+            event = self._frames.popleft()
+            if event["exposure_ms"] != exposure_ms:
+                self.mismatches.append(Mismatch("frame", self._index, event["exposure_ms"], exposure_ms))
+            self._index += 1
+        time.sleep(event["duration"] / self.speed)
+        return np.full(tuple(event["shape"]), event["level"], dtype=np.dtype(event["dtype"]))
+
+    @property
+    def remaining(self):
+        return len(self._frames)
+
+
+@dataclass
+class ReplayedExposure:
+    """記録から再現した自動露光の結果（AutoExposure.find が返す ExposureResult と同じ項目）"""
+    exposure_ms: float
+    frame: np.ndarray
+    captures: int
+    converged: bool
+    level: float
+    history: list = field(default_factory=list)
+
+
+class ReplayAutoExposure:
+    """
+    記録した自動露光の判断をなぞる。記録と同じ露光時間で試し撮りし、記録と同じ露光時間に決める。
+    露光時間のキャッシュは読み書きしない。
+    """
+
+    def __init__(self, events, camera):
+        self.camera = camera
+        self.mismatches = []
+        self._decisions = deque(e for e in events if e.get("kind") == "auto_exposure")
+        self._index = 0
+        self._lock = threading.Lock()
+
+    def find(self, led=None, filter_label=None, sample_type=None, initial_ms=None):
+        with self._lock:
+            if not self._decisions:
+                raise ReplayMismatch("記録にない自動露光が行われました。")
+            event = self._decisions.popleft()
+            index = self._index
+            self._index += 1
+            if (event["led"], event["filter"]) != (led, filter_label):
+                self.mismatches.append(Mismatch("auto_exposure", index, (event["led"], event["filter"]),
+                                                (led, filter_label)))
+        frame = None
+        for exposure_ms in event["history"]:
+            captured = self.camera.capture(exposure_ms)
+            if exposure_ms == event["exposure_ms"]:
+                frame = captured
+        return ReplayedExposure(event["exposure_ms"], frame, event["captures"], event["converged"],
+                                event["level"], list(event["history"]))
+
+    def save(self):
+        pass
+
+    @property
+    def remaining(self):
+        return len(self._decisions)
+
+
+class TraceReplay:
+    """
+    記録ファイル1つ分の再生。serial_factory() をコントローラに渡し、camera() をカメラの代わりに使う。
+    speed=1.0 で記録と同じ速さ、大きくするほど速く再生する（float('inf') なら待たずに応答する）。
+    """
+
+    def __init__(self, path, speed=1.0):
+        if not speed > 0:
+            raise ValueError(f"再生の速さは正の値にしてください: {speed}")
+        self.meta, self.events = load_trace(path)
+        self.speed = speed
+        self.ports = []
+        self.cameras = []
+        self.auto_exposures = []
+
+    def serial_factory(self, device=None):
+        def open_port(port=None, baudrate=None, timeout=None, **kwargs):
+            replay = ReplaySerial(self.events, self.speed, timeout=timeout, device=device)
+            self.ports.append(replay)
+            return replay
+        return open_port
+
+    def camera(self):
+        camera = ReplayCamera(self.events, self.speed)
+        self.cameras.append(camera)
+        return camera
+
+    def recorded(self, kind):
+        """kind の種類のイベントが記録にあるか"""
+        return any(e.get("kind") == kind for e in self.events)
+
+    def auto_exposure(self, camera):
+        """記録した自動露光の判断を、camera（通常は camera() の擬似カメラ）で撮りながら再生する"""
+        auto_exposure = ReplayAutoExposure(self.events, camera)
+        self.auto_exposures.append(auto_exposure)
+        return auto_exposure
+
+    @property
+    def mismatches(self):
+        return [m for source in self.ports + self.cameras + self.auto_exposures for m in source.mismatches]
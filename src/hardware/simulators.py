@@ -0,0 +1,349 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+import numpy as np
+
+from src.hardware.excitation import ExcitationSource
+
+
+class FakeSerialDevice:
+    """
+    擬似端末(pty)上でシリアル機器の応答を模擬する基底クラス。
+    受信した1行ごとに respond() の戻り値を返す。実機なしで通信や遅延を確認するために使う。
+    ptyはLinux/macOSにしかないため、pty関係のモジュールは start() の中で読み込む
+    （Windowsでもこのモジュールの SimulatedCamera などは使える）。
+    """
+
+    name = "FakeSerial"
+
+    def __init__(self, response_delay=0.0):
+        self.response_delay = response_delay
+        self.silent = False # Trueにすると応答を返さない（タイムアウト試験用）
+        self.received = []
+        self.port = None
+        self._master_fd = None
+        self._slave_fd = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """ptyを開いて応答スレッドを起動し、接続先のポート名を返す"""
+        if not hasattr(os, "openpty"):
+            raise RuntimeError(f"{self.name} はptyが使えるOS (Linux/macOS) でのみ使えます。")
+        import tty
+
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._serve, name=self.name, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        for fd in (self._master_fd, self._slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self._master_fd = self._slave_fd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _serve(self):
+        import select
+
+        buffer = bytearray()
+        while not self._stop_event.is_set():
+            readable, _, _ = select.select([self._master_fd], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                buffer.extend(os.read(self._master_fd, 1024))
+            except OSError:
+                break
+            while b"\n" in buffer:
+                line, _, rest = buffer.partition(b"\n")
+                buffer = bytearray(rest)
+                command = line.decode('ascii', errors='replace').strip()
+                if command:
+                    self._handle(command)
+
+    def _handle(self, command):
+        self.received.append(command)
+        if self.silent:
+            return
+        reply = self.respond(command)
+        if self.response_delay:
+            time.sleep(self.response_delay)
+        os.write(self._master_fd, f"{reply}\r\n".encode('ascii'))
+
+    def respond(self, command):
+        """1つのコマンドに対する応答文字列を返す"""
+        raise NotImplementedError
+
+
+class FakeFC8Device(FakeSerialDevice):
+    """FC8-25Aの擬似デバイス。'F{n}' で移動して 'OK'、'F?' で 'F{n}' を返す"""
+
+    name = "FakeFC8"
+
+    def __init__(self, num_positions=8, initial_position=1, response_delay=0.0, move_time_per_slot=0.0):
+        super().__init__(response_delay)
+        self.num_positions = num_positions
+        self.position = initial_position
+        self.move_time_per_slot = move_time_per_slot
+
+    def respond(self, command):
+        """移動時間もここで模擬する"""
+        if command == "F?":
+            return f"F{self.position}"
+        if command.startswith("F"):
+            try:
+                target = int(command[1:])
+            except ValueError:
+                return "ERR"
+            if not 1 <= target <= self.num_positions:
+                return "ERR"
+            distance = abs(target - self.position)
+            distance = min(distance, self.num_positions - distance)
+            time.sleep(distance * self.move_time_per_slot)
+            self.position = target
+            return "OK"
+        return "ERR"
+
+
+class FakeMax303Device(FakeSerialDevice):
+    """MAX-303の擬似デバイス。'S1'/'S0' でシャッター開閉、'F{n}' で内蔵フィルター回転、'S?' で状態を返す"""
+
+    name = "FakeMAX303"
+
+    def __init__(self, num_filters=8, response_delay=0.0):
+        super().__init__(response_delay)
+        self.num_filters = num_filters
+        self.filter_position = 1
+        self.shutter_open = False
+
+    def respond(self, command):
+        if command in ("S0", "S1"):
+            self.shutter_open = command == "S1"
+            return "OK"
+        if command == "S?":
+            return f"S{int(self.shutter_open)} F{self.filter_position}"
+        if command.startswith("F"):
+            try:
+                target = int(command[1:])
+            except ValueError:
+                return "ERR"
+            if not 1 <= target <= self.num_filters:
+                return "ERR"
+            self.filter_position = target
+            return "OK"
+        return "ERR"
+
+
+class FakeLedServer:
+    """
+    Raspberry Pi のLED制御ユニットの代わりに、ローカルでJSON行のコマンドに応答するTCPサーバー。
+    LedController の試験や、実機なしでの動作確認に使う。
+    """
+
+    def __init__(self, leds=None, host="127.0.0.1", port=0, switch_time=0.0):
+        self.leds = leds # 受け付けるLEDのラベル（Noneなら全て受け付ける）
+        self.switch_time = switch_time
+        self.current = None
+        self.schedule = []
+        self.schedule_index = 0
+        self.received = []
+        self.switches = 0 # 実際にLEDを切り替えた回数
+        self._lock = threading.Lock()
+        # port=0 の場合は空いているポートが割り当てられる（address で確認できる）
+        self._server = socketserver.ThreadingTCPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._connections = set()
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        """待ち受けを開始し、(ホスト, ポート) を返す"""
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={"poll_interval": 0.05},
+                                        name="FakeLedServer", daemon=True)
+        self._thread.start()
+        return self.address
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        # 接続中のクライアントも切断し、Piの電源が落ちた状態を模擬する
+        for connection in list(self._connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                server._connections.add(self.request)
+
+            def finish(self):
+                server._connections.discard(self.request)
+                try:
+                    super().finish()
+                except OSError:
+                    pass
+
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line)
+                    except ValueError:
+                        reply = {"ok": False, "error": "invalid json"}
+                    else:
+                        reply = {"id": request.get("id"), **server.respond(request)}
+                    self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+        return Handler
+
+    def _switch(self, led):
+        if self.leds is not None and led is not None and led not in self.leds:
+            return {"ok": False, "error": f"unknown led {led}"}
+        if led != self.current:
+            time.sleep(self.switch_time)
+            self.switches += 1
+        self.current = led
+        return {"ok": True, "led": led}
+
+    def respond(self, request):
+        """1つのコマンドを処理して応答の辞書を返す"""
+        with self._lock:
+            cmd = request.get("cmd")
+            self.received.append(cmd)
+            if cmd == "ping":
+                return {"ok": True}
+            if cmd == "select":
+                return self._switch(request.get("led"))
+            if cmd == "off":
+                self.schedule = []
+                return self._switch(None)
+            if cmd == "schedule":
+                leds = list(request.get("leds") or [])
+                unknown = [led for led in leds if self.leds is not None and led not in self.leds]
+                if unknown:
+                    return {"ok": False, "error": f"unknown led {unknown[0]}"}
+                self.schedule, self.schedule_index = leds, 0
+                return {"ok": True, "steps": len(leds)}
+            if cmd == "next":
+                if self.schedule_index >= len(self.schedule):
+                    return {"ok": False, "error": "schedule finished"}
+                led = self.schedule[self.schedule_index]
+                self.schedule_index += 1
+                return self._switch(led)
+            return {"ok": False, "error": f"unknown command {cmd}"}
+
+
+class SimulatedExcitationSource(ExcitationSource):
+    """励起光源の代わりに、選択されたLEDを記録するだけの擬似デバイス"""
+
+    def __init__(self, switch_time=0.0):
+        self.switch_time = switch_time
+        self.current = None
+
+    def select(self, led):
+        time.sleep(self.switch_time)
+        self.current = led
+        return True
+
+    def off(self):
+        self.current = None
+
+
+class SimulatedCamera:
+    """
+    合成した16bit蛍光画像を返す擬似カメラ。
+    ランダムに配置した粒子（ガウス形状）に背景とノイズを加え、明るさは露光時間に比例させる。
+    spectrum(excitation, filter_position) を与えると、励起・放射の組ごとに粒子の明るさを変えられる。
+    """
+
+    def __init__(self, shape=(480, 640), num_particles=20, readout_time=0.0, exposure_scale=0.0,
+                 excitation=None, filter_changer=None, spectrum=None, seed=0):
+        self.shape = shape
+        self.readout_time = readout_time
+        # 実際に待つ時間 = 露光時間 × exposure_scale（0なら露光を待たない）
+        self.exposure_scale = exposure_scale
+        self.excitation = excitation
+        self.filter_changer = filter_changer
+        self.spectrum = spectrum
+        self.background = 100.0
+        self._rng = np.random.default_rng(seed)
+        self.particles = self._make_particles(num_particles)
+        self.frames_captured = 0
+
+    def _make_particles(self, num_particles):
+        """全粒子を合わせた輝度分布（1ms露光あたりのカウント）を作る"""
+        height, width = self.shape
+        yy, xx = np.mgrid[0:height, 0:width]
+        profile = np.zeros(self.shape, dtype=np.float32)
+        for _ in range(num_particles):
+            cy, cx = self._rng.uniform(0, height), self._rng.uniform(0, width)
+            sigma = self._rng.uniform(2.0, 6.0)
+            brightness = self._rng.uniform(5.0, 30.0)
+            profile += brightness * np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * sigma ** 2)).astype(np.float32)
+        return profile
+
+    def capture(self, exposure_ms):
+        time.sleep(exposure_ms / 1000.0 * self.exposure_scale + self.readout_time)
+        gain = 1.0
+        if self.spectrum is not None:
+            excitation = self.excitation.current if self.excitation is not None else None
+            position = getattr(self.filter_changer, "current_position", None)
+            gain = self.spectrum(excitation, position)
+        signal = self.particles * (gain * exposure_ms) + self.background
+        frame = signal + self._rng.normal(0.0, 1.0, self.shape) * np.sqrt(signal)
+        self.frames_captured += 1
+        return np.clip(frame, 0, 65535).astype(np.uint16)
+
+
+# --- このファイルが直接実行された場合は、擬似デバイスに対する往復遅延を計測します ---
+if __name__ == '__main__':
+    from src.hardware.filter_changer import FilterChangerController
+
+    with FakeFC8Device() as device:
+        fc_controller = FilterChangerController(port=device.port, baudrate=9600)
+        if fc_controller.connect():
+            latencies = []
+            for _ in range(50):
+                start = time.perf_counter()
+                fc_controller.get_current_position()
+                latencies.append((time.perf_counter() - start) * 1000)
+            fc_controller.disconnect()
+            latencies.sort()
+            print(f"F? 往復遅延: 中央値 {latencies[len(latencies) // 2]:.2f} ms, 最大 {latencies[-1]:.2f} ms")
@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+
+import serial
+
+from src.hardware.excitation import ExcitationSource
+from src.utils.tracing import get_tracer
+
+logger = logging.getLogger(__name__)
+tracer = get_tracer()
+
+# MAX-303 のコマンド（行末は CR/LF）。取扱説明書で確認できていない仮のコマンドのため、
+# 確認が済むまでは experimental=True を指定した試験（擬似デバイス）でしか接続しない
+SHUTTER_OPEN = "S1"
+SHUTTER_CLOSE = "S0"
+FILTER_MOVE = "F{position}"
+STATUS_QUERY = "S?"
+# 内蔵フィルターの回転を含む応答待ちの上限（秒）
+RESPONSE_TIMEOUT = 5.0
+
+
+class XenonController(ExcitationSource):
+    """
+    朝日分光 MAX-303 (キセノン光源) をシリアル通信で制御する。
+    select(led) は励起波長に対応する内蔵フィルターへ回転してからシャッターを開き、off() はシャッターを閉じる。
+    波長と内蔵フィルターのポジションの対応は settings.ini の [XenonFilters] に '280nm = 1' の形で書く。
+    コマンドが仮のものであるため、experimental=True を指定しない限り connect() は失敗する。
+    """
+
+    def __init__(self, port, baudrate=9600, filter_positions=None, timeout=RESPONSE_TIMEOUT, experimental=False):
+        self.port = port
+        self.baudrate = baudrate
+        # ConfigParserはキーを小文字にするため、ラベルも小文字で引く
+        self.filter_positions = {str(k).lower(): int(v) for k, v in (filter_positions or {}).items()}
+        self.timeout = timeout
+        self.experimental = experimental
+        self.ser = None
+        self.current = None
+        self.current_filter = None
+        self.shutter_open = False
+        self._lock = threading.Lock()
+
+    def connect(self):
+        if not self.experimental:
+            # 実機に未確認のコマンドを送らない
+            logger.error("MAX-303の制御は試験中のため、実機には接続できません。")
+            return False
+        if self.port is None:
+            logger.error("MAX-303のポートが設定されていません。")
+            return False
+        try:
+            self.ser = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+            self.ser.reset_input_buffer()
+        except serial.SerialException as e:
+            logger.error(f"MAX-303 ({self.port}) に接続できませんでした。 {e}")
+            self.ser = None
+            return False
+        # 接続直後は安全のためシャッターを閉じておく
+        if not self._command(SHUTTER_CLOSE):
+            self.disconnect()
+            return False
+        logger.info(f"MAX-303 ({self.port}) に接続しました。")
+        return True
+
+    def disconnect(self):
+        with self._lock:
+            if self.ser is not None:
+                try:
+                    self.ser.close()
+                except (serial.SerialException, OSError) as e:
+                    logger.warning(f"MAX-303のポートを閉じる際にエラーが発生しました。 {e}")
+            self.ser = None
+        self.current = None
+        self.current_filter = None
+        self.shutter_open = False
+
+    @property
+    def is_connected(self):
+        return bool(self.ser and self.ser.is_open)
+
+    def health_check(self):
+        return self.is_connected and self._send(STATUS_QUERY) is not None
+
+    def _send(self, command):
+        """コマンドを送って1行の応答を返す。応答がなければNone"""
+        with self._lock:
+            if self.ser is None:
+                return None
+            start = time.perf_counter()
+            status = "ok"
+            try:
+                self.ser.write(f"{command}\r\n".encode("ascii"))
+                response = self.ser.readline().decode("ascii", errors="replace").strip()
+            except (serial.SerialException, OSError) as e:
+                status = "disconnected"
+                logger.error(f"MAX-303との通信に失敗しました。 {e}")
+                return None
+            finally:
+                tracer.record_span("xenon.command", time.perf_counter() - start, status, command=command)
+        if not response:
+            logger.error(f"MAX-303から {command} への応答がありませんでした。")
+            return None
+        return response
+
+    def _command(self, command):
+        response = self._send(command)
+        if response is None:
+            return False
+        if "OK" not in response:
+            logger.error(f"MAX-303が {command} に予期しない応答を返しました: {response}")
+            return False
+        return True
+
+    def select(self, led):
+        position = self.filter_positions.get(str(led).lower())
+        if position is None:
+            logger.error(f"{led} に対応する内蔵フィルターが [XenonFilters] に設定されていません。")
+            return False
+        if position != self.current_filter:
+            # フィルター回転中に試料へ他の波長が当たらないよう、先にシャッターを閉じる
+            if self.shutter_open:
+                if not self._command(SHUTTER_CLOSE):
+                    return False
+                self.shutter_open = False
+            if not self._command(FILTER_MOVE.format(position=position)):
+                self.current_filter = None
+                return False
+            self.current_filter = position
+        if not self.shutter_open:
+            if not self._command(SHUTTER_OPEN):
+                return False
+            self.shutter_open = True
+        self.current = led
+        return True
+
+    def off(self):
+        if self.is_connected and self._command(SHUTTER_CLOSE):
+            self.shutter_open = False
+        self.current = None
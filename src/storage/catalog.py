@@ -0,0 +1,225 @@
+"""
+撮影データの索引（SQLite）とプレビュー画像。
+
+保存時にバンドごとの撮影条件・簡単な統計と、縮小したプレビュー（大・小の2段）を catalog.sqlite に書き込む。
+GUIや解析は、ディレクトリを走査したり16bitの元画像を開いたりせずに、この索引を検索して目的のデータを探す。
+プレビューはTkの PhotoImage がそのまま読めるバイナリPGMで保存する。
+"""
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from src.app.live_view import contrast_stretch, to_pgm
+
+logger = logging.getLogger(__name__)
+
+CATALOG_NAME = "catalog.sqlite"
+# プレビューの長辺の上限（ピクセル）。0段目が一覧表示用の大きい方、1段目がサムネイル
+PREVIEW_SIZES = (256, 64)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    sample_type TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_name ON samples(name);
+CREATE INDEX IF NOT EXISTS samples_created ON samples(created);
+CREATE TABLE IF NOT EXISTS bands (
+    id INTEGER PRIMARY KEY,
+    sample_id INTEGER NOT NULL REFERENCES samples(id) ON DELETE CASCADE,
+    excitation TEXT NOT NULL,
+    emission TEXT NOT NULL,
+    filter_position INTEGER,
+    exposure_ms REAL,
+    timestamp TEXT,
+    mean REAL,
+    max REAL,
+    UNIQUE (sample_id, excitation, emission)
+);
+CREATE INDEX IF NOT EXISTS bands_pair ON bands(excitation, emission);
+CREATE TABLE IF NOT EXISTS previews (
+    band_id INTEGER NOT NULL REFERENCES bands(id) ON DELETE CASCADE,
+    level INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (band_id, level)
+);
+"""
+
+
+def _halve(image):
+    """2×2画素の平均で縦横半分にする（奇数の端は切り捨てる）"""
+    height, width = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    image = image[:height, :width]
+    return (image[0::2, 0::2] + image[1::2, 0::2] + image[0::2, 1::2] + image[1::2, 1::2]) * 0.25
+
+
+def _shrink(image, size):
+    while max(image.shape) > size and min(image.shape) >= 2:
+        image = _halve(image)
+    return image
+
+
+def build_pyramid(frame, sizes=PREVIEW_SIZES, low_percentile=1.0, high_percentile=99.5):
+    """
+    長辺が sizes の各値以下になるまで縮小したuint8画像のリストを返す。
+    縮小は平均で行う。階調はライブビューと同じ contrast_stretch で最初の段に合わせ、
+    以降の段はその画像を縮小して全段で揃える。
+    """
+    image = contrast_stretch(_shrink(np.asarray(frame, dtype=np.float32), sizes[0]), low_percentile, high_percentile)
+    levels = [image]
+    for size in sizes[1:]:
+        image = _shrink(image.astype(np.float32), size)
+        levels.append(np.rint(image).astype(np.uint8))
+    return levels
+
+
+class Catalog:
+    """
+    保存先ごとの撮影データの索引。保存スレッドとGUIの両方から使えるよう、1つの接続を排他して使う。
+    WALモードにしているため、書き込み中でも読み出し（一覧表示）は待たされない。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    @classmethod
+    def in_directory(cls, directory):
+        return cls(Path(directory) / CATALOG_NAME)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # --- 書き込み ---
+    def _sample_id(self, name, path, sample_type, now):
+        row = self._conn.execute("SELECT id FROM samples WHERE path = ?", (path,)).fetchone()
+        if row is not None:
+            self._conn.execute(
+                "UPDATE samples SET updated = ?, sample_type = COALESCE(?, sample_type) WHERE id = ?",
+                (now, sample_type, row["id"]),
+            )
+            return row["id"]
+        return self._conn.execute(
+            "INSERT INTO samples (name, path, sample_type, created, updated) VALUES (?, ?, ?, ?, ?)",
+            (name, path, sample_type, now, now),
+        ).lastrowid
+
+    def add_band(self, sample_name, path, excitation, emission, frame, metadata=None):
+        """1バンド分の撮影条件・統計・プレビューを登録する（同じバンドは上書き）"""
+        metadata = metadata or {}
+        pyramid = build_pyramid(frame)
+        # 統計は間引いた画像で求め、保存スレッドの負荷を抑える
+        sample = np.asarray(frame)[::2, ::2]
+        mean, peak = float(sample.mean()), float(sample.max())
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                sample_id = self._sample_id(sample_name, str(path), metadata.get("sample_type"), now)
+                band_id = self._conn.execute(
+                    """INSERT INTO bands (sample_id, excitation, emission, filter_position, exposure_ms, timestamp, mean, max)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (sample_id, excitation, emission) DO UPDATE SET
+                           filter_position = excluded.filter_position, exposure_ms = excluded.exposure_ms,
+                           timestamp = excluded.timestamp, mean = excluded.mean, max = excluded.max
+                       RETURNING id""",
+                    (sample_id, excitation, emission, metadata.get("filter_position"), metadata.get("exposure_ms"),
+                     metadata.get("timestamp"), mean, peak),
+                ).fetchone()[0]
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO previews (band_id, level, width, height, data) VALUES (?, ?, ?, ?, ?)",
+                    [(band_id, level, image.shape[1], image.shape[0], to_pgm(image))
+                     for level, image in enumerate(pyramid)],
+                )
+        return band_id
+
+    def index_cube(self, path):
+        """既存の .fcube ファイルを索引に登録する（索引を作る前に撮影したデータの取り込み用）"""
+        from src.storage.cube import CubeReader
+
+        path = Path(path)
+        with CubeReader(path) as reader:
+            sample_name = reader.metadata.get("sample_name", path.stem)
+            for excitation, emission in reader.available():
+                self.add_band(sample_name, path, excitation, emission, reader.band(excitation, emission),
+                              reader.band_metadata(excitation, emission))
+
+    def rebuild(self, directory):
+        """directory 以下の .fcube で、まだ索引にないものを登録し、登録した件数を返す"""
+        known = {row["path"] for row in self._query("SELECT path FROM samples")}
+        added = 0
+        for path in sorted(Path(directory).rglob("*.fcube")):
+            if str(path) in known:
+                continue
+            try:
+                self.index_cube(path)
+                added += 1
+            except Exception as e:
+                logger.warning(f"{path} を索引に登録できませんでした。 {e}")
+        return added
+
+    # --- 検索 ---
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def samples(self, name_like=None, sample_type=None, limit=100, offset=0):
+        """新しい順のサンプル一覧（バンド数付き）。name_like は部分一致"""
+        where, params = [], []
+        if name_like:
+            where.append("s.name LIKE ?")
+            params.append(f"%{name_like}%")
+        if sample_type:
+            where.append("s.sample_type = ?")
+            params.append(sample_type)
+        sql = ("SELECT s.id, s.name, s.path, s.sample_type, s.created, s.updated, COUNT(b.id) AS bands "
+               "FROM samples s LEFT JOIN bands b ON b.sample_id = s.id "
+               + (f"WHERE {' AND '.join(where)} " if where else "")
+               + "GROUP BY s.id ORDER BY s.updated DESC, s.id DESC LIMIT ? OFFSET ?")
+        return [dict(row) for row in self._query(sql, params + [limit, offset])]
+
+    def bands(self, sample_id=None, excitation=None, emission=None):
+        where, params = [], []
+        for column, value in (("b.sample_id", sample_id), ("b.excitation", excitation), ("b.emission", emission)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        sql = ("SELECT b.*, s.name AS sample_name, s.path FROM bands b JOIN samples s ON s.id = b.sample_id "
+               + (f"WHERE {' AND '.join(where)} " if where else "") + "ORDER BY s.updated DESC, s.id DESC, b.id")
+        return [dict(row) for row in self._query(sql, params)]
+
+    def preview(self, band_id, level=0):
+        """PGM形式のプレビュー画像（なければNone）"""
+        rows = self._query("SELECT data FROM previews WHERE band_id = ? AND level = ?", (band_id, level))
+        return bytes(rows[0]["data"]) if rows else None
+
+    def sample_paths(self, name_like=None, sample_type=None, limit=10000):
+        """条件に合うサンプルのファイルパス（解析用）"""
+        return [row["path"] for row in self.samples(name_like, sample_type, limit=limit)]
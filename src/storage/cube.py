@@ -0,0 +1,338 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ファイル構成:
+#   ヘッダ   : MAGIC + uint32(ヘッダJSON長) + ヘッダJSON
+#   バンド   : CHUNK_TAG + CHUNK_STRUCT + メタデータJSON + 画像データ（1バンド=1チャンク）
+#   索引     : INDEX_TAG + uint32(索引JSON長) + 索引JSON
+#   末尾     : FOOTER_STRUCT(索引の位置) + FOOTER_MAGIC
+# 書き込み途中で止まった場合は末尾がないため、読み込み時にチャンクを先頭から走査して索引を作り直す。
+MAGIC = b"FCUBE1\0\0"
+FOOTER_MAGIC = b"FCEND\0\0\0"
+CHUNK_TAG = b"CHNK"
+INDEX_TAG = b"INDX"
+CHUNK_STRUCT = struct.Struct("<HHQQI")  # 励起番号, 放射番号, 元のバイト数, 保存バイト数, メタデータ長
+FOOTER_STRUCT = struct.Struct("<Q")
+LENGTH_STRUCT = struct.Struct("<I")
+
+COMPRESSIONS = ("zlib", "none")
+# サンプル名はそのままファイル名にするため、パスとして解釈される文字は使えない
+SAMPLE_NAME_FORBIDDEN = ("/", "\\", "\0")
+
+
+class CubeFormatError(Exception):
+    """キューブファイルの形式が正しくない場合に送出される"""
+
+
+def check_sample_name(sample_name):
+    """サンプル名がファイル名として使えるか確かめる（使えなければ ValueError）"""
+    if not sample_name or sample_name in (".", "..") or any(c in sample_name for c in SAMPLE_NAME_FORBIDDEN):
+        raise ValueError(f"サンプル名 {sample_name!r} はファイル名に使えません（'/' や '\\' を含めないでください）。")
+    return sample_name
+
+
+def _shuffle(frame):
+    """多バイト整数の上位・下位バイトをまとめて並べ、圧縮率を上げる"""
+    itemsize = frame.dtype.itemsize
+    if itemsize == 1:
+        return frame.tobytes()
+    return np.ascontiguousarray(frame).view(np.uint8).reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(raw, dtype, shape):
+    dtype = np.dtype(dtype)
+    if dtype.itemsize == 1:
+        return np.frombuffer(raw, dtype=dtype).reshape(shape)
+    planes = np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(shape)
+
+
+class CubeWriter:
+    """
+    1サンプル分の 励起×放射×H×W 画像を1つのファイルに順次書き込む。
+    バンド（励起・放射の1組）ごとに1チャンクとして可逆圧縮して追記する。
+    既存のファイルは上書きしない（FileExistsError）。続きを書くときは resume() で開き直す。
+    """
+
+    def __init__(self, path, excitations, emissions, frame_shape, dtype=np.uint16,
+                 compression="zlib", level=1, metadata=None):
+        self._setup(path, excitations, emissions, frame_shape, dtype, compression, level)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "xb")
+        header = json.dumps({
+            "excitations": self.excitations,
+            "emissions": self.emissions,
+            "frame_shape": list(self.frame_shape),
+            "dtype": self.dtype.str,
+            "compression": compression,
+            "metadata": metadata or {},
+        }, ensure_ascii=False).encode("utf-8")
+        self._file.write(MAGIC + LENGTH_STRUCT.pack(len(header)) + header)
+
+    def _setup(self, path, excitations, emissions, frame_shape, dtype, compression, level):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"未対応の圧縮形式です: {compression}")
+        self.path = Path(path)
+        self.excitations = list(excitations)
+        self.emissions = list(emissions)
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.compression = compression
+        self.level = level
+        self._index = {}
+
+    @classmethod
+    def resume(cls, path, level=1):
+        """
+        既存のファイルを開き直し、保存済みのバンドの後ろから追記を続ける。
+        閉じられたファイルの索引や、書き込み途中で切れたチャンクは切り捨てる。
+        """
+        with CubeReader(path) as reader:
+            writer = cls.__new__(cls)
+            writer._setup(path, reader.excitations, reader.emissions, reader.frame_shape, reader.dtype,
+                          reader.compression, level)
+            for key, entry in reader._index.items():
+                writer._index[key] = {name: entry[name] for name in ("offset", "data_offset", "stored_size", "metadata")}
+            end = max((e["data_offset"] + e["stored_size"] for e in writer._index.values()), default=reader._data_start)
+        writer._file = open(writer.path, "r+b")
+        writer._file.truncate(end)
+        writer._file.seek(end)
+        return writer
+
+    def _band_index(self, excitation, emission):
+        try:
+            return self.excitations.index(excitation), self.emissions.index(emission)
+        except ValueError:
+            raise KeyError(f"キューブに含まれない組み合わせです: 励起={excitation}, 放射={emission}") from None
+
+    def write_band(self, excitation, emission, frame, metadata=None):
+        """励起・放射ラベルの組に対応する1枚の画像を追記する"""
+        ex, em = self._band_index(excitation, emission)
+        frame = np.asarray(frame)
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"画像サイズが一致しません: {frame.shape} != {self.frame_shape}")
+        frame = frame.astype(self.dtype, copy=False)
+        if self.compression == "zlib":
+            raw = _shuffle(frame)
+            stored = zlib.compress(raw, self.level)
+        else:
+            # 無圧縮の場合はそのまま並べ、読み込み時にメモリマップから直接参照できるようにする
+            raw = stored = np.ascontiguousarray(frame).tobytes()
+        meta = json.dumps(metadata or {}, ensure_ascii=False).encode("utf-8")
+
+        offset = self._file.tell()
+        self._file.write(CHUNK_TAG + CHUNK_STRUCT.pack(ex, em, len(raw), len(stored), len(meta)) + meta)
+        data_offset = self._file.tell()
+        self._file.write(stored)
+        self._file.flush()
+        self._index[(ex, em)] = {"offset": offset, "data_offset": data_offset,
+                                 "stored_size": len(stored), "metadata": metadata or {}}
+
+    def close(self):
+        if self._file is None:
+            return
+        index = json.dumps(
+            [{"excitation": ex, "emission": em, **entry} for (ex, em), entry in self._index.items()],
+            ensure_ascii=False,
+        ).encode("utf-8")
+        index_offset = self._file.tell()
+        self._file.write(INDEX_TAG + LENGTH_STRUCT.pack(len(index)) + index)
+        self._file.write(FOOTER_STRUCT.pack(index_offset) + FOOTER_MAGIC)
+        # 撮影の記録（ジャーナル）に完了と書く前に、データがディスクへ書き出されているようにする
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class CubeReader:
+    """
+    キューブファイルをメモリマップで開き、必要なバンドだけを読み出す。
+    圧縮なしのファイルでは、band() はファイル上のデータを直接参照する（読み取り専用・コピーなし）。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise CubeFormatError(f"空のファイルです: {self.path}") from None
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise CubeFormatError(f"キューブファイルではありません: {self.path}")
+        (header_len,) = LENGTH_STRUCT.unpack_from(self._map, len(MAGIC))
+        self._data_start = len(MAGIC) + LENGTH_STRUCT.size + header_len
+        header = json.loads(self._map[len(MAGIC) + LENGTH_STRUCT.size:self._data_start].decode("utf-8"))
+        self.excitations = header["excitations"]
+        self.emissions = header["emissions"]
+        self.frame_shape = tuple(header["frame_shape"])
+        self.dtype = np.dtype(header["dtype"])
+        self.compression = header["compression"]
+        self.metadata = header["metadata"]
+        self.complete = True
+        self._index = self._read_index()
+
+    @property
+    def shape(self):
+        return (len(self.excitations), len(self.emissions)) + self.frame_shape
+
+    def _read_index(self):
+        size = len(self._map)
+        tail = len(FOOTER_MAGIC) + FOOTER_STRUCT.size
+        if size >= self._data_start + tail and self._map[size - len(FOOTER_MAGIC):] == FOOTER_MAGIC:
+            (index_offset,) = FOOTER_STRUCT.unpack_from(self._map, size - tail)
+            if self._map[index_offset:index_offset + len(INDEX_TAG)] == INDEX_TAG:
+                start = index_offset + len(INDEX_TAG)
+                (length,) = LENGTH_STRUCT.unpack_from(self._map, start)
+                start += LENGTH_STRUCT.size
+                entries = json.loads(self._map[start:start + length].decode("utf-8"))
+                return {(e["excitation"], e["emission"]): e for e in entries}
+        self.complete = False
+        return self._scan_chunks()
+
+    def _scan_chunks(self):
+        """末尾の索引がない（書き込み途中で終了した）場合に、チャンクを走査して索引を作る"""
+        index = {}
+        pos = self._data_start
+        header_size = len(CHUNK_TAG) + CHUNK_STRUCT.size
+        while pos + header_size <= len(self._map) and self._map[pos:pos + len(CHUNK_TAG)] == CHUNK_TAG:
+            ex, em, _, stored_size, meta_len = CHUNK_STRUCT.unpack_from(self._map, pos + len(CHUNK_TAG))
+            meta_start = pos + header_size
+            data_offset = meta_start + meta_len
+            if data_offset + stored_size > len(self._map):
+                break  # 途中までしか書かれていないチャンクは捨てる
+            metadata = json.loads(self._map[meta_start:data_offset].decode("utf-8"))
+            index[(ex, em)] = {"offset": pos, "data_offset": data_offset,
+                               "stored_size": stored_size, "metadata": metadata}
+            pos = data_offset + stored_size
+        return index
+
+    def _key(self, excitation, emission):
+        ex = excitation if isinstance(excitation, int) else self.excitations.index(excitation)
+        em = emission if isinstance(emission, int) else self.emissions.index(emission)
+        return ex, em
+
+    def available(self):
+        """保存済みの (励起ラベル, 放射ラベル) の一覧"""
+        return [(self.excitations[ex], self.emissions[em]) for ex, em in sorted(self._index)]
+
+    def has_band(self, excitation, emission):
+        return self._key(excitation, emission) in self._index
+
+    def band(self, excitation, emission):
+        """1バンド分の画像を返す。ラベルまたは番号で指定する"""
+        key = self._key(excitation, emission)
+        if key not in self._index:
+            raise KeyError(f"保存されていないバンドです: 励起={excitation}, 放射={emission}")
+        entry = self._index[key]
+        start, size = entry["data_offset"], entry["stored_size"]
+        if self.compression == "none":
+            count = size // self.dtype.itemsize
+            return np.frombuffer(self._map, dtype=self.dtype, count=count, offset=start).reshape(self.frame_shape)
+        return _unshuffle(zlib.decompress(self._map[start:start + size]), self.dtype, self.frame_shape)
+
+    def band_metadata(self, excitation, emission):
+        return self._index[self._key(excitation, emission)]["metadata"]
+
+    def to_array(self, fill_value=0):
+        """キューブ全体を読み込む。未保存のバンドは fill_value で埋める"""
+        cube = np.full(self.shape, fill_value, dtype=self.dtype)
+        for ex, em in self._index:
+            cube[ex, em] = self.band(ex, em)
+        return cube
+
+    def close(self):
+        if getattr(self, "_map", None) is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # band() が返した配列が参照中。配列が解放されればマップも閉じられる
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class CubeFrameWriter:
+    """
+    AcquisitionEngine用の保存先。サンプルごとに '<サンプル名>.fcube' を1つ作り、撮影したバンドを追記する。
+    同じ名前のファイルが既にあれば '<サンプル名>_2.fcube' のように番号を付け、以前のデータは上書きしない。
+    励起・放射ラベルの並びは撮影ステップから決める。
+    resume=True のときは outputs {サンプル名: 中断した撮影のファイル} に（なければ '<サンプル名>.fcube' に）追記する。
+    catalog (src.storage.catalog.Catalog) を渡すと、保存したバンドを索引とプレビューにも登録する。
+    """
+
+    def __init__(self, directory, excitations, emissions, compression="zlib", resume=False, catalog=None,
+                 outputs=None):
+        self.directory = Path(directory)
+        self.excitations = list(excitations)
+        self.emissions = list(emissions)
+        self.compression = compression
+        # Trueの場合、既存のファイルがあれば作り直さずに追記する（中断した撮影の再開用）
+        self.resume = resume
+        self.catalog = catalog
+        self._writers = {}
+        self._paths = {name: Path(path) for name, path in (outputs or {}).items() if path}
+
+    @classmethod
+    def for_steps(cls, directory, steps, **kwargs):
+        excitations = list(dict.fromkeys(step.led for step in steps))
+        emissions = list(dict.fromkeys(step.filter for step in steps))
+        return cls(directory, excitations, emissions, **kwargs)
+
+    def path_for(self, sample_name):
+        path = self._paths.get(sample_name)
+        if path is None:
+            check_sample_name(sample_name)
+            path = self.directory / f"{sample_name}.fcube"
+            if not self.resume:
+                number = 2
+                while path.exists():
+                    path = self.directory / f"{sample_name}_{number}.fcube"
+                    number += 1
+            self._paths[sample_name] = path
+        return path
+
+    def write(self, sample_name, index, step, frame, metadata):
+        writer = self._writers.get(sample_name)
+        if writer is None and self.resume and self.path_for(sample_name).exists():
+            writer = self._writers[sample_name] = CubeWriter.resume(self.path_for(sample_name))
+        if writer is None:
+            writer = CubeWriter(self.path_for(sample_name), self.excitations, self.emissions, frame.shape,
+                                dtype=frame.dtype, compression=self.compression,
+                                metadata={"sample_name": sample_name})
+            self._writers[sample_name] = writer
+        writer.write_band(step.led, step.filter, frame, metadata)
+        if self.catalog is not None:
+            # 索引はあとから rebuild() で作り直せるため、登録に失敗しても撮影は止めない
+            try:
+                self.catalog.add_band(sample_name, self.path_for(sample_name), step.led, step.filter, frame, metadata)
+            except Exception as e:
+                logger.warning(f"{sample_name} ({step.led}/{step.filter}) を索引に登録できませんでした。 {e}")
+        return self.path_for(sample_name)
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
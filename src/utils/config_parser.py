@@ -1,13 +1,161 @@
 import configparser
+import logging
+import os
+import threading
+from dataclasses import dataclass
 from pathlib import Path
+from types import MappingProxyType
 
 # このファイルの場所を基準に、プロジェクトのルートディレクトリを特定します
 PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+DEFAULT_CONFIG_PATH = PROJECT_ROOT / 'config' / 'settings.ini'
+
+logger = logging.getLogger(__name__)
+
+
+class SettingsError(ValueError):
+    """設定ファイルの値が不正な場合に送出される"""
+
+
+def parse_wavelength(text):
+    """'365nm'のような文字列から数値部分を抽出する。数字を含まない場合はNoneを返す。"""
+    digits = ''.join(filter(str.isdigit, text or ''))
+    return int(digits) if digits else None
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    settings.ini を一度だけ解析した、変更できない設定オブジェクト。
+    波長の文字列はここで数値に変換し、イベントのたびに解析し直さなくて済むようにする。
+    """
+    path: Path
+    mtime_ns: int
+    filter_changer_port: str
+    filter_changer_baudrate: int
+    exposure_default: float
+    save_directory: str
+    filter_wavelengths: MappingProxyType # ポジション番号 -> '350nm' などのラベル
+    led_wavelengths: MappingProxyType    # iniのキー -> '280nm' などのラベル
+    filter_nm: MappingProxyType          # ポジション番号 -> 波長(nm)。'Empty'などはNone
+    filter_slot_by_nm: MappingProxyType  # 波長(nm) -> ポジション番号
+    led_nm: MappingProxyType             # LEDのラベル -> 波長(nm)
+    sections: MappingProxyType           # 全セクションの生の値（他のデバイス用）
+
+    def get(self, section, option, fallback=None):
+        return self.sections.get(section, {}).get(option, fallback)
+
+    @property
+    def filter_options(self):
+        """GUIやシーケンス作成で使う {'1': '350nm', ...} 形式のフィルター一覧"""
+        return {str(pos): label for pos, label in self.filter_wavelengths.items()}
+
+    @property
+    def led_options(self):
+        return list(self.led_wavelengths.values())
+
+    def filters_above(self, excitation_nm):
+        """励起波長より長い波長のフィルターのラベル一覧。励起波長が不明ならすべて返す"""
+        if excitation_nm is None:
+            return list(self.filter_wavelengths.values())
+        return [self.filter_wavelengths[pos] for pos, nm in self.filter_nm.items()
+                if nm is not None and nm > excitation_nm]
+
+
+def _build_settings(path, mtime_ns, config):
+    def require(section, option, convert=str):
+        try:
+            return convert(config.get(section, option))
+        except (configparser.Error, ValueError) as e:
+            raise SettingsError(f"[{section}] {option} の値が不正です: {e}") from None
+
+    filter_wavelengths = {}
+    if config.has_section('FilterWavelengths'):
+        for key, label in config.items('FilterWavelengths'):
+            try:
+                filter_wavelengths[int(key)] = label
+            except ValueError:
+                raise SettingsError(f"[FilterWavelengths] のキーはポジション番号にしてください: {key}") from None
+    led_wavelengths = dict(config.items('LedWavelengths')) if config.has_section('LedWavelengths') else {}
+
+    filter_nm = {pos: parse_wavelength(label) for pos, label in sorted(filter_wavelengths.items())}
+    filter_slot_by_nm = {}
+    for pos, nm in filter_nm.items():
+        if nm is not None:
+            filter_slot_by_nm.setdefault(nm, pos)
+
+    exposure_default = require('Camera', 'exposure_default', float) if config.has_option('Camera', 'exposure_default') else 1000.0
+    if exposure_default <= 0:
+        raise SettingsError("[Camera] exposure_default は正の値にしてください。")
+
+    return Settings(
+        path=path,
+        mtime_ns=mtime_ns,
+        filter_changer_port=require('FilterChanger', 'port'),
+        filter_changer_baudrate=require('FilterChanger', 'baudrate', int),
+        exposure_default=exposure_default,
+        save_directory=config.get('Paths', 'default_save_directory', fallback=str(PROJECT_ROOT / 'data')),
+        filter_wavelengths=MappingProxyType(dict(sorted(filter_wavelengths.items()))),
+        led_wavelengths=MappingProxyType(led_wavelengths),
+        filter_nm=MappingProxyType(filter_nm),
+        filter_slot_by_nm=MappingProxyType(filter_slot_by_nm),
+        led_nm=MappingProxyType({label: parse_wavelength(label) for label in led_wavelengths.values()}),
+        sections=MappingProxyType({
+            name: MappingProxyType(dict(config.items(name, raw=True))) for name in config.sections()
+        }),
+    )
+
+
+_cache = {}
+_subscribers = []
+_lock = threading.Lock()
+
+
+def load_settings(path=None, force=False):
+    """
+    設定ファイルを読み込んで Settings を返す。前回から更新時刻が変わっていなければキャッシュを返す。
+    内容が再読み込みされた場合は、subscribe() で登録した関数に新しい Settings を通知する。
+    """
+    path = Path(path) if path is not None else DEFAULT_CONFIG_PATH
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError(f"設定ファイルが見つかりません: {path}") from None
+
+    with _lock:
+        cached = _cache.get(path)
+        if cached is not None and cached.mtime_ns == mtime_ns and not force:
+            return cached
+        config = configparser.ConfigParser()
+        config.read(path, encoding='utf-8')
+        settings = _build_settings(path, mtime_ns, config)
+        _cache[path] = settings
+        subscribers = list(_subscribers) if cached is not None else []
+
+    for callback in subscribers:
+        try:
+            callback(settings)
+        except Exception as e:
+            logger.error(f"設定変更の通知中にエラーが発生しました。 {e}")
+    return settings
+
+
+def subscribe(callback):
+    """設定ファイルが再読み込みされたときに callback(settings) を呼ぶよう登録する"""
+    with _lock:
+        _subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    with _lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
 
 def get_config():
-    """設定ファイル (config/settings.ini) を読み込み、configオブジェクトを返す関数"""
+    """設定ファイル (config/settings.ini) を読み込み、configオブジェクトを返す関数
+    呼び出すたびにファイルを読み直すため、通常は load_settings() を使うこと。"""
     config = configparser.ConfigParser()
-    config_path = PROJECT_ROOT / 'config' / 'settings.ini'
+    config_path = DEFAULT_CONFIG_PATH
     
     if not config_path.exists():
         raise FileNotFoundError(f"設定ファイルが見つかりません: {config_path}")
@@ -0,0 +1,219 @@
+import bisect
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+# 遅延ヒストグラムの区間の上限（ミリ秒）。最後の区間はそれ以上すべて
+HISTOGRAM_BOUNDS_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Tracer:
+    """
+    デバイス操作の所要時間（スパン）とログを、メモリ上のリングバッファに記録する。
+    記録は辞書をdequeに追加するだけで、ファイルへの書き出しは別スレッドで行う。
+    """
+
+    def __init__(self, capacity=10000, samples_per_name=2048):
+        self._events = deque(maxlen=capacity)
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self._samples_per_name = samples_per_name
+        self._durations = {}  # スパン名 -> 直近の所要時間(ms)
+        self._histograms = {}  # スパン名 -> 区間ごとの件数（全期間）
+        self._queue = None
+        self._listener = None
+
+    def _emit(self, event):
+        with self._lock:
+            event["seq"] = next(self._seq)
+            self._events.append(event)
+        if self._queue is not None:
+            self._queue.put_nowait(event)
+        return event
+
+    def record_span(self, name, duration, status="ok", **attrs):
+        """所要時間 duration（秒）のスパンを記録する"""
+        duration_ms = duration * 1000.0
+        with self._lock:
+            samples = self._durations.get(name)
+            if samples is None:
+                samples = self._durations[name] = deque(maxlen=self._samples_per_name)
+                self._histograms[name] = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+            samples.append(duration_ms)
+            self._histograms[name][bisect.bisect_left(HISTOGRAM_BOUNDS_MS, duration_ms)] += 1
+        return self._emit({"t": time.time(), "kind": "span", "name": name,
+                           "duration_ms": duration_ms, "status": status, **attrs})
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """with ブロックの所要時間を記録する。例外が起きた場合は status='error' になる"""
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield attrs
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            # ブロック内で attrs['status'] を設定すると、その値で記録する
+            status = attrs.pop("status", status)
+            self.record_span(name, time.perf_counter() - start, status, **attrs)
+
+    def log(self, message, level="INFO", **fields):
+        return self._emit({"t": time.time(), "kind": "log", "level": level, "message": message, **fields})
+
+    def events_since(self, seq, kind=None):
+        """通し番号 seq より後のイベントを返す（リングバッファから消えたものは含まれない）"""
+        with self._lock:
+            # 通し番号は1ずつ増えるため、seq より新しい分だけを末尾から取り出す（全体は走査しない）
+            count = min(len(self._events), self._events[-1]["seq"] - seq) if self._events else 0
+            events = list(itertools.islice(reversed(self._events), max(0, count)))[::-1]
+        if kind is not None:
+            events = [e for e in events if e["kind"] == kind]
+        return events
+
+    @property
+    def last_seq(self):
+        with self._lock:
+            return self._events[-1]["seq"] if self._events else 0
+
+    def span_names(self):
+        with self._lock:
+            return sorted(self._durations)
+
+    def histogram(self, name):
+        """[(区間の上限ms, 件数), ...] を返す。最後の区間の上限は inf"""
+        with self._lock:
+            counts = list(self._histograms.get(name, [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)))
+        return list(zip(HISTOGRAM_BOUNDS_MS + (float("inf"),), counts))
+
+    def latency_summary(self, name):
+        """直近のスパンの件数・平均・パーセンタイル（ms）"""
+        with self._lock:
+            samples = sorted(self._durations.get(name, ()))
+        return summarize_durations(samples)
+
+    def report(self):
+        """全スパンの遅延統計を読みやすい文字列にする"""
+        lines = []
+        for name in self.span_names():
+            s = self.latency_summary(name)
+            lines.append(f"{name}: {s['count']}件 平均 {s['mean']:.2f} ms, p50 {s['p50']:.2f}, "
+                         f"p90 {s['p90']:.2f}, p99 {s['p99']:.2f}, 最大 {s['max']:.2f}")
+        return "\n".join(lines)
+
+    def enable_file(self, path, max_bytes=5 * 1024 * 1024, backup_count=5):
+        """イベントをJSON Lines形式でファイルに書き出す（一定サイズでローテーション）"""
+        self.disable_file()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        handler.setFormatter(_JsonEventFormatter())
+        self._queue = _EventQueue()
+        self._listener = logging.handlers.QueueListener(self._queue, handler)
+        self._listener.start()
+
+    def disable_file(self):
+        if self._listener is not None:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+        self._listener = None
+        self._queue = None
+
+
+class _EventQueue(queue.SimpleQueue):
+    """QueueListener はログレコードを受け取るため、イベントの辞書を包んで渡す"""
+
+    def put_nowait(self, event):
+        if event is None:
+            # QueueListener.stop() が送る終了合図
+            return super().put_nowait(None)
+        record = logging.LogRecord("trace", logging.INFO, "", 0, "", None, None)
+        record.event = event
+        super().put_nowait(record)
+
+
+class _JsonEventFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.event, ensure_ascii=False, default=str)
+
+
+class TraceLogHandler(logging.Handler):
+    """loggingのメッセージをTracerのリングバッファに流す（GUIのログ欄で表示するため）"""
+
+    def __init__(self, tracer, level=logging.NOTSET):
+        super().__init__(level)
+        self.tracer = tracer
+
+    def emit(self, record):
+        try:
+            self.tracer.log(record.getMessage(), level=record.levelname, logger=record.name)
+        except Exception:
+            self.handleError(record)
+
+
+def summarize_durations(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+
+    def pick(p):
+        return samples[min(len(samples) - 1, int(p / 100.0 * len(samples)))]
+
+    return {"count": len(samples), "mean": sum(samples) / len(samples),
+            "p50": pick(50), "p90": pick(90), "p99": pick(99), "max": samples[-1]}
+
+
+_default_tracer = Tracer()
+
+
+def get_tracer():
+    return _default_tracer
+
+
+def install_log_capture(tracer=None, level=logging.INFO, logger_name="src"):
+    """src 以下のロガーの出力をTracerに集める。コンソールへの出力は行わなくなる"""
+    tracer = tracer or _default_tracer
+    logger = logging.getLogger(logger_name)
+    for handler in logger.handlers:
+        if isinstance(handler, TraceLogHandler) and handler.tracer is tracer:
+            break
+    else:
+        logger.addHandler(TraceLogHandler(tracer))
+    logger.setLevel(level)
+    return tracer
+
+
+def summarize_file(path):
+    """JSON Lines のトレースファイルから、スパン名ごとの遅延統計を求める"""
+    durations = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if event.get("kind") == "span":
+                durations.setdefault(event["name"], []).append(event["duration_ms"])
+    return {name: summarize_durations(values) for name, values in sorted(durations.items())}
+
+
+# --- このファイルが直接実行された場合は、トレースファイルの遅延統計を表示します ---
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("使い方: python -m src.utils.tracing <trace.jsonl>")
+        sys.exit(2)
+    for span_name, s in summarize_file(sys.argv[1]).items():
+        print(f"{span_name}: {s['count']}件 平均 {s['mean']:.2f} ms, p50 {s['p50']:.2f}, "
+              f"p90 {s['p90']:.2f}, p99 {s['p99']:.2f}, 最大 {s['max']:.2f}")
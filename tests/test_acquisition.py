@@ -0,0 +1,96 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from src.app.acquisition import AcquisitionEngine, AcquisitionError, NpyFrameWriter
+from src.app.sequence_planner import SequenceStep
+
+STEPS = [SequenceStep("280nm", "400nm", 2), SequenceStep("310nm", "400nm", 2), SequenceStep("280nm", "500nm", 4)]
+
+
+class FakeFilter:
+    def __init__(self, delay=0.0, fail_at=None):
+        self.delay, self.fail_at, self.moves = delay, fail_at, []
+
+    def move_to(self, slot):
+        time.sleep(self.delay)
+        self.moves.append(slot)
+        return slot != self.fail_at
+
+
+class FakeCamera:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def capture(self, exposure_ms):
+        time.sleep(self.delay)
+        return np.full((4, 4), int(exposure_ms), dtype=np.uint16)
+
+
+class FakeLed:
+    def __init__(self):
+        self.selected, self.is_off = [], False
+
+    def select(self, led):
+        self.selected.append(led)
+        return True
+
+    def off(self):
+        self.is_off = True
+
+
+class SlowWriter:
+    def __init__(self, delay):
+        self.delay, self.written, self.closed = delay, [], False
+
+    def write(self, sample_name, index, step, frame, metadata):
+        time.sleep(self.delay)
+        self.written.append((index, metadata["excitation"], metadata["emission_filter"]))
+
+    def close(self):
+        self.closed = True
+
+
+def test_runs_every_step_in_order():
+    fc, led, writer = FakeFilter(), FakeLed(), SlowWriter(0)
+    report = AcquisitionEngine(fc, FakeCamera(), led, writer).run(STEPS, 100, "sample")
+    assert fc.moves == [2, 2, 4]
+    assert led.selected == ["280nm", "310nm", "280nm"]
+    assert writer.written == [(0, "280nm", "400nm"), (1, "310nm", "400nm"), (2, "280nm", "500nm")]
+    assert writer.closed and led.is_off
+    assert report.frames == 3 and report.frames_per_minute > 0
+
+
+def test_saving_overlaps_with_next_move():
+    writer = SlowWriter(0.1)
+    engine = AcquisitionEngine(FakeFilter(0.1), FakeCamera(), FakeLed(), writer)
+    report = engine.run(STEPS, 10, "sample")
+    totals = report.stage_totals()
+    assert totals["save"] == pytest.approx(0.3, abs=0.05)
+    # 直列なら 0.6秒以上かかる
+    assert report.wall_time < totals["move"] + totals["save"] - 0.1
+
+
+def test_move_failure_aborts_and_switches_led_off():
+    led = FakeLed()
+    engine = AcquisitionEngine(FakeFilter(fail_at=4), FakeCamera(), led, SlowWriter(0))
+    with pytest.raises(AcquisitionError):
+        engine.run(STEPS, 10, "sample")
+    assert led.is_off
+
+
+def test_cancel_stops_before_next_step():
+    cancel = threading.Event()
+    engine = AcquisitionEngine(FakeFilter(), FakeCamera(), FakeLed(), SlowWriter(0), on_step=lambda t: cancel.set())
+    report = engine.run(STEPS, 10, "sample", cancel_event=cancel)
+    assert report.cancelled and report.frames == 1
+
+
+def test_npy_writer_saves_frame_and_metadata(tmp_path):
+    engine = AcquisitionEngine(FakeFilter(), FakeCamera(), FakeLed(), NpyFrameWriter(tmp_path))
+    engine.run(STEPS[:1], 50, "s1")
+    saved = sorted(p.name for p in (tmp_path / "s1").iterdir())
+    assert saved == ["000_ex280nm_em400nm.json", "000_ex280nm_em400nm.npy"]
+    assert np.load(tmp_path / "s1" / saved[1])[0, 0] == 50
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+from src.app.acquisition import AcquisitionEngine
+from src.app.auto_exposure import AutoExposure, ExposureCache, frame_statistics
+from src.app.batch import parse_plan
+from src.app.sequence_planner import SequenceStep
+from src.hardware.simulators import SimulatedCamera, SimulatedExcitationSource
+
+
+def make_camera(gain=1.0):
+    return SimulatedCamera(shape=(96, 128), num_particles=30, spectrum=lambda ex, pos: gain)
+
+
+def within_target(result, auto):
+    target = auto.target_fraction * 65535
+    return abs(result.level - target) <= auto.tolerance * target
+
+
+def test_frame_statistics_uses_decimated_frame():
+    frame = np.zeros((8, 8), dtype=np.uint16)
+    frame[::4, ::4] = 65535
+    level, saturated = frame_statistics(frame, 65535)
+    assert level == 65535 and saturated == 1.0
+    frame[::4, ::4] = 0
+    frame[1, 1] = 65535
+    assert frame_statistics(frame, 65535) == (0.0, 0.0)
+
+
+def test_converges_from_default_guess():
+    auto = AutoExposure(make_camera(), default_exposure=10.0)
+    result = auto.find("280nm", "400nm")
+    assert result.converged and within_target(result, auto)
+    assert result.captures <= 3
+
+
+def test_cached_rate_converges_in_one_capture(tmp_path):
+    cache = ExposureCache(tmp_path / "cache.json")
+    auto = AutoExposure(make_camera(), cache=cache, default_exposure=10.0)
+    first = auto.find("280nm", "400nm", "PE")
+    auto.save()
+
+    reloaded = AutoExposure(make_camera(), cache=ExposureCache(tmp_path / "cache.json"))
+    second = reloaded.find("280nm", "400nm", "PE")
+    assert second.converged and second.captures == 1
+    assert abs(second.exposure_ms - first.exposure_ms) / first.exposure_ms < 0.2
+    # 試料の種類の記録がなくても、同じLED・フィルターの記録から予測する
+    assert reloaded.find("280nm", "400nm", "PS").captures == 1
+
+
+def test_backs_off_from_saturation():
+    auto = AutoExposure(make_camera(gain=50.0))
+    result = auto.find("280nm", "400nm", initial_ms=5000)
+    assert result.converged and within_target(result, auto)
+    assert result.exposure_ms < 100
+
+
+@pytest.mark.parametrize("default_exposure", [10.0, 100.0, 1000.0, 8000.0])
+def test_brackets_saturation_on_default_simulator(default_exposure):
+    # 明るい粒子が目標の明るさより先に飽和する画像。飽和した露光時間より短い側で決まる
+    auto = AutoExposure(SimulatedCamera(), default_exposure=default_exposure)
+    result = auto.find("280nm", "400nm")
+    assert result.converged and result.captures <= auto.max_captures
+    assert len(result.history) == result.captures and result.exposure_ms in result.history
+    level, saturated = frame_statistics(result.frame, 65535)
+    assert saturated <= auto.max_saturated and level == result.level
+    assert level >= auto.target_fraction * 65535 / 2
+
+
+def test_reports_failure_when_too_dark():
+    cache = ExposureCache()
+    auto = AutoExposure(make_camera(gain=1e-4), cache=cache, max_exposure=50.0, max_captures=4)
+    result = auto.find("280nm", "400nm")
+    assert not result.converged
+    assert result.exposure_ms == 50.0
+    # 決まらなかった露光時間は次の予測に使わない
+    assert cache.rate("280nm", "400nm") is None
+
+
+def test_rejects_inconsistent_limits():
+    with pytest.raises(ValueError):
+        AutoExposure(make_camera(), max_saturated=0.01)
+    with pytest.raises(ValueError):
+        AutoExposure(make_camera(), target_fraction=0.9, tolerance=0.15)
+
+
+def test_engine_saves_converged_frame_for_auto_steps():
+    steps = [SequenceStep("280nm", "400nm", 2), SequenceStep("310nm", "450nm", 3)]
+    written = []
+
+    class Filter:
+        def move_to(self, slot):
+            return True
+
+    class Writer:
+        def write(self, sample_name, index, step, frame, metadata):
+            written.append(metadata)
+
+        def close(self):
+            pass
+
+    camera = make_camera()
+    auto = AutoExposure(camera, default_exposure=10.0)
+    report = AcquisitionEngine(Filter(), camera, SimulatedExcitationSource(), Writer(),
+                               auto_exposure=auto).run(steps, [None, 5.0], "s1")
+    assert camera.frames_captured == report.frames + report.extra_captures
+    assert written[0]["auto_exposure"]["converged"] and written[0]["exposure_ms"] > 10.0
+    assert written[1]["exposure_ms"] == 5.0 and "auto_exposure" not in written[1]
+
+
+def test_plan_accepts_auto_exposure():
+    plan = parse_plan({"exposure_ms": "auto", "samples": [
+        {"name": "s", "sample_type": "PE", "pairs": [["280nm", "400nm"], {"excitation": "310nm", "emission": "450nm",
+                                                                      "exposure_ms": 20}]}]})
+    assert plan.samples[0].exposures == [None, 20.0]
+    assert plan.samples[0].sample_type == "PE"
@@ -0,0 +1,108 @@
+import json
+import os
+
+import pytest
+
+from src.app.batch import BatchRunner, PlanError, load_plan, main, parse_plan
+from src.hardware.simulators import SimulatedCamera, SimulatedExcitationSource
+from src.storage.cube import CubeReader
+
+FILTERS = {"1": "350nm", "2": "400nm", "3": "450nm", "4": "500nm"}
+
+PLAN_YAML = """
+exposure_ms: 100
+samples:
+  - name: s1
+    pairs:
+      - [280nm, 500nm]
+      - {excitation: 310nm, emission: 400nm, exposure_ms: 20}
+      - [280nm, 400nm]
+  - name: s2
+    exposure_ms: 50
+    pairs:
+      - [340nm, 450nm]
+"""
+
+
+class Filter:
+    current_position = 1
+
+    def move_to(self, slot):
+        self.current_position = slot
+        return True
+
+
+def test_load_yaml_plan(tmp_path):
+    path = tmp_path / "plan.yaml"
+    path.write_text(PLAN_YAML, encoding="utf-8")
+    plan = load_plan(path)
+    assert [s.name for s in plan.samples] == ["s1", "s2"]
+    assert plan.samples[0].exposures == [100.0, 20.0, 100.0]
+    assert plan.samples[1].exposures == [50.0]
+
+
+@pytest.mark.parametrize("data", [{}, {"samples": [{"pairs": [["a", "b"]]}]}, {"samples": [{"name": "x"}]},
+                                  {"samples": [{"name": "x", "pairs": [["a"]]}]},
+                                  {"samples": [{"name": "../x", "pairs": [["a", "b"]]}]}])
+def test_invalid_plans_are_rejected(data):
+    with pytest.raises(PlanError):
+        parse_plan(data)
+
+
+def test_runner_keeps_exposure_with_reordered_pair(tmp_path):
+    plan = parse_plan({"exposure_ms": 100, "samples": [
+        {"name": "s1", "pairs": [["280nm", "500nm"], {"excitation": "310nm", "emission": "400nm", "exposure_ms": 20}]}]})
+    runner = BatchRunner(Filter(), SimulatedCamera(shape=(8, 8)), SimulatedExcitationSource(), FILTERS, tmp_path)
+    results = runner.run(plan)
+    assert results[0].planned_move_time <= results[0].naive_move_time
+    with CubeReader(tmp_path / "s1.fcube") as reader:
+        assert reader.band_metadata("310nm", "400nm")["exposure_ms"] == 20
+        assert reader.band_metadata("280nm", "500nm")["exposure_ms"] == 100
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="ptyが使えない環境")
+def test_cli_simulated_run_writes_cubes_and_report(tmp_path):
+    plan_path = tmp_path / "plan.json"
+    plan_path.write_text(json.dumps({"exposure_ms": 5, "samples": [
+        {"name": "a", "pairs": [["280nm", "400nm"], ["310nm", "450nm"]]}]}), encoding="utf-8")
+    assert main([str(plan_path), "--simulate", "--save-dir", str(tmp_path / "out")]) == 0
+    assert (tmp_path / "out" / "a.fcube").exists()
+    report = json.loads(next((tmp_path / "out").glob("batch_report_*.json")).read_text(encoding="utf-8"))
+    assert report["total_frames"] == 2
+    assert report["samples"][0]["steps"][0]["capture"] >= 0
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="ptyが使えない環境")
+def test_cli_simulated_auto_exposure_keeps_cache_in_output(tmp_path, monkeypatch):
+    real_cache = tmp_path / "real_cache.json"
+    monkeypatch.setattr("src.app.auto_exposure.DEFAULT_CACHE_PATH", real_cache)
+    plan_path = tmp_path / "plan.json"
+    plan_path.write_text(json.dumps({"exposure_ms": "auto", "samples": [
+        {"name": "a", "pairs": [["280nm", "400nm"]]}]}), encoding="utf-8")
+    assert main([str(plan_path), "--simulate", "--save-dir", str(tmp_path / "out")]) == 0
+    assert not real_cache.exists()
+    assert (tmp_path / "out" / "exposure_cache.simulated.json").exists()
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="ptyが使えない環境")
+def test_cli_replays_recorded_auto_exposure_without_cache(tmp_path, monkeypatch):
+    real_cache = tmp_path / "real_cache.json"
+    monkeypatch.setattr("src.app.auto_exposure.DEFAULT_CACHE_PATH", real_cache)
+    plan_path = tmp_path / "plan.json"
+    plan_path.write_text(json.dumps({"exposure_ms": "auto", "samples": [
+        {"name": "a", "pairs": [["280nm", "400nm"], ["310nm", "450nm"]]}]}), encoding="utf-8")
+    trace = tmp_path / "session.jsonl"
+    assert main([str(plan_path), "--simulate", "--save-dir", str(tmp_path / "rec"), "--record-trace", str(trace)]) == 0
+    assert main([str(plan_path), "--save-dir", str(tmp_path / "play"), "--replay-trace", str(trace),
+                 "--replay-speed", "inf"]) == 0
+    assert not real_cache.exists()
+    # 一様な再生画像でも、記録と同じ露光時間で撮影される
+    with CubeReader(tmp_path / "rec" / "a.fcube") as recorded, CubeReader(tmp_path / "play" / "a.fcube") as replayed:
+        for pair in (("280nm", "400nm"), ("310nm", "450nm")):
+            assert replayed.band_metadata(*pair)["exposure_ms"] == recorded.band_metadata(*pair)["exposure_ms"]
+
+
+def test_cli_rejects_non_positive_replay_speed(tmp_path):
+    with pytest.raises(SystemExit) as exc:
+        main([str(tmp_path / "plan.json"), "--replay-trace", str(tmp_path / "t.jsonl"), "--replay-speed", "0"])
+    assert exc.value.code == 2
@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.app.benchmark import percentiles, run_benchmark
+from src.hardware.simulators import SimulatedCamera, SimulatedExcitationSource
+
+
+def test_simulated_camera_scales_with_exposure():
+    camera = SimulatedCamera(shape=(64, 64), seed=1)
+    short, long = camera.capture(10), camera.capture(100)
+    assert short.dtype == np.uint16 and short.shape == (64, 64)
+    assert long.astype(float).sum() > short.astype(float).sum()
+
+
+def test_simulated_camera_uses_spectrum_of_current_excitation():
+    excitation = SimulatedExcitationSource()
+    camera = SimulatedCamera(shape=(32, 32), excitation=excitation,
+                             spectrum=lambda led, pos: 0.0 if led == "dark" else 1.0)
+    excitation.select("dark")
+    dark = camera.capture(100)
+    excitation.select("bright")
+    assert camera.capture(100).mean() > dark.mean() + 10
+
+
+def test_percentiles():
+    result = percentiles(list(range(101)))
+    assert result == {"p50": 50.0, "p90": 90.0, "p99": 99.0}
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="ptyが使えない環境")
+def test_benchmark_reports_throughput(tmp_path):
+    result = run_benchmark(commands=5, shape=(32, 32), leds=["280nm", "310nm"],
+                           filters={"1": "350nm", "2": "400nm"}, save_directory=tmp_path)
+    assert result["frames"] == 4
+    assert result["frames_per_second"] > 0
+    assert result["command_latency_ms"]["p50"] is not None
+    assert len(list((tmp_path / "benchmark").glob("*.npy"))) == 4
@@ -0,0 +1,62 @@
+import numpy as np
+
+from src.analysis.features import analyze_catalog
+from src.app.acquisition import AcquisitionEngine
+from src.app.sequence_planner import SequenceStep
+from src.hardware.simulators import SimulatedCamera, SimulatedExcitationSource
+from src.storage.catalog import Catalog, build_pyramid
+from src.storage.cube import CubeFrameWriter, CubeWriter
+
+
+class Filter:
+    def move_to(self, slot):
+        return True
+
+
+def test_build_pyramid_downsamples_with_shared_scale():
+    frame = np.zeros((480, 640), dtype=np.uint16)
+    frame[:, 320:] = 4000
+    large, small = build_pyramid(frame)
+    assert large.shape == (120, 160) and small.shape == (30, 40)
+    assert large.dtype == np.uint8
+    # 同じ明るさは全段で同じ値になる
+    assert large[0, -1] == small[0, -1] == 255
+    assert large[0, 0] == small[0, 0] == 0
+
+
+def test_engine_registers_bands_and_previews(tmp_path):
+    steps = [SequenceStep("280nm", "400nm", 2), SequenceStep("310nm", "450nm", 3)]
+    with Catalog.in_directory(tmp_path) as catalog:
+        writer = CubeFrameWriter.for_steps(tmp_path, steps, catalog=catalog)
+        engine = AcquisitionEngine(Filter(), SimulatedCamera(shape=(64, 96)), SimulatedExcitationSource(), writer)
+        engine.run(steps, 20, "s1", sample_type="soil")
+        engine.run(steps[:1], 30, "s2")
+
+        samples = catalog.samples()
+        assert [s["name"] for s in samples] == ["s2", "s1"]
+        assert samples[1]["bands"] == 2 and samples[1]["sample_type"] == "soil"
+        assert catalog.sample_paths(sample_type="soil") == [str(tmp_path / "s1.fcube")]
+
+        bands = catalog.bands(excitation="310nm")
+        assert len(bands) == 1
+        assert bands[0]["sample_name"] == "s1" and bands[0]["exposure_ms"] == 20
+        assert bands[0]["filter_position"] == 3
+        assert catalog.preview(bands[0]["id"]).startswith(b"P5 96 64 255\n")
+        assert catalog.preview(bands[0]["id"], level=1).startswith(b"P5 48 32 255\n")
+
+
+def test_rebuild_indexes_existing_files_once(tmp_path):
+    frame = np.arange(16 * 24, dtype=np.uint16).reshape(16, 24)
+    with CubeWriter(tmp_path / "old.fcube", ["280nm"], ["400nm"], frame.shape,
+                    metadata={"sample_name": "old"}) as writer:
+        writer.write_band("280nm", "400nm", frame, {"exposure_ms": 50})
+    (tmp_path / "broken.fcube").write_bytes(b"not a cube")
+
+    with Catalog.in_directory(tmp_path) as catalog:
+        assert catalog.rebuild(tmp_path) == 1
+        assert catalog.rebuild(tmp_path) == 0
+        (band,) = catalog.bands()
+        assert band["sample_name"] == "old" and band["exposure_ms"] == 50
+        assert band["max"] == frame[::2, ::2].max()
+        assert len(analyze_catalog(catalog, name_like="ol", max_workers=1)) == 1
+        assert analyze_catalog(catalog, name_like="new", max_workers=1) == []
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from src.utils.config_parser import SettingsError, load_settings, parse_wavelength, subscribe, unsubscribe
+
+INI = """
+[FilterChanger]
+port = COM3
+baudrate = 9600
+
+[Camera]
+exposure_default = 500
+
+[Paths]
+default_save_directory = /tmp/data
+
+[FilterWavelengths]
+1 = 350nm
+2 = 400nm
+3 = Empty
+
+[LedWavelengths]
+a = 280nm
+b = 365nm
+"""
+
+
+@pytest.fixture
+def ini(tmp_path):
+    path = tmp_path / "settings.ini"
+    path.write_text(INI, encoding="utf-8")
+    return path
+
+
+def test_parses_typed_values_and_lookup_tables(ini):
+    settings = load_settings(ini)
+    assert settings.filter_changer_port == "COM3"
+    assert settings.filter_changer_baudrate == 9600
+    assert settings.exposure_default == 500.0
+    assert settings.filter_options == {"1": "350nm", "2": "400nm", "3": "Empty"}
+    assert settings.filter_nm == {1: 350, 2: 400, 3: None}
+    assert settings.filter_slot_by_nm == {350: 1, 400: 2}
+    assert settings.led_nm == {"280nm": 280, "365nm": 365}
+    assert settings.filters_above(365) == ["400nm"]
+    assert settings.get("Paths", "default_save_directory") == "/tmp/data"
+
+
+def test_settings_are_immutable(ini):
+    settings = load_settings(ini)
+    with pytest.raises(AttributeError):
+        settings.filter_changer_port = "COM4"
+    with pytest.raises(TypeError):
+        settings.filter_nm[1] = 0
+
+
+def test_cached_until_file_changes(ini):
+    first = load_settings(ini)
+    assert load_settings(ini) is first
+
+    notified = []
+    subscribe(notified.append)
+    try:
+        ini.write_text(INI.replace("COM3", "COM7"), encoding="utf-8")
+        stat = os.stat(ini)
+        os.utime(ini, ns=(stat.st_atime_ns, first.mtime_ns + 1_000_000))
+        reloaded = load_settings(ini)
+    finally:
+        unsubscribe(notified.append)
+    assert reloaded.filter_changer_port == "COM7"
+    assert notified == [reloaded]
+
+
+def test_invalid_values_are_rejected(tmp_path):
+    path = tmp_path / "bad.ini"
+    path.write_text(INI.replace("9600", "fast"), encoding="utf-8")
+    with pytest.raises(SettingsError):
+        load_settings(path)
+
+
+def test_parse_wavelength():
+    assert parse_wavelength("365nm") == 365
+    assert parse_wavelength("Empty") is None
+
+
+def test_project_settings_file_is_valid():
+    settings = load_settings()
+    assert settings.filter_slot_by_nm[350] == 1
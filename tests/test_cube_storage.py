@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from src.app.acquisition import AcquisitionEngine
+from src.app.sequence_planner import SequenceStep
+from src.hardware.simulators import SimulatedCamera, SimulatedExcitationSource
+from src.storage.cube import CubeFormatError, CubeFrameWriter, CubeReader, CubeWriter
+
+EXCITATIONS = ["280nm", "310nm"]
+EMISSIONS = ["400nm", "450nm", "500nm"]
+
+
+def make_frame(seed):
+    return np.random.default_rng(seed).integers(0, 4000, size=(16, 24), dtype=np.uint16)
+
+
+@pytest.mark.parametrize("compression", ["zlib", "none"])
+def test_round_trip_each_band(tmp_path, compression):
+    path = tmp_path / "s.fcube"
+    frames = {}
+    with CubeWriter(path, EXCITATIONS, EMISSIONS, (16, 24), compression=compression,
+                    metadata={"sample": "s"}) as writer:
+        for i, (ex, em) in enumerate([("280nm", "400nm"), ("310nm", "500nm")]):
+            frames[(ex, em)] = make_frame(i)
+            writer.write_band(ex, em, frames[(ex, em)], {"exposure_ms": 100 + i})
+
+    with CubeReader(path) as reader:
+        assert reader.complete
+        assert reader.shape == (2, 3, 16, 24)
+        assert reader.metadata == {"sample": "s"}
+        assert reader.available() == list(frames)
+        for (ex, em), frame in frames.items():
+            np.testing.assert_array_equal(reader.band(ex, em), frame)
+        assert reader.band_metadata("310nm", "500nm") == {"exposure_ms": 101}
+        cube = reader.to_array()
+        np.testing.assert_array_equal(cube[1, 2], frames[("310nm", "500nm")])
+        assert not cube[0, 1].any()
+
+
+def test_compression_shrinks_smooth_frames(tmp_path):
+    frame = np.tile(np.arange(256, dtype=np.uint16) + 1000, (64, 1))
+    with CubeWriter(tmp_path / "c.fcube", ["a"], ["b"], frame.shape) as writer:
+        writer.write_band("a", "b", frame)
+    assert (tmp_path / "c.fcube").stat().st_size < frame.nbytes / 4
+
+
+def test_interrupted_file_is_recovered_by_scanning(tmp_path):
+    path = tmp_path / "crash.fcube"
+    writer = CubeWriter(path, EXCITATIONS, EMISSIONS, (16, 24))
+    writer.write_band("280nm", "450nm", make_frame(3))
+    writer.write_band("310nm", "400nm", make_frame(4))
+    writer._file.close()  # close() を呼ばずに終了した状態
+    with open(path, "ab") as f:
+        f.write(b"CHNK\x00")  # 途中までしか書かれていないチャンク
+
+    with CubeReader(path) as reader:
+        assert not reader.complete
+        assert reader.available() == [("280nm", "450nm"), ("310nm", "400nm")]
+        np.testing.assert_array_equal(reader.band("310nm", "400nm"), make_frame(4))
+
+
+def test_rejects_unknown_band_and_bad_file(tmp_path):
+    with CubeWriter(tmp_path / "x.fcube", EXCITATIONS, EMISSIONS, (16, 24)) as writer:
+        with pytest.raises(KeyError):
+            writer.write_band("999nm", "400nm", make_frame(0))
+    (tmp_path / "bad.fcube").write_bytes(b"not a cube")
+    with pytest.raises(CubeFormatError):
+        CubeReader(tmp_path / "bad.fcube")
+
+
+def test_engine_writes_one_cube_per_sample(tmp_path):
+    steps = [SequenceStep("280nm", "400nm", 2), SequenceStep("280nm", "450nm", 3)]
+
+    class Filter:
+        def move_to(self, slot):
+            return True
+
+    writer = CubeFrameWriter.for_steps(tmp_path, steps)
+    camera = SimulatedCamera(shape=(8, 8))
+    AcquisitionEngine(Filter(), camera, SimulatedExcitationSource(), writer).run(steps, 10, "s1")
+    with CubeReader(tmp_path / "s1.fcube") as reader:
+        assert reader.shape == (1, 2, 8, 8)
+        assert reader.band_metadata("280nm", "450nm")["exposure_ms"] == 10
+
+
+def test_same_sample_twice_keeps_first_cube(tmp_path):
+    steps = [SequenceStep("280nm", "400nm", 2)]
+
+    class Filter:
+        def move_to(self, slot):
+            return True
+
+    for exposure in (10, 20):
+        writer = CubeFrameWriter.for_steps(tmp_path, steps)
+        AcquisitionEngine(Filter(), SimulatedCamera(shape=(8, 8)), SimulatedExcitationSource(), writer).run(
+            steps, exposure, "s1")
+    with CubeReader(tmp_path / "s1.fcube") as first, CubeReader(tmp_path / "s1_2.fcube") as second:
+        assert first.band_metadata("280nm", "400nm")["exposure_ms"] == 10
+        assert second.band_metadata("280nm", "400nm")["exposure_ms"] == 20
+    with pytest.raises(FileExistsError):
+        CubeWriter(tmp_path / "s1.fcube", EXCITATIONS, EMISSIONS, (8, 8))
+
+
+@pytest.mark.parametrize("name", ["../s1", "a/b", "a\\b", ".."])
+def test_rejects_sample_names_that_are_paths(tmp_path, name):
+    with pytest.raises(ValueError):
+        CubeFrameWriter(tmp_path, EXCITATIONS, EMISSIONS).path_for(name)
@@ -0,0 +1,136 @@
+import threading
+import time
+
+from src.app.device_manager import CONNECTED, DeviceManager, RECONNECTING
+
+
+class SlowDevice:
+    """接続に一定時間かかる試験用デバイス"""
+
+    def __init__(self, connect_time=0.0, connect_result=True):
+        self.connect_time = connect_time
+        self.connect_result = connect_result
+        self.healthy = True
+        self.connected = False
+        self.connect_calls = 0
+        self.disconnect_calls = 0
+
+    def connect(self):
+        self.connect_calls += 1
+        time.sleep(self.connect_time)
+        self.connected = self.connect_result
+        return self.connect_result
+
+    def disconnect(self):
+        self.disconnect_calls += 1
+        self.connected = False
+
+    def health_check(self):
+        return self.connected and self.healthy
+
+
+def test_connect_all_runs_in_parallel():
+    manager = DeviceManager()
+    for name in ("a", "b", "c"):
+        manager.add(name, SlowDevice(connect_time=0.3))
+    start = time.perf_counter()
+    results = manager.connect_all()
+    elapsed = time.perf_counter() - start
+    manager.stop()
+    assert results == {"a": True, "b": True, "c": True}
+    assert elapsed < 0.6
+
+
+def test_connect_timeout_does_not_block_other_devices():
+    statuses = []
+    manager = DeviceManager(on_status=lambda name, state, detail: statuses.append((name, state)))
+    manager.add("fast", SlowDevice(connect_time=0.0))
+    manager.add("hung", SlowDevice(connect_time=1.0), connect_timeout=0.2)
+    start = time.perf_counter()
+    results = manager.connect_all()
+    elapsed = time.perf_counter() - start
+    manager.stop()
+    assert results == {"fast": True, "hung": False}
+    assert elapsed < 0.6
+    assert ("fast", CONNECTED) in statuses
+    assert ("hung", RECONNECTING) in statuses
+
+
+def test_reconnects_after_failed_health_check():
+    device = SlowDevice()
+    reconnected = threading.Event()
+
+    def on_status(name, state, detail):
+        if state == CONNECTED and device.connect_calls >= 2:
+            reconnected.set()
+
+    manager = DeviceManager(on_status=on_status, heartbeat_interval=0.05, backoff_initial=0.05)
+    manager.add("fc", device)
+    manager.start()
+    try:
+        deadline = time.monotonic() + 2.0
+        while not manager.is_connected("fc") and time.monotonic() < deadline:
+            time.sleep(0.01)
+        device.healthy = False
+        deadline = time.monotonic() + 2.0
+        while not device.disconnect_calls and time.monotonic() < deadline:
+            time.sleep(0.01)
+        device.healthy = True
+        assert reconnected.wait(2.0)
+        assert device.disconnect_calls >= 1
+    finally:
+        manager.stop()
+    assert not device.connected
+
+
+def test_backoff_grows_and_is_capped():
+    manager = DeviceManager(backoff_initial=1.0, backoff_max=4.0)
+    manager.add("dead", SlowDevice(connect_result=False))
+    manager.connect_all()
+    entry = manager._devices["dead"]
+    delays = []
+    for _ in range(4):
+        before = time.monotonic()
+        manager._schedule_retry(entry, None)
+        delays.append(round(entry.next_retry - before))
+    manager.stop()
+    assert delays == [2, 4, 4, 4]
+
+
+def test_single_failed_check_does_not_disconnect():
+    device = SlowDevice()
+    manager = DeviceManager(failures_before_disconnect=3)
+    manager.add("fc", device)
+    manager.connect_all()
+    entry = manager._devices["fc"]
+    device.healthy = False
+    manager._check(entry)
+    manager._check(entry)
+    assert manager.is_connected("fc") and device.disconnect_calls == 0
+    device.healthy = True
+    manager._check(entry)
+    device.healthy = False
+    manager._check(entry)
+    manager._check(entry)
+    assert manager.is_connected("fc")
+    manager._check(entry)
+    assert manager.state("fc") == RECONNECTING and device.disconnect_calls == 1
+    manager.stop()
+
+
+def test_heartbeat_skips_busy_or_paused_devices():
+    device = SlowDevice()
+    checks = []
+    device.health_check = lambda: checks.append(1) or True
+    manager = DeviceManager(heartbeat_interval=0.0)
+    manager.add("fc", device)
+    manager.connect_all()
+    device.busy = True
+    manager.poll()
+    device.busy = False
+    with manager.paused("fc"):
+        manager.poll()
+    assert checks == []
+    manager.poll()
+    assert checks == [1]
+    manager.stop()
@@ -0,0 +1,92 @@
+import threading
+import time
+
+from src.app.device_worker import CallbackDispatcher, DeviceWorker
+
+
+def wait_for(predicate, dispatcher, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        dispatcher.process_pending()
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_result_is_delivered_through_dispatcher():
+    dispatcher = CallbackDispatcher()
+    worker = DeviceWorker("test", dispatcher)
+    results = []
+    worker.submit(lambda x: x * 2, 21, on_success=results.append)
+    assert wait_for(lambda: results == [42], dispatcher)
+    worker.shutdown()
+
+
+def test_callbacks_run_on_calling_thread_not_worker():
+    dispatcher = CallbackDispatcher()
+    worker = DeviceWorker("test", dispatcher)
+    threads = []
+    worker.submit(lambda: None, on_success=lambda _: threads.append(threading.current_thread()))
+    assert wait_for(lambda: threads, dispatcher)
+    assert threads[0] is threading.current_thread()
+    worker.shutdown()
+
+
+def test_errors_are_routed_to_on_error():
+    dispatcher = CallbackDispatcher()
+    worker = DeviceWorker("test", dispatcher)
+    errors = []
+
+    def fail():
+        raise RuntimeError("boom")
+
+    job = worker.submit(fail, on_error=errors.append)
+    assert wait_for(lambda: errors, dispatcher)
+    assert isinstance(errors[0], RuntimeError)
+    assert job.future.exception() is errors[0]
+    worker.shutdown()
+
+
+def test_cancel_pending_skips_queued_jobs():
+    dispatcher = CallbackDispatcher()
+    worker = DeviceWorker("test", dispatcher)
+    release = threading.Event()
+    ran = []
+    blocker = worker.submit(release.wait)
+    assert wait_for(blocker.future.running, dispatcher)
+    queued = [worker.submit(ran.append, i) for i in range(3)]
+    assert worker.cancel_pending() == 3
+    assert all(job.cancelled for job in queued)
+    release.set()
+    worker.shutdown()
+    assert ran == []
+
+
+def test_cancel_pending_by_tag_keeps_other_jobs():
+    dispatcher = CallbackDispatcher()
+    worker = DeviceWorker("test", dispatcher)
+    release = threading.Event()
+    ran = []
+    blocker = worker.submit(release.wait)
+    assert wait_for(blocker.future.running, dispatcher)
+    worker.submit(ran.append, "move 3", tag="move")
+    query = worker.submit(ran.append, "query")
+    worker.submit(ran.append, "move 4", tag="move")
+    assert worker.cancel_pending(tag="move") == 2
+    latest = worker.submit(ran.append, "move 5", tag="move")
+    release.set()
+    assert latest.result(timeout=1.0) is None
+    assert not query.cancelled
+    assert ran == ["query", "move 5"]
+    worker.shutdown()
+
+
+def test_status_reports_start_and_end():
+    dispatcher = CallbackDispatcher()
+    statuses = []
+    worker = DeviceWorker("fc", dispatcher, on_status=lambda name, desc: statuses.append((name, desc)))
+    worker.submit(lambda: None, description="移動")
+    assert wait_for(lambda: len(statuses) == 2, dispatcher)
+    assert statuses == [("fc", "移動"), ("fc", None)]
+    worker.shutdown()
@@ -0,0 +1,146 @@
+import importlib.util
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from src.app.acquisition import AcquisitionEngine, AcquisitionError
+from src.app.sequence_planner import SequenceStep
+from src.hardware.excitation import create_excitation_source
+from src.hardware.led_controller import LedController
+from src.hardware import simulators
+from src.hardware.simulators import FakeLedServer, FakeMax303Device
+from src.hardware.xenon_controller import XenonController
+from src.utils.config_parser import load_settings
+
+LEDS = ["280nm", "310nm", "365nm"]
+
+
+@pytest.fixture
+def server():
+    with FakeLedServer(leds=LEDS) as fake:
+        yield fake
+
+
+@pytest.fixture
+def led(server):
+    controller = LedController(*server.address, leds=LEDS)
+    assert controller.connect()
+    yield controller
+    controller.disconnect()
+
+
+def test_select_and_off(led, server):
+    assert led.select("310nm")
+    assert server.current == "310nm" == led.current
+    led.off()
+    assert server.current is None
+    assert server.received == ["ping", "select", "off"]
+
+
+def test_schedule_skips_round_trips_for_repeated_led(led, server):
+    sequence = ["280nm", "280nm", "310nm", "310nm", "365nm"]
+    assert led.upload_schedule(sequence)
+    for name in sequence:
+        assert led.select(name)
+        assert server.current == name
+    assert server.received == ["ping", "schedule", "next", "next", "next"]
+    assert server.switches == 3
+
+
+def test_out_of_order_select_falls_back_to_direct_switch(led, server):
+    assert led.upload_schedule(["280nm", "310nm"])
+    assert led.select("365nm")
+    assert led.select("310nm")
+    assert server.received[-2:] == ["select", "select"]
+
+
+def test_unknown_led_is_rejected_before_upload(led, server):
+    assert not led.upload_schedule(["280nm", "999nm"])
+    assert "schedule" not in server.received
+
+
+def test_batched_requests_return_replies_in_order(led):
+    replies = led._request_many([{"cmd": "select", "led": "280nm"}, {"cmd": "ping"}, {"cmd": "bogus"}])
+    assert [r["ok"] for r in replies] == [True, True, False]
+
+
+def test_lost_server_fails_health_check(led, server):
+    assert led.health_check()
+    server.stop()
+    assert not led.health_check()
+    assert not led.is_connected
+
+
+def test_engine_uploads_schedule_once(led, server, tmp_path):
+    class Filter:
+        def move_to(self, slot):
+            return True
+
+    class Camera:
+        def capture(self, exposure_ms):
+            return np.zeros((2, 2), dtype=np.uint16)
+
+    class Writer:
+        def write(self, *args):
+            pass
+
+        def close(self):
+            pass
+
+    steps = [SequenceStep("280nm", "400nm", 2), SequenceStep("280nm", "450nm", 3), SequenceStep("365nm", "450nm", 3)]
+    report = AcquisitionEngine(Filter(), Camera(), led, Writer()).run(steps, 10, "s1")
+    assert report.frames == 3
+    assert server.received == ["ping", "schedule", "next", "next", "off"]
+    with pytest.raises(AcquisitionError):
+        AcquisitionEngine(Filter(), Camera(), led, Writer()).run([SequenceStep("999nm", "400nm", 2)], 10, "s2")
+
+
+@pytest.mark.skipif(not hasattr(os, "openpty"), reason="ptyが使えない環境")
+def test_xenon_rotates_filter_with_shutter_closed():
+    with FakeMax303Device() as device:
+        xenon = XenonController(device.port, filter_positions={"280nm": 3, "365nm": 5}, timeout=1.0,
+                                experimental=True)
+        assert xenon.connect()
+        assert xenon.select("280nm")
+        assert device.filter_position == 3 and device.shutter_open
+        assert xenon.select("280nm")
+        assert xenon.select("365nm")
+        assert not xenon.select("310nm")
+        assert xenon.health_check()
+        xenon.off()
+        assert not device.shutter_open
+        xenon.disconnect()
+    assert device.received == ["S0", "F3", "S1", "S0", "F5", "S1", "S?", "S0"]
+
+
+def test_factory_chooses_backend_from_system_type(tmp_path):
+    base = "[FilterChanger]\nport = COM3\nbaudrate = 9600\n[LedWavelengths]\n1 = 280nm\n"
+    path = tmp_path / "settings.ini"
+    path.write_text(base + "[System]\nsystem_type = led\n[LedController]\nhost = 10.0.0.2\n", encoding="utf-8")
+    led = create_excitation_source(load_settings(path, force=True))
+    assert isinstance(led, LedController) and led.host == "10.0.0.2" and led.leds == ["280nm"]
+
+    path.write_text(base + "[System]\nsystem_type = Xenon\n[XenonLamp]\nport = COM9\n[XenonFilters]\n280nm = 2\n",
+                    encoding="utf-8")
+    # 試験中の実装のため、明示しなければ作らない（GUI・バッチ撮影からは使えない）
+    with pytest.raises(ValueError):
+        create_excitation_source(load_settings(path, force=True))
+    xenon = create_excitation_source(load_settings(path, force=True), allow_experimental=True)
+    assert isinstance(xenon, XenonController) and xenon.port == "COM9" and xenon.filter_positions == {"280nm": 2}
+    assert not XenonController("COM9").connect()
+
+    path.write_text(base + "[System]\nsystem_type = laser\n", encoding="utf-8")
+    with pytest.raises(ValueError):
+        create_excitation_source(load_settings(path, force=True))
+
+
+def test_simulators_import_without_pty_modules(monkeypatch):
+    # Windowsには termios/tty がないが、擬似カメラなどは読み込めるようにする
+    monkeypatch.setitem(sys.modules, "tty", None)
+    monkeypatch.setitem(sys.modules, "termios", None)
+    spec = importlib.util.spec_from_file_location("simulators_without_pty", simulators.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert module.SimulatedCamera(shape=(4, 4), num_particles=1).capture(1.0).shape == (4, 4)
@@ -0,0 +1,73 @@
+import numpy as np
+
+from src.analysis.features import analyze_samples, extract_features, label_components, otsu_threshold
+from src.storage.cube import CubeWriter
+
+EXCITATIONS = ["280nm", "340nm"]
+EMISSIONS = ["400nm", "450nm", "500nm"]
+
+
+def make_cube():
+    """左上の粒子は短波長で、右下の粒子は長波長で光るキューブ"""
+    cube = np.full((2, 3, 40, 50), 100, dtype=np.uint16)
+    spectrum_a = np.array([[1000, 500, 100], [300, 100, 50]])
+    spectrum_b = np.array([[50, 200, 900], [100, 400, 1500]])
+    cube[:, :, 5:10, 5:12] += spectrum_a[:, :, None, None].astype(np.uint16)
+    cube[:, :, 25:33, 30:36] += spectrum_b[:, :, None, None].astype(np.uint16)
+    return cube, spectrum_a, spectrum_b
+
+
+def test_label_components_separates_regions():
+    mask = np.zeros((6, 8), dtype=bool)
+    mask[0:2, 0:2] = True
+    mask[3:6, 4] = True
+    mask[5, 4:8] = True
+    labels = label_components(mask)
+    assert set(np.unique(labels)) == {0, 1, 2}
+    assert len(set(labels[3:6, 4])) == 1 and labels[5, 7] == labels[3, 4]
+
+
+def test_otsu_threshold_between_modes():
+    image = np.concatenate([np.full(100, 10.0), np.full(100, 200.0)])
+    assert 10 < otsu_threshold(image) < 200
+
+
+def test_extract_features_finds_particles_and_spectra():
+    cube, spectrum_a, spectrum_b = make_cube()
+    features = extract_features(cube, "s", EXCITATIONS, EMISSIONS)
+    assert features.num_particles == 2
+    assert sorted(features.areas.tolist()) == [35, 48]
+    order = np.argsort(features.centroids[:, 0])
+    np.testing.assert_allclose(features.fingerprints[order[0]], spectrum_a + 100)
+    np.testing.assert_allclose(features.fingerprints[order[1]], spectrum_b + 100)
+    np.testing.assert_allclose(features.normalized_fingerprints().sum(axis=(1, 2)), 1.0)
+
+
+def test_empty_and_noise_only_cubes_have_no_particles():
+    constant = np.full((2, 3, 40, 50), 100, dtype=np.uint16)
+    assert extract_features(constant).num_particles == 0
+    noise = np.random.default_rng(0).normal(100, 3, size=constant.shape)
+    assert extract_features(noise).num_particles == 0
+
+
+def test_particles_are_found_above_noise():
+    cube, _, _ = make_cube()
+    noisy = cube + np.random.default_rng(1).normal(0, 3, size=cube.shape)
+    assert extract_features(noisy, "s", EXCITATIONS, EMISSIONS).num_particles == 2
+
+
+def test_analyze_samples_in_parallel_keeps_order(tmp_path):
+    cube, _, _ = make_cube()
+    paths = []
+    for name, particles in (("one", cube), ("empty", np.full_like(cube, 100))):
+        path = tmp_path / f"{name}.fcube"
+        with CubeWriter(path, EXCITATIONS, EMISSIONS, cube.shape[2:], metadata={"sample_name": name}) as writer:
+            for ex, ex_label in enumerate(EXCITATIONS):
+                for em, em_label in enumerate(EMISSIONS):
+                    writer.write_band(ex_label, em_label, particles[ex, em], {"exposure_ms": 100})
+        paths.append(path)
+    results = analyze_samples(paths, max_workers=2)
+    assert [r.sample_name for r in results] == ["one", "empty"]
+    assert results[0].num_particles == 2
+    assert results[0].excitations == EXCITATIONS
+    assert results[1].num_particles == 0
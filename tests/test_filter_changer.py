@@ -0,0 +1,217 @@
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from src.hardware.filter_changer import MIN_MOVE_TIMEOUT, SLOT_MOVE_TIME, TRACE_DEVICE, FilterChangerController, slot_distance
+from src.hardware.session_trace import Mismatch, ReplayMismatch, TraceRecorder, TraceReplay, load_trace
+from src.hardware.simulators import FakeFC8Device
+
+# 現場で記録した通信（F? → F1, F3 → 約1秒後に OK, 撮影1枚, F4, F? → F4）
+FIELD_TRACE = Path(__file__).parent / "traces" / "fc8_session.jsonl"
+
+
+@pytest.fixture
+def device():
+    if not hasattr(os, "openpty"):
+        pytest.skip("ptyが使えない環境")
+    with FakeFC8Device() as fake:
+        yield fake
+
+
+@pytest.fixture
+def controller(device):
+    fc = FilterChangerController(port=device.port, baudrate=9600)
+    assert fc.connect()
+    yield fc
+    fc.disconnect()
+
+
+def test_move_and_query_position(controller, device):
+    assert controller.move_to(3)
+    assert controller.get_current_position() == 3
+    assert device.received == ["F3", "F?"]
+
+
+def test_rejects_out_of_range_position(controller, device):
+    assert not controller.move_to(9)
+    assert device.received == []
+
+
+def test_response_wakes_waiter_without_polling_delay(controller):
+    controller.get_current_position()
+    start = time.perf_counter()
+    for _ in range(10):
+        assert controller.get_current_position() == 1
+    assert (time.perf_counter() - start) / 10 < 0.04
+
+
+def test_timeout_returns_none(controller, device):
+    device.silent = True
+    assert controller._send_command("F?\r\n", timeout_sec=0.2) is None
+    assert not controller._pending
+
+
+def test_late_reply_after_timeout_does_not_complete_next_move(controller, device):
+    device.move_time_per_slot = 0.4
+    controller.move_timeout = lambda position: 0.3
+    assert not controller.move_to(5)
+    del controller.move_timeout
+    # 5への移動の 'OK' が遅れて届くが、次の移動は位置を確認し直してから行う
+    start = time.perf_counter()
+    assert controller.move_to(4)
+    assert time.perf_counter() - start > 1.5
+    assert device.position == 4 and controller.current_position == 4
+    assert device.received == ["F5", "F?", "F4"]
+
+
+def test_slot_distance_takes_shorter_direction():
+    assert slot_distance(1, 2) == 1
+    assert slot_distance(1, 8) == 1
+    assert slot_distance(2, 6) == 4
+
+
+def test_move_timeout_covers_rotation_in_either_direction(controller):
+    assert controller.move_timeout(5) >= 7 * SLOT_MOVE_TIME
+    assert controller.move_to(1)
+    # 隣のスロットでも、逆向きに7スロット回る場合に間に合うようにする
+    assert controller.move_timeout(2) >= 7 * SLOT_MOVE_TIME
+    assert controller.move_timeout(5) >= MIN_MOVE_TIMEOUT
+
+
+def test_move_completes_on_ok_reply(controller, device):
+    device.move_time_per_slot = 0.05
+    assert controller.move_to(2)
+    assert controller.current_position == 2
+    assert controller.last_move_duration < 0.5
+
+
+def test_health_check_detects_silent_device(controller, device):
+    assert controller.is_connected
+    controller.last_response_time = None
+    assert controller.health_check()
+    device.silent = True
+    controller.last_response_time = None
+    assert not controller.health_check()
+
+
+def test_health_check_does_not_query_during_move(controller, device):
+    device.move_time_per_slot = 0.2
+    mover = threading.Thread(target=controller.move_to, args=(4,))
+    mover.start()
+    deadline = time.monotonic() + 1.0
+    while not controller.busy and time.monotonic() < deadline:
+        time.sleep(0.005)
+    controller.last_response_time = None
+    assert controller.health_check()
+    mover.join()
+    assert device.received == ["F4"]
+
+
+def test_disconnect_clears_connection_state(controller):
+    controller.disconnect()
+    assert not controller.is_connected
+    assert not controller.health_check()
+    controller.disconnect()
+
+
+def replay_controller(replay):
+    fc = FilterChangerController(port="replay", baudrate=9600, serial_factory=replay.serial_factory(TRACE_DEVICE))
+    assert fc.connect()
+    return fc
+
+
+def test_replay_field_trace_faster_than_real_time():
+    replay = TraceReplay(FIELD_TRACE, speed=10)
+    fc = replay_controller(replay)
+    try:
+        assert fc.get_current_position() == 1
+        assert fc.move_to(3)
+        # 記録では約1秒かかった移動が、10倍速では約0.1秒で終わる
+        assert 0.08 < fc.last_move_duration < 0.5
+        assert fc.move_to(4)
+        assert fc.get_current_position() == 4
+        assert fc.ser.remaining == 0
+    finally:
+        fc.disconnect()
+    assert replay.mismatches == []
+
+
+def test_replay_keeps_recorded_reply_timing():
+    replay = TraceReplay(FIELD_TRACE, speed=4)
+    fc = replay_controller(replay)
+    try:
+        assert fc.get_current_position() == 1
+        assert fc.move_to(3)
+        assert 0.24 < fc.last_move_duration < 0.6
+    finally:
+        fc.disconnect()
+
+
+def test_replay_detects_protocol_change():
+    # 記録では最初に位置を問い合わせているため、いきなり移動すると食い違いになる
+    replay = TraceReplay(FIELD_TRACE, speed=math.inf)
+    fc = replay_controller(replay)
+    try:
+        assert not fc.move_to(3)
+        assert not fc._pending
+    finally:
+        fc.disconnect()
+    assert replay.mismatches == [Mismatch("serial", 0, b"F?\r\n", b"F3\r\n")]
+    assert str(replay.mismatches[0]) == "通信 0: 記録 'F?\\r\\n', 送信 'F3\\r\\n'"
+
+
+def test_replay_camera_uses_recorded_frames():
+    camera = TraceReplay(FIELD_TRACE, speed=math.inf).camera()
+    assert camera.shape == (8, 8)
+    frame = camera.capture(100)
+    assert frame.dtype.name == "uint16" and frame.shape == (8, 8) and frame.max() == 1200
+    assert camera.mismatches == [] and camera.remaining == 0
+    with pytest.raises(ReplayMismatch):
+        camera.capture(100)
+
+    camera = TraceReplay(FIELD_TRACE, speed=math.inf).camera()
+    camera.capture(250)
+    assert [str(m) for m in camera.mismatches] == ["撮影 0: 記録 100 ms, 再生 250 ms"]
+
+
+def test_recorder_keeps_one_session_per_file(tmp_path):
+    path = tmp_path / "session.jsonl"
+    TraceRecorder(path, port="first").close()
+    # 追記すると2回分の記録が混ざり、再生できなくなる
+    with pytest.raises(FileExistsError):
+        TraceRecorder(path, port="second")
+    assert load_trace(path)[0]["port"] == "first"
+
+
+@pytest.mark.parametrize("speed", [0, -1.0, math.nan])
+def test_replay_rejects_non_positive_speed(speed):
+    with pytest.raises(ValueError):
+        TraceReplay(FIELD_TRACE, speed=speed)
+
+
+def test_recorded_session_replays_identically(device, tmp_path):
+    path = tmp_path / "session.jsonl"
+    with TraceRecorder(path, port=device.port) as recorder:
+        fc = FilterChangerController(port=device.port, baudrate=9600,
+                                     serial_factory=recorder.serial_factory(TRACE_DEVICE))
+        assert fc.connect()
+        assert fc.move_to(5)
+        assert fc.get_current_position() == 5
+        fc.disconnect()
+    meta, events = load_trace(path)
+    assert meta["port"] == device.port
+    assert [e["data"] for e in events if e["dir"] == "tx"] == ["F5\r\n", "F?\r\n"]
+
+    replay = TraceReplay(path, speed=math.inf)
+    fc = replay_controller(replay)
+    try:
+        assert fc.move_to(5)
+        assert fc.get_current_position() == 5
+        assert fc.ser.sent == [b"F5\r\n", b"F?\r\n"]
+    finally:
+        fc.disconnect()
+    assert replay.mismatches == []
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from src.app.acquisition import AcquisitionEngine, AcquisitionError
+from src.app.batch import BatchRunner, parse_plan
+from src.app.journal import JOURNAL_NAME, AcquisitionJournal, incomplete_runs, load_journal
+from src.app.sequence_planner import SequenceStep
+from src.hardware.simulators import SimulatedCamera, SimulatedExcitationSource
+from src.storage.cube import CubeFrameWriter, CubeReader, CubeWriter
+
+STEPS = [SequenceStep("280nm", "400nm", 2), SequenceStep("280nm", "450nm", 3),
+         SequenceStep("310nm", "450nm", 3), SequenceStep("310nm", "500nm", 4)]
+FILTERS = {"2": "400nm", "3": "450nm", "4": "500nm"}
+
+
+class Filter:
+    def __init__(self, fail_at=None):
+        self.fail_at, self.moves = fail_at, []
+
+    def move_to(self, slot):
+        self.moves.append(slot)
+        return slot != self.fail_at
+
+
+def run_engine(tmp_path, filter_changer, completed=None, camera=None):
+    camera = camera or SimulatedCamera(shape=(8, 8))
+    writer = CubeFrameWriter.for_steps(tmp_path, STEPS, resume=bool(completed))
+    with AcquisitionJournal.in_directory(tmp_path) as journal:
+        engine = AcquisitionEngine(filter_changer, camera, SimulatedExcitationSource(), writer, journal=journal)
+        return engine.run(STEPS, 10, "s1", completed=completed), camera
+
+
+def test_journal_records_plan_steps_and_end(tmp_path):
+    run_engine(tmp_path, Filter())
+    (run,) = load_journal(tmp_path / JOURNAL_NAME)
+    assert run.sample_name == "s1" and run.steps == STEPS and run.exposures == [10] * 4
+    assert sorted(run.completed) == [0, 1, 2, 3] and run.finished
+    assert incomplete_runs(tmp_path / JOURNAL_NAME) == {}
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    run_engine(tmp_path, Filter())
+    path = tmp_path / JOURNAL_NAME
+    path.write_bytes(path.read_bytes()[:-10])
+    (run,) = load_journal(path)
+    assert not run.finished
+    assert sorted(run.completed) == [0, 1, 2, 3]
+
+
+def test_resume_after_failure_skips_saved_frames(tmp_path):
+    with pytest.raises(AcquisitionError):
+        run_engine(tmp_path, Filter(fail_at=4))
+    run = incomplete_runs(tmp_path / JOURNAL_NAME)["s1"]
+    assert run.pending == [3]
+    completed = {i: run.completed[i] for i in run.verified_completed()}
+    assert sorted(completed) == [0, 1, 2]
+
+    filter_changer = Filter()
+    report, camera = run_engine(tmp_path, filter_changer, completed=completed)
+    assert report.frames == 1 and camera.frames_captured == 1
+    assert filter_changer.moves == [4]
+    with CubeReader(tmp_path / "s1.fcube") as reader:
+        assert reader.complete
+        assert len(reader.available()) == 4
+    assert incomplete_runs(tmp_path / JOURNAL_NAME) == {}
+
+
+def test_frames_missing_from_disk_are_not_trusted(tmp_path):
+    with pytest.raises(AcquisitionError):
+        run_engine(tmp_path, Filter(fail_at=4))
+    # 最後に保存したバンドが途中で切れた状態を作る
+    cube = tmp_path / "s1.fcube"
+    with CubeReader(cube) as reader:
+        cut = max(entry["data_offset"] for entry in reader._index.values()) + 3
+    cube.write_bytes(cube.read_bytes()[:cut])
+    run = incomplete_runs(tmp_path / JOURNAL_NAME)["s1"]
+    assert run.verified_completed() == {0, 1}
+
+
+def test_cube_writer_resume_appends_to_closed_file(tmp_path):
+    path = tmp_path / "x.fcube"
+    frame = np.arange(12, dtype=np.uint16).reshape(3, 4)
+    with CubeWriter(path, ["a", "b"], ["x"], (3, 4)) as writer:
+        writer.write_band("a", "x", frame)
+    with CubeWriter.resume(path) as writer:
+        writer.write_band("b", "x", frame + 1)
+    with CubeReader(path) as reader:
+        assert reader.complete
+        np.testing.assert_array_equal(reader.band("a", "x"), frame)
+        np.testing.assert_array_equal(reader.band("b", "x"), frame + 1)
+
+
+def test_journal_syncs_in_batches(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr("src.app.journal.os.fsync", lambda fd: synced.append(fd))
+    with AcquisitionJournal(tmp_path / "j", sync_every=3, sync_interval=60) as journal:
+        journal.begin("s", STEPS, [1] * 4)
+        for i in range(6):
+            journal.step_done(i)
+        assert len(synced) == 3
+
+
+def test_batch_runner_resumes_incomplete_sample(tmp_path):
+    plan = parse_plan({"exposure_ms": 10, "optimize_order": False, "samples": [
+        {"name": "s1", "pairs": [[s.led, s.filter] for s in STEPS]}]})
+    with AcquisitionJournal.in_directory(tmp_path) as journal:
+        runner = BatchRunner(Filter(fail_at=4), SimulatedCamera(shape=(8, 8)), SimulatedExcitationSource(),
+                             FILTERS, tmp_path, journal=journal)
+        with pytest.raises(AcquisitionError):
+            runner.run(plan)
+    resume = incomplete_runs(tmp_path / JOURNAL_NAME)
+    camera = SimulatedCamera(shape=(8, 8))
+    with AcquisitionJournal.in_directory(tmp_path) as journal:
+        runner = BatchRunner(Filter(), camera, SimulatedExcitationSource(), FILTERS, tmp_path,
+                             journal=journal, resume=resume)
+        (result,) = runner.run(plan)
+    assert camera.frames_captured == result.report.frames == 1
+    with CubeReader(tmp_path / "s1.fcube") as reader:
+        assert len(reader.available()) == 4
@@ -0,0 +1,54 @@
+import time
+
+import numpy as np
+
+from src.app.live_view import FrameRingBuffer, LiveViewPipeline, contrast_stretch, downscale, to_pgm
+from src.hardware.simulators import SimulatedCamera
+
+
+def test_ring_buffer_keeps_newest_without_growing():
+    ring = FrameRingBuffer(3, (2, 2))
+    for value in range(10):
+        ring.push(np.full((2, 2), value))
+    seq, frame, _ = ring.latest()
+    assert seq == 9 and frame[0, 0] == 9
+    assert ring.frames.shape == (3, 2, 2)
+    assert ring.is_valid(8) and not ring.is_valid(6)
+
+
+def test_empty_ring_buffer_has_no_latest():
+    assert FrameRingBuffer(2, (2, 2)).latest() is None
+
+
+def test_downscale_and_stretch():
+    frame = np.arange(1000 * 1200, dtype=np.uint16).reshape(1000, 1200)
+    small = downscale(frame, 480, 640)
+    assert small.shape[0] <= 480 and small.shape[1] <= 640
+    image = contrast_stretch(small)
+    assert image.dtype == np.uint8
+    assert image.min() == 0 and image.max() == 255
+
+
+def test_to_pgm_header():
+    data = to_pgm(np.zeros((3, 5), dtype=np.uint8))
+    assert data.startswith(b"P5 5 3 255\n") and len(data) == len(b"P5 5 3 255\n") + 15
+
+
+def test_pipeline_shows_latest_and_counts_drops():
+    camera = SimulatedCamera(shape=(64, 80), readout_time=0.002)
+    pipeline = LiveViewPipeline(camera, 10, camera.shape, display_size=(32, 40))
+    pipeline.start()
+    try:
+        deadline = time.monotonic() + 2
+        shown = None
+        while shown is None and time.monotonic() < deadline:
+            shown = pipeline.next_display_frame()
+        assert shown is not None and shown.image.shape == (32, 40)
+        time.sleep(0.05)
+        later = pipeline.next_display_frame()
+        assert later is not None and later.seq > shown.seq
+        assert pipeline.frames_dropped > 0
+        assert pipeline.latency is not None
+    finally:
+        pipeline.stop()
+    assert not pipeline.running
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from src.analysis.preprocessing import CalibrationCache, Preprocessor
+
+SHAPE = (8, 10)
+
+
+def make_cache():
+    cache = CalibrationCache()
+    # バイアス100、暗電流 0.1カウント/ms
+    cache.add_dark(100, np.full((3,) + SHAPE, 110, dtype=np.uint16))
+    cache.add_dark(1000, np.full(SHAPE, 200, dtype=np.uint16))
+    vignette = np.ones(SHAPE, dtype=np.float32)
+    vignette[:, :5] = 0.5
+    cache.add_flat(2, (vignette * 1000 + 200).astype(np.uint16), 1000)
+    return cache, vignette
+
+
+def test_dark_is_interpolated_and_cached():
+    cache, _ = make_cache()
+    dark = cache.dark(500)
+    assert dark[0, 0] == pytest.approx(150)
+    assert cache.dark(500) is dark
+
+
+def test_derived_darks_are_bounded():
+    cache, _ = make_cache()
+    # 自動露光のように露光時間が毎回違っても、保持するダークは上限までに限る
+    first, oldest = cache.dark(200.5), cache.dark(300.0)
+    for i in range(1, 50):
+        cache.dark(300 + i * 0.1)
+        assert cache.dark(200.5) is first  # 最近使ったものは残る
+    assert len(cache._derived_darks) == cache.max_derived_darks
+    assert cache.dark(300.0) is not oldest
+    np.testing.assert_array_equal(cache.dark(300.0), oldest)
+
+
+def test_corrects_dark_flat_and_exposure():
+    cache, vignette = make_cache()
+    scene = np.full(SHAPE, 3.0, dtype=np.float32)  # 1msあたり3カウント
+    raw = (scene * vignette * 500 + 150).astype(np.uint16)
+    result = Preprocessor(cache).process_frame(raw, 500, 2)
+    assert result.dtype == np.float32
+    # フラットは平均1に正規化されるため、結果は場面の明るさ×ケラレの平均になる
+    np.testing.assert_allclose(result, 3.0 * vignette.mean(), rtol=1e-2)
+
+
+def test_stack_uses_per_frame_settings_and_given_output():
+    cache, _ = make_cache()
+    stack = np.stack([np.full(SHAPE, 210, np.uint16), np.full(SHAPE, 1200, np.uint16)])
+    out = np.empty(stack.shape, dtype=np.float32)
+    result = Preprocessor(cache).process_stack(stack, [100, 1000], [None, None], out=out)
+    assert result is out
+    np.testing.assert_allclose(result[0], 1.0)
+    np.testing.assert_allclose(result[1], 1.0)
+
+
+def test_negative_values_are_clipped():
+    cache, _ = make_cache()
+    result = Preprocessor(cache).process_frame(np.zeros(SHAPE, np.uint16), 100)
+    assert result.min() == 0
+
+
+def test_save_and_load(tmp_path):
+    cache, _ = make_cache()
+    cache.save(tmp_path / "calib.npz")
+    loaded = CalibrationCache.load(tmp_path / "calib.npz")
+    assert loaded.dark_exposures == [100.0, 1000.0]
+    np.testing.assert_array_equal(loaded.inverse_flat(2), cache.inverse_flat(2))
+
+
+def test_missing_dark_raises():
+    with pytest.raises(KeyError):
+        CalibrationCache().dark(100)
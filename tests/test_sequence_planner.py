@@ -0,0 +1,38 @@
+import pytest
+
+from src.app.sequence_planner import MoveCostModel, plan_sequence
+
+FILTERS = {"1": "350nm", "2": "400nm", "3": "450nm", "4": "500nm",
+           "5": "550nm", "6": "600nm", "7": "Empty", "8": "Empty"}
+
+
+def test_groups_by_filter_and_walks_wheel_in_order():
+    pairs = [("280nm", "600nm"), ("310nm", "400nm"), ("280nm", "400nm"),
+             ("310nm", "600nm"), ("280nm", "500nm")]
+    plan = plan_sequence(pairs, FILTERS, start_position=1)
+    assert [s.slot for s in plan.steps] == [2, 2, 4, 6, 6]
+    assert plan.estimated_time < plan.naive_time
+    assert plan.saving == pytest.approx(plan.naive_time - plan.estimated_time)
+
+
+def test_uses_wraparound_when_shorter():
+    pairs = [("280nm", "350nm"), ("280nm", "600nm")]
+    plan = plan_sequence(pairs, FILTERS, start_position=8)
+    assert [s.slot for s in plan.steps] == [1, 6]
+
+
+def test_keeps_current_led_first_within_group():
+    pairs = [("280nm", "450nm"), ("340nm", "450nm"), ("340nm", "500nm"), ("310nm", "500nm")]
+    plan = plan_sequence(pairs, FILTERS, start_position=3)
+    assert [s.led for s in plan.steps] == ["280nm", "340nm", "340nm", "310nm"]
+
+
+def test_plan_contains_every_pair():
+    pairs = [("280nm", f) for f in ("600nm", "350nm", "500nm")] * 2
+    plan = plan_sequence(pairs, FILTERS, cost_model=MoveCostModel(slot_move_time=1.0))
+    assert sorted((s.led, s.filter) for s in plan.steps) == sorted(pairs)
+
+
+def test_unknown_filter_is_rejected():
+    with pytest.raises(ValueError):
+        plan_sequence([("280nm", "700nm")], FILTERS)
@@ -0,0 +1,63 @@
+import json
+import logging
+import time
+
+import pytest
+
+from src.utils.tracing import Tracer, TraceLogHandler, summarize_file
+
+
+def test_span_records_duration_and_status():
+    tracer = Tracer()
+    with tracer.span("fc.command", command="F?"):
+        time.sleep(0.01)
+    with pytest.raises(RuntimeError):
+        with tracer.span("fc.command", command="F1"):
+            raise RuntimeError
+    events = tracer.events_since(0, kind="span")
+    assert [e["status"] for e in events] == ["ok", "error"]
+    assert events[0]["command"] == "F?" and events[0]["duration_ms"] >= 10
+
+
+def test_histogram_and_summary():
+    tracer = Tracer()
+    for ms in (0.05, 3, 3, 700):
+        tracer.record_span("fc.move", ms / 1000)
+    counts = dict(tracer.histogram("fc.move"))
+    assert counts[0.1] == 1 and counts[5] == 2 and counts[1000] == 1
+    summary = tracer.latency_summary("fc.move")
+    assert summary["count"] == 4 and summary["max"] == pytest.approx(700)
+    assert "fc.move" in tracer.report()
+
+
+def test_ring_buffer_is_bounded_and_incremental():
+    tracer = Tracer(capacity=5)
+    for i in range(8):
+        tracer.log(f"m{i}")
+    assert [e["message"] for e in tracer.events_since(0)] == ["m3", "m4", "m5", "m6", "m7"]
+    assert [e["message"] for e in tracer.events_since(tracer.last_seq - 1)] == ["m7"]
+    assert tracer.events_since(tracer.last_seq) == []
+    assert [e["message"] for e in tracer.events_since(4)] == ["m4", "m5", "m6", "m7"]
+
+
+def test_logging_messages_are_captured():
+    tracer = Tracer()
+    logger = logging.getLogger("test_tracing.capture")
+    logger.addHandler(TraceLogHandler(tracer))
+    logger.setLevel(logging.INFO)
+    logger.info("接続しました")
+    logger.debug("表示されない")
+    events = tracer.events_since(0, kind="log")
+    assert [(e["level"], e["message"]) for e in events] == [("INFO", "接続しました")]
+
+
+def test_jsonl_file_and_summary(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracer = Tracer()
+    tracer.enable_file(path)
+    tracer.record_span("camera.capture", 0.1, exposure_ms=100)
+    tracer.log("hello")
+    tracer.disable_file()
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [e["kind"] for e in lines] == ["span", "log"]
+    assert summarize_file(path)["camera.capture"]["count"] == 1